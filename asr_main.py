@@ -4,21 +4,24 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
 from src.tasks import ASRTask
-from src.evaluation import compute_bootstrap_wer
+from src.evaluation import ErrorRateAccumulator
+from src.models.encoder_cache import EncoderOutputCache
 from espnet2.torch_utils.model_summary import model_summary
 
 import os
 import sys
 import yaml
 import random
+import shutil
 import argparse
+import pandas as pd
 from tqdm import tqdm
 from colorama import Fore
 from pathlib import Path
 
 import torch
 import torch.nn as nn
-from torch.cuda.amp import GradScaler, autocast
+from torch.nn.parallel import DistributedDataParallel as DDP
 
 from src.utils import *
 from src.transforms import *
@@ -27,41 +30,106 @@ from torchvision import transforms
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
 
-def training(e2e, train_loader, optimizer, scheduler, accum_grad, scaler=None):
+def forward_backward(e2e, batch, weight, accumulator, batch_transforms=None, amp_dtype=None, device_batch=None):
+    """
+      Forward and backward of a micro-batch. When it runs out of GPU memory, its two halves are retried one after the other,
+      which accumulates the same gradients, unless the backward had started: its partial gradients are then discarded along with
+      the gradients and losses of the previous micro-batches of the step. In distributed training, the processes would fall out of step,
+      so the error is raised.
+      'device_batch' is the batch already moved to the device, if any.
+    """
+    device_type = torch.device(config.device).type
+    if device_batch is None:
+        device_batch = {k: v.to(device=config.device, non_blocking=True) if hasattr(v, 'to') else v for k, v in batch.items()}
+    if batch_transforms is not None:
+        device_batch['speech'], device_batch['speech_lengths'] = batch_transforms(device_batch['speech'], device_batch['speech_lengths'])
+
+    loss = None
+    try:
+        # -- forward
+        with torch.autocast(device_type, dtype=amp_dtype, enabled=amp_dtype is not None):
+            loss = e2e(**device_batch)[0]
+
+        # -- backward
+        accumulator.backward(loss, weight)
+        return
+    except torch.cuda.OutOfMemoryError:
+        if isinstance(e2e, DDP) or len(batch['sample_id']) == 1:
+            raise
+        partial_grads = loss is not None
+
+    # -- the activations of the failed attempt are released outside the except block, which holds on to them
+    del device_batch, loss
+    n_discarded = accumulator.reset() if partial_grads else 0
+    torch.cuda.empty_cache()
+    print(f"\nOut of memory with a batch of {len(batch['sample_id'])} utterances, retrying it in two halves")
+    if n_discarded > 0:
+        print(f"The backward had started, so the {n_discarded} micro-batch(es) already accumulated in this optimizer step were discarded")
+
+    for part in split_batch(batch):
+        forward_backward(e2e, part, accumulator.part_weight(part, batch, weight), accumulator, batch_transforms, amp_dtype)
+
+def training(e2e, train_loader, optimizer, scheduler, accum_grad, scaler=None, batch_transforms=None, start_batch=0, train_loss=(0.0, 0.0), batch_rng=None, checkpoint_fn=None, profiler=None):
     e2e.train()
+    save_every_steps = config.training_settings.get('save_every_steps', None)
+    amp_dtype = get_amp_dtype(config)
+
+    # -- micro-batches weighted by their number of tokens, and optimizer steps every accum_grad of them
+    accumulator = GradientAccumulator(
+        e2e, optimizer, scheduler, accum_grad, len(train_loader),
+        scaler=scaler,
+        grad_clip=config.training_settings.get('grad_clip', -1.0),
+        weighting=config.training_settings.get('loss_weighting', 'tokens'),
+        loss_sum=train_loss[0],
+        weight_sum=train_loss[1],
+        device=config.device,
+        profiler=profiler,
+    )
+
+    # -- per-stage timings of the forward
+    model = e2e.module if isinstance(e2e, DDP) else e2e
+    model.set_stage_timer(profiler)
+
+    # -- resuming an interrupted epoch: its first batches are skipped by the sampler
+    train_loader.batch_sampler.start_batch = start_batch
+    batches = iter(DevicePrefetcher(train_loader, config.device, profiler))
+    if batch_rng is not None:
+        set_rng_state(batch_rng)
+        split_rng_streams()
+    if profiler is not None:
+        batches = profiler.data_wait(batches)
 
     # -- training
-    train_loss = 0.0
     optimizer.zero_grad()
-    for batch_idx, batch in enumerate(tqdm(train_loader, position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.GREEN, Fore.RESET))):
-        batch = {k: v.to(device=config.device, non_blocking=True) if hasattr(v, 'to') else v for k, v in batch.items()}
-
-        # -- forward
-        loss = e2e(**batch)[0] / config.training_settings['accum_grad']
-
-        # -- backward
-        loss.backward()
+    for batch_idx, (batch, device_batch) in enumerate(tqdm(batches, initial=start_batch, total=len(train_loader), position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.GREEN, Fore.RESET)), start=start_batch):
+        # -- forward and backward, the host batch being kept in case it has to be split
+        with accumulator.micro_step(batch_idx):
+            forward_backward(e2e, batch, accumulator.weight(batch), accumulator, batch_transforms, amp_dtype, device_batch)
 
         # -- update
-        if ((batch_idx+1) % accum_grad == 0) or (batch_idx+1 == len(train_loader)):
-            optimizer.step()
-            if scheduler is not None:
-                scheduler.step()
-            optimizer.zero_grad()
+        if accumulator.is_update(batch_idx):
+            accumulator.step()
+
+            # -- -- mid-epoch training state, saved right after an update so no gradient is pending
+            if checkpoint_fn is not None and save_every_steps and ((batch_idx+1) // accum_grad) % save_every_steps == 0 and batch_idx+1 < len(train_loader):
+                checkpoint_fn(batch_idx+1, accumulator.state())
 
-        train_loss += loss.item()
+        if profiler is not None:
+            profiler.end_step(batch, batch_idx)
 
-    return train_loss / (len(train_loader) / accum_grad)
+    model.set_stage_timer(None)
+    return accumulator.average_loss()
 
-def validation(e2e, data_loader):
+def validation(e2e, data_loader, batch_transforms=None):
     e2e.eval()
     data_loss = 0.0
     data_cer = 0.0
 
     # -- validation
     with torch.no_grad():
-        for batch in tqdm(data_loader, position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.BLUE, Fore.RESET)):
-            batch = {k: v.to(device=config.device, non_blocking=True) if hasattr(v, 'to') else v for k, v in batch.items()}
+        for _, batch in tqdm(DevicePrefetcher(data_loader, config.device), position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.BLUE, Fore.RESET)):
+            if batch_transforms is not None:
+                batch['speech'], batch['speech_lengths'] = batch_transforms(batch['speech'], batch['speech_lengths'])
 
             # -- forward
             loss, stats, weight = e2e(**batch)
@@ -69,52 +137,63 @@ def validation(e2e, data_loader):
             data_loss += loss.item()
             data_cer += stats["cer_ctc"].item() * 100.0
 
-    return round(data_loss / len(data_loader), 3), round(data_cer / len(data_loader), 3)
+    # -- each process evaluates a shard of the data in distributed training
+    data_loss, data_cer, n_batches = all_reduce_sum([data_loss, data_cer, len(data_loader)], config.device)
+    return round(data_loss / n_batches, 3), round(data_cer / n_batches, 3)
 
-def inference(output_dir, speech2text, eval_loader, dataset):
-    print(f"Decoding {dataset.upper()} dataset:")
+LANG_MAPPING = {'<EU>': 0, '<ES>': 1, '<BI>': 2}
 
+def decode(speech2text, eval_loader, dst_path, batch_transforms=None, position=0):
     # -- obtaining hypothesis
     lang_preds = []
     lang_refs = []
-    lang_mapping = {'<EU>': 0, '<ES>': 1, '<BI>': 2}
+    error_rates = ErrorRateAccumulator()
 
-    dst_dir = os.path.join(output_dir, "inference/")
-    os.makedirs(dst_dir, exist_ok=True)
-    dst_path = os.path.join(dst_dir, dataset+".inf")
     with open(dst_path, "w") as f:
         with torch.no_grad():
-            for batch in tqdm(eval_loader, position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.YELLOW, Fore.RESET)):
-                result = speech2text(torch.squeeze(batch['speech'], 0))
+            progress = tqdm(eval_loader, position=position, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.YELLOW, Fore.RESET))
+            for batch in progress:
+                if batch_transforms is not None:
+                    speech, speech_lengths = batch['speech'].to(speech2text.device), batch['speech_lengths'].to(speech2text.device)
+                    batch['speech'], batch['speech_lengths'] = batch_transforms(speech, speech_lengths)
+                results = speech2text(batch['speech'], batch['speech_lengths'], paths=batch['path'])
 
-                hyp = result[0][0]
+                for i, result in enumerate(results):
+                    hyp = result[0]
 
-                if args.output_for_submission:
-                    sample_id = batch['sample_id'][0]
-                    with open(args.output_for_submission, 'a', encoding='utf-8') as f:
-                        f.write(f'{sample_id} {hyp.strip()}\n')
+                    if args.output_for_submission:
+                        sample_id = batch['sample_id'][i]
+                        with open(args.output_for_submission, 'a', encoding='utf-8') as f_sub:
+                            f_sub.write(f'{sample_id} {hyp.strip()}\n')
 
-                else:
-                    # -- dumping results
-                    f.write(batch['ref'][0].strip() + "#" + hyp.strip() + "\n")
-
-                    # -- language identification
-                    lang_hyp = result[0][-1]
-                    lang_ref = batch['language'][0]
-                    if lang_hyp is not None:
-                        lang_preds.append( lang_mapping[lang_hyp] )
                     else:
-                        lang_choices = list(set(lang_mapping.values()) - set([lang_mapping[lang_ref]]))
-                        lang_preds.append( random.sample(lang_choices, 1)[0] )
+                        # -- dumping results
+                        f.write(batch['ref'][i].strip() + "#" + hyp.strip() + "\n")
+                        error_rates.add(batch['ref'][i].strip(), hyp.strip())
+
+                        # -- language identification
+                        lang_hyp = result[-1]
+                        lang_ref = batch['language'][i]
+                        if lang_hyp is not None:
+                            lang_preds.append( LANG_MAPPING[lang_hyp] )
+                        else:
+                            lang_choices = list(set(LANG_MAPPING.values()) - set([LANG_MAPPING[lang_ref]]))
+                            lang_preds.append( random.sample(lang_choices, 1)[0] )
+
+                        lang_refs.append( LANG_MAPPING[lang_ref] )
 
-                    lang_refs.append( lang_mapping[lang_ref] )
+                if not args.output_for_submission:
+                    progress.set_postfix(wer=error_rates.wer)
 
+    return lang_refs, lang_preds, error_rates
+
+def report(dst_path, lang_refs, lang_preds, error_rates):
     if args.output_for_submission:
         print("You can check the output for the challenge submission in {args.output_for_submission}!")
     else:
         # -- computing WER
         lang_acc = accuracy_score(lang_refs, lang_preds)
-        wer, cer, ci_wer, ci_cer = compute_bootstrap_wer(dst_path)
+        wer, cer, ci_wer, ci_cer = error_rates.summary()
         report_wer = "%WER: " + str(wer) + " ± " + str(ci_wer); print(f"\n{report_wer}")
         report_cer = "%CER: " + str(cer) + " ± " + str(ci_cer); print(report_cer)
         report_lid = "%LID: " + str(lang_acc); print(report_lid)
@@ -125,9 +204,104 @@ def inference(output_dir, speech2text, eval_loader, dataset):
 
     # -- computing confusion matrix
     cm = confusion_matrix(lang_refs, lang_preds)
-    cm_display = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=list(lang_mapping.keys()))
+    cm_display = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=list(LANG_MAPPING.keys()))
     cm_display.plot().figure_.savefig(dst_path.replace(".inf", ".png"))
 
+def inference(output_dir, speech2text, eval_loader, dataset, batch_transforms=None):
+    print(f"Decoding {dataset.upper()} dataset:")
+
+    dst_dir = os.path.join(output_dir, "inference/")
+    os.makedirs(dst_dir, exist_ok=True)
+    dst_path = os.path.join(dst_dir, dataset+".inf")
+
+    lang_refs, lang_preds, error_rates = decode(speech2text, eval_loader, dst_path, batch_transforms)
+    report(dst_path, lang_refs, lang_preds, error_rates)
+
+def decode_shard(rank, shard_args, shard_config, shard_path, dst_path, num_threads):
+    global args, config
+    args, config = shard_args, shard_config
+
+    # -- each worker holds its own model copy with a bounded number of intra-op threads
+    torch.set_num_threads(num_threads)
+
+    tokenizer, converter = get_tokenizer_converter(config)
+    _, eval_audio_transforms, _, eval_batch_transforms = get_audio_transforms(args, config)
+    speech2text = build_speech2text(args, config)
+
+    # -- the pool workers are daemonic and cannot start dataloader workers, which would also exceed the thread budget
+    eval_loader = get_dataloader(config, dataset_path=shard_path, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=False, batch_size=config.inference_conf.get('batch_size', 1), num_workers=0)
+
+    return decode(speech2text, eval_loader, dst_path, eval_batch_transforms, position=rank)
+
+def sharded_inference(output_dir, dataset, num_jobs, num_threads=None):
+    eval_dataset = pd.read_csv(args.test_dataset, delimiter=',')
+    num_jobs = max(1, min(num_jobs, len(eval_dataset)))
+    print(f"Decoding {dataset.upper()} dataset with {num_jobs} processes:")
+
+    dst_dir = os.path.join(output_dir, "inference/")
+    shard_dir = os.path.join(dst_dir, dataset+"_shards/")
+    os.makedirs(shard_dir, exist_ok=True)
+    dst_path = os.path.join(dst_dir, dataset+".inf")
+    if num_threads is None:
+        num_threads = max(1, os.cpu_count() // num_jobs)
+
+    # -- splitting the evaluation CSV into contiguous shards, so merging them keeps the original order
+    shard_size = -(-len(eval_dataset) // num_jobs)
+    shards = []
+    for rank in range(num_jobs):
+        shard_args = argparse.Namespace(**vars(args))
+        if args.output_for_submission:
+            shard_args.output_for_submission = os.path.join(shard_dir, f"submission.{rank}")
+            open(shard_args.output_for_submission, "w").close()
+        shard_path = os.path.join(shard_dir, f"{dataset}.{rank}.csv")
+        eval_dataset[rank * shard_size:(rank + 1) * shard_size].to_csv(shard_path, index=False)
+        shards.append( (rank, shard_args, config, shard_path, os.path.join(shard_dir, f"{dataset}.{rank}.inf"), num_threads) )
+
+    with torch.multiprocessing.get_context("spawn").Pool(num_jobs) as pool:
+        results = pool.starmap(decode_shard, shards)
+
+    # -- merging the shards in order
+    lang_refs, lang_preds, error_rates = [], [], ErrorRateAccumulator()
+    with open(dst_path, "w") as f:
+        for shard, (shard_lang_refs, shard_lang_preds, shard_error_rates) in zip(shards, results):
+            with open(shard[4], "r") as f_shard:
+                f.write(f_shard.read())
+            lang_refs.extend(shard_lang_refs)
+            lang_preds.extend(shard_lang_preds)
+            error_rates.update(shard_error_rates)
+
+    if args.output_for_submission:
+        with open(args.output_for_submission, 'a', encoding='utf-8') as f_sub:
+            for shard in shards:
+                with open(shard[1].output_for_submission, 'r', encoding='utf-8') as f_shard:
+                    f_sub.write(f_shard.read())
+
+    # -- the shard CSVs, hypotheses and submissions are no longer needed once merged
+    shutil.rmtree(shard_dir)
+
+    report(dst_path, lang_refs, lang_preds, error_rates)
+
+def get_audio_transforms(args, config):
+    if config.training_settings.get('batch_augmentation', False):
+        # -- -- applied to the padded batches on the model device instead of per sample in the dataloader workers
+        train_audio_transforms, eval_audio_transforms = None, None
+        train_batch_transforms = BatchCompose([
+            BatchSpeedRate(sample_rate=16000),
+        ])
+        eval_batch_transforms = BatchCompose([
+            BatchAddNoise(noise_path=args.noise, sample_rate=16000, snr_target=args.snr_target),
+        ])
+    else:
+        train_audio_transforms = Compose([
+            SpeedRate(sample_rate=16000),
+        ])
+        eval_audio_transforms = Compose([
+            AddNoise(noise_path=args.noise, sample_rate=16000, snr_target=args.snr_target),
+        ])
+        train_batch_transforms, eval_batch_transforms = None, None
+
+    return train_audio_transforms, eval_audio_transforms, train_batch_transforms, eval_batch_transforms
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Automatic Audio-Visual Speech Recognition System.",
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -141,10 +315,11 @@ if __name__ == "__main__":
     parser.add_argument("--mode", default="both", type=str, help="Choose: 'training', 'inference' or 'both'")
     parser.add_argument("--mask", default="none", type=str, help="Choose: 'audio', 'video' or 'none'")
     parser.add_argument("--snr-target", default=9999, type=int, help="A specific signal-to-noise rate when adding noise to the audio waveform.")
-    parser.add_argument("--noise", default="./src/noise/babble_noise.wav", type=str, help="Path to .wav file of noise")
+    parser.add_argument("--noise", nargs='+', default="./src/noise/babble_noise.wav", type=str, help="Path(s) to .wav file(s) of noise, each noisy sample draws its noise from one of them")
 
     parser.add_argument("--config-file", required=True, type=str, help="Path to a config file that specifies the AVSR model architecture")
     parser.add_argument("--load-checkpoint", default="", type=str, help="Path to load a pretrained AVSR model")
+    parser.add_argument("--resume-training", default="", type=str, help="Path to a training_state.pth file from which an interrupted training is resumed, even mid-epoch")
 
     parser.add_argument("--load-modules", nargs='+', default=["entire-e2e"], type=str, help="Choose which parts of the model you want to load: 'entire-e2e', 'frontend', 'encoder' or 'decoder'")
     parser.add_argument("--freeze-modules", nargs='+', default=["no-frozen"], type=str, help="Choose which parts of the model you want to freeze: 'no-frozen', 'frontend', 'encoder' or 'decoder'")
@@ -154,8 +329,15 @@ if __name__ == "__main__":
     parser.add_argument("--output-dir", required=True, type=str, help="Path to save the fine-tuned model and its inference hypothesis")
     parser.add_argument("--output-name", required=True, type=str, help="Name of the file where the hypothesis and results will be write down.")
     parser.add_argument("--output-for-submission", default='', type=str, help='Specified output path if you want the expected output for the challenge submission')
+    parser.add_argument("--decode-jobs", default=1, type=int, help="Number of processes decoding shards of the test set in parallel, each one with its own model copy")
+    parser.add_argument("--encoder-cache-dir", default="", type=str, help="Directory of an on-disk cache of the encoder outputs, reused across decodings of the same checkpoint and SNR (single-process decoding only, i.e. --decode-jobs 1)")
+    parser.add_argument("--encoder-cache-gb", default=16.0, type=float, help="Maximum size in GB of the encoder cache, the least recently used outputs are evicted")
+    parser.add_argument("--decode-threads", default=None, type=int, help="Number of intra-op threads of each decoding process (by default, the CPU cores split among the processes)")
 
     args = parser.parse_args()
+    if args.encoder_cache_dir and args.decode_jobs > 1:
+        # -- the shards would overwrite each other's index of the cache
+        parser.error("--encoder-cache-dir is only supported with single-process decoding (--decode-jobs 1)")
 
     # -- configuration architecture details
     config_file = Path(args.config_file)
@@ -171,12 +353,10 @@ if __name__ == "__main__":
     tokenizer, converter = get_tokenizer_converter(config)
 
     # -- audio preprocessing
-    train_audio_transforms = Compose([
-        SpeedRate(sample_rate=16000),
-    ])
-    eval_audio_transforms = Compose([
-        AddNoise(noise_path=args.noise, sample_rate=16000, snr_target=args.snr_target),
-    ])
+    train_audio_transforms, eval_audio_transforms, train_batch_transforms, eval_batch_transforms = get_audio_transforms(args, config)
+
+    # -- distributed data-parallel training when launched with torchrun
+    rank, world_size = init_distributed(config)
 
     # -- training
     if args.mode in ["training", "both"]:
@@ -188,57 +368,162 @@ if __name__ == "__main__":
         )
         print(model_summary(e2e))
 
-        # -- -- loading the AVSR end-to-end system from a checkpoint
-        load_e2e(e2e, args.load_modules, args.load_checkpoint, config)
+        # -- -- resuming an interrupted training, or loading the AVSR end-to-end system from a checkpoint
+        resume_state = None
+        if args.resume_training:
+            resume_state = load_training_state(args.resume_training)
+            set_rng_state(resume_state['loader_rng'])
+        else:
+            load_e2e(e2e, args.load_modules, args.load_checkpoint, config)
 
         # -- -- freezing modules of the AVSR end-to-end system
         freeze_e2e(e2e, args.freeze_modules, config)
 
         # -- -- creating dataloaders
-        train_loader = get_dataloader(config, dataset_path=args.training_dataset, audio_transforms=train_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=True)
-        val_loader = get_dataloader(config, dataset_path=args.validation_dataset, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=False)
+        loader_rng = get_rng_state()
+        train_loader = get_dataloader(config, dataset_path=args.training_dataset, audio_transforms=train_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=True, num_replicas=world_size, rank=rank)
+        val_loader = get_dataloader(config, dataset_path=args.validation_dataset, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=False, num_replicas=world_size, rank=rank)
         test_loader = get_dataloader(config, dataset_path=args.test_dataset, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=False)
 
         # -- -- optimizer and scheduler
         optimizer, scheduler = set_optimizer(config, e2e, train_loader)
+        scaler = get_grad_scaler(config)
+
+        # -- -- checkpoints are written in the background while the next epoch trains
+        checkpoint_writer = None
+        if config.training_settings.get('async_checkpoints', True) and rank == 0:
+            checkpoint_writer = AsyncCheckpointWriter(max_pending=config.training_settings.get('checkpoint_queue', 2))
+
+        # -- -- per-step stage timings and throughput of the first process, optionally with a torch.profiler trace
+        profiler = None
+        if config.training_settings.get('profiling', None) and rank == 0:
+            frontend_conf = config.frontend_conf if config.frontend_conf is not None else {}
+            profiler = TrainingProfiler(
+                os.path.join(args.output_dir, f"profile.{config.training_settings['profiling']}"),
+                config.device,
+                fs=frontend_conf.get('fs', 16000),
+                trace_window=config.training_settings.get('profiler_trace', None),
+                trace_dir=os.path.join(args.output_dir, "profiler_trace"),
+            )
+
+        # -- -- restoring the weights, the optimizer and scheduler states and the position in the epoch
+        start_epoch, start_batch, train_loss, batch_rng = 1, 0, (0.0, 0.0), None
+        val_stats = []
+        if resume_state is not None:
+            restore_training_state(resume_state, e2e, optimizer, scheduler, scaler)
+            if resume_state['sampler'] is not None:
+                train_loader.batch_sampler.load_state_dict(resume_state['sampler'])
+            if resume_state['epoch_rng'] is not None:
+                set_rng_state(resume_state['epoch_rng'])
+            start_epoch, start_batch = resume_state['epoch'], resume_state['batch_idx']
+            train_loss, batch_rng = resume_state['train_loss'], resume_state['batch_rng']
+            val_stats = resume_state['val_stats']
+            print(f"\nResuming the training from epoch {start_epoch}, batch {start_batch}")
+
+        # -- -- the dataloaders are built from the shared RNG states, the rest of the training draws its own randomness in each process
+        split_rng_streams()
+
+        # -- -- replicating the model across processes, the first one being the only one that saves checkpoints
+        train_e2e = e2e
+        if world_size > 1:
+            train_e2e = DDP(
+                e2e,
+                device_ids=[torch.device(config.device).index] if torch.device(config.device).type == 'cuda' else None,
+                find_unused_parameters=config.training_settings.get('find_unused_parameters', False),
+            )
 
         # -- -- training process
-
-        # e = 0
-        # spe = 20973
-        # for e in range(e*spe):
-        #     optimizer.step()
-
-        val_stats = []
         print("\nTRAINING PHASE\n")
-        scaler = GradScaler if config.training_settings['use_amp'] else None
-        for epoch in range(1, config.training_settings['epochs']+1):
-            train_loss = training(e2e, train_loader, optimizer, scheduler, config.training_settings['accum_grad'], scaler)
-            val_loss, val_cer = validation(e2e, val_loader)
+        for epoch in range(start_epoch, config.training_settings['epochs']+1):
+            if epoch > start_epoch:
+                start_batch, train_loss, batch_rng = 0, (0.0, 0.0), None
+                if config.training_settings['balanced_finetuning']:
+                    sync_rng_state()
+                    loader_rng = get_rng_state()
+                    train_loader = get_dataloader(config, dataset_path=args.training_dataset, audio_transforms=train_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=True, num_replicas=world_size, rank=rank)
+                    split_rng_streams()
+
+            # -- -- -- states the epoch starts from, which a mid-epoch resume replays
+            epoch_progress = {
+                'epoch': epoch,
+                'loader_rng': loader_rng,
+                'epoch_rng': get_rng_state(),
+                'sampler': train_loader.batch_sampler.state_dict(),
+                'val_stats': list(val_stats),
+            }
+            checkpoint_fn = None
+            if rank == 0:
+                checkpoint_fn = lambda batch_idx, loss: save_training_state(args.output_dir, e2e, optimizer, scheduler, scaler, {**epoch_progress, 'batch_idx': batch_idx, 'train_loss': loss, 'batch_rng': get_rng_state()}, checkpoint_writer)
+
+            if profiler is not None:
+                profiler.start(epoch)
+            train_loss = training(train_e2e, train_loader, optimizer, scheduler, config.training_settings['accum_grad'], scaler, train_batch_transforms, start_batch, train_loss, batch_rng, checkpoint_fn, profiler)
+            val_loss, val_cer = validation(e2e, val_loader, eval_batch_transforms)
 
             print(f"Epoch {epoch}: TRAIN LOSS={train_loss} || VAL LOSS={val_loss} | VAL CER={val_cer}%")
-            dst_check_path = save_model(args.output_dir, e2e, str(epoch).zfill(3))
+            if profiler is not None:
+                print(f"Epoch {epoch}: THROUGHPUT {profiler.epoch_summary()}")
+            if rank != 0:
+                continue
+
+            dst_check_path = save_model(args.output_dir, e2e, str(epoch).zfill(3), checkpoint_writer)
             val_stats.append( (dst_check_path, val_cer) )
 
+            # -- -- -- the next epoch starts from the current states, or from a new balanced loader
+            next_epoch_rng, sampler_state = get_rng_state(), train_loader.batch_sampler.state_dict()
             if config.training_settings['balanced_finetuning']:
-                train_loader = get_dataloader(config, dataset_path=args.training_dataset, audio_transforms=train_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=True)
-
-        # -- -- computing average model
-        save_val_stats(args.output_dir, val_stats)
-        sorted_val_stats = sorted(val_stats, key=lambda x: x[1])
-        # check_paths = [check_path for check_path, cer in sorted_val_stats[:config.training_settings['average_epochs']]]
-        check_paths = [check_path for check_path, val_cer in val_stats[-config.training_settings['average_epochs']:]]
-        average_model(e2e, check_paths)
-        save_model(args.output_dir, e2e, "average")
+                loader_rng, next_epoch_rng, sampler_state = next_epoch_rng, None, None
+            save_training_state(args.output_dir, e2e, optimizer, scheduler, scaler, {
+                'epoch': epoch+1,
+                'batch_idx': 0,
+                'train_loss': (0.0, 0.0),
+                'loader_rng': loader_rng,
+                'epoch_rng': next_epoch_rng,
+                'batch_rng': None,
+                'sampler': sampler_state,
+                'val_stats': list(val_stats),
+            }, checkpoint_writer)
+
+        if rank == 0:
+            # -- -- waiting for the checkpoints to be on disk before averaging them
+            if checkpoint_writer is not None:
+                checkpoint_writer.close()
+            if profiler is not None:
+                profiler.close()
+
+            # -- -- computing average model
+            save_val_stats(args.output_dir, val_stats)
+            sorted_val_stats = sorted(val_stats, key=lambda x: x[1])
+            # check_paths = [check_path for check_path, cer in sorted_val_stats[:config.training_settings['average_epochs']]]
+            check_paths = [check_path for check_path, val_cer in val_stats[-config.training_settings['average_epochs']:]]
+            average_model(e2e, check_paths)
+            save_model(args.output_dir, e2e, "average")
+
+    # -- the first process alone decodes the test set
+    destroy_distributed()
 
     # -- inference
-    if args.mode in ["inference", "both"]:
+    if args.mode in ["inference", "both"] and rank == 0:
         print("\nINFERENCE PHASE\n")
 
-        # -- -- building speech-to-text recoginiser
-        speech2text = build_speech2text(args, config)
-
-        # -- -- creating validation & test dataloaders
-        eval_loader = get_dataloader(config, dataset_path=args.test_dataset, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=False)
-        inference(args.output_dir, speech2text, eval_loader, args.output_name)
+        if args.decode_jobs > 1:
+            # -- -- decoding shards of the test set in parallel processes
+            sharded_inference(args.output_dir, args.output_name, args.decode_jobs, args.decode_threads)
+        else:
+            # -- -- building speech-to-text recoginiser
+            speech2text = build_speech2text(args, config)
+
+            # -- -- reusing the encoder outputs of previous decodings of the same checkpoint and SNR
+            encoder_cache = None
+            if args.encoder_cache_dir:
+                encoder_cache = EncoderOutputCache(args.encoder_cache_dir, max_bytes=int(args.encoder_cache_gb * 2**30))
+                speech2text.asr_model.set_encoder_cache(encoder_cache, transform_key=f"snr={args.snr_target}|noise={args.noise}")
+
+            # -- -- creating validation & test dataloaders
+            eval_loader = get_dataloader(config, dataset_path=args.test_dataset, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, filter_spkr_ids=args.filter_spkr_ids, filter_by_language=args.filter_by_language, is_training=False, batch_size=config.inference_conf.get('batch_size', 1))
+            try:
+                inference(args.output_dir, speech2text, eval_loader, args.output_name, eval_batch_transforms)
+            finally:
+                if encoder_cache is not None:
+                    encoder_cache.flush()
 
@@ -139,21 +139,26 @@ class CTC(torch.nn.Module):
             ys_pad: batch of padded character id sequence tensor (B, Lmax)
             ys_lens: batch of lengths of character sequence (B)
         """
-        # hs_pad: (B, L, NProj) -> ys_hat: (B, L, Nvocab)
-        ys_hat = self.ctc_lo(F.dropout(hs_pad, p=self.dropout_rate))
+        # under mixed precision, the projection, log-softmax and loss stay in
+        # the precision of the parameters, i.e. fp32
+        with torch.autocast(hs_pad.device.type, enabled=False):
+            hs_pad = hs_pad.to(self.ctc_lo.weight.dtype)
 
-        if self.ctc_type == "gtnctc":
-            # gtn expects list form for ys
-            ys_true = [y[y != -1] for y in ys_pad]  # parse padded ys
-        else:
-            # ys_hat: (B, L, D) -> (L, B, D)
-            ys_hat = ys_hat.transpose(0, 1)
-            # (B, L) -> (BxL,)
-            ys_true = torch.cat([ys_pad[i, :l] for i, l in enumerate(ys_lens)])
+            # hs_pad: (B, L, NProj) -> ys_hat: (B, L, Nvocab)
+            ys_hat = self.ctc_lo(F.dropout(hs_pad, p=self.dropout_rate))
+
+            if self.ctc_type == "gtnctc":
+                # gtn expects list form for ys
+                ys_true = [y[y != -1] for y in ys_pad]  # parse padded ys
+            else:
+                # ys_hat: (B, L, D) -> (L, B, D)
+                ys_hat = ys_hat.transpose(0, 1)
+                # (B, L) -> (BxL,)
+                ys_true = torch.cat([ys_pad[i, :l] for i, l in enumerate(ys_lens)])
 
-        loss = self.loss_fn(ys_hat, ys_true, hlens, ys_lens).to(
-            device=hs_pad.device, dtype=hs_pad.dtype
-        )
+            loss = self.loss_fn(ys_hat, ys_true, hlens, ys_lens).to(
+                device=hs_pad.device, dtype=hs_pad.dtype
+            )
 
         return loss
 
@@ -165,7 +170,8 @@ class CTC(torch.nn.Module):
         Returns:
             torch.Tensor: softmax applied 3d tensor (B, Tmax, odim)
         """
-        return F.softmax(self.ctc_lo(hs_pad), dim=2)
+        with torch.autocast(hs_pad.device.type, enabled=False):
+            return F.softmax(self.ctc_lo(hs_pad.to(self.ctc_lo.weight.dtype)), dim=2)
 
     def log_softmax(self, hs_pad):
         """log_softmax of frame activations
@@ -175,7 +181,8 @@ class CTC(torch.nn.Module):
         Returns:
             torch.Tensor: log softmax applied 3d tensor (B, Tmax, odim)
         """
-        return F.log_softmax(self.ctc_lo(hs_pad), dim=2)
+        with torch.autocast(hs_pad.device.type, enabled=False):
+            return F.log_softmax(self.ctc_lo(hs_pad.to(self.ctc_lo.weight.dtype)), dim=2)
 
     def argmax(self, hs_pad):
         """argmax of frame activations
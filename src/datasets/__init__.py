@@ -1 +1,3 @@
 from .asr_dataset import ASRDataset
+from .waveform_store import WaveformStore, pack_waveforms
+from .token_cache import TokenCache, build_token_cache, tokenizer_hash
@@ -6,6 +6,27 @@ import torch
 import torchaudio
 from torch.utils.data import Dataset
 
+from .waveform_store import WaveformStore
+
+class _StringArray:
+    """Strings packed as UTF-8 bytes into a single buffer plus offsets.
+
+    Unlike a list or object array, it holds no Python object per string, so the
+    pages shared with forked dataloader workers are not copied when they are read.
+    """
+
+    def __init__(self, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=self.offsets[1:])
+        self.buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
 class ASRDataset(Dataset):
     """Dataset to load the BBS-S2TC data.
     """
@@ -14,6 +35,10 @@ class ASRDataset(Dataset):
         # -- config
         self.config = config
 
+        # -- pre-decoded waveforms packed by src/scripts/pack_waveforms.py
+        waveform_store = getattr(config, 'waveform_store', None)
+        self.waveform_store = WaveformStore(waveform_store) if waveform_store else None
+
         # -- reading dataset
         self.dataset = pd.read_csv(dataset_path, delimiter=',', dtype={"speaker_id": "string"})
         self.dataset['sample_id'] = self.dataset['path'].map(lambda x: x.split('/')[-1])
@@ -45,16 +70,30 @@ class ASRDataset(Dataset):
         if 'all-langs' not in filter_by_language:
             self.dataset = self.dataset[self.dataset['language'].isin(filter_by_language)]
 
+        # -- columnar metadata, so samples are indexed without building pandas objects
+        self.paths = _StringArray(self.dataset['path'])
+        self.sample_ids = _StringArray(self.dataset['sample_id'])
+        self.sentences = _StringArray(self.dataset['sentence'].str.strip().str.lower())
+        self.lengths = self.dataset['length'].to_numpy(dtype=np.float64)
+
+        # -- interned language tags and speaker IDs
+        self.language_codes, self.languages = pd.factorize(self.dataset['language'].map(lambda x: f'<{x.upper()}>'))
+        self.speaker_codes, self.speakers = pd.factorize(self.dataset['speaker_id'], use_na_sentinel=False)
+        self.languages, self.speakers = self.languages.tolist(), self.speakers.tolist()
+
+        del self.dataset
+
     def __len__(self):
-        return len(self.dataset)
+        return len(self.lengths)
 
     def __getitem__(self, index):
         sample = {}
 
         # -- sample metadata
-        sample['sample_id'] = self.dataset.iloc[index]['sample_id']
-        sample['speaker_id'] = self.dataset.iloc[index]['speaker_id']
-        sample['language'] = f'<{self.dataset.iloc[index]["language"].upper()}>'
+        sample['sample_id'] = self.sample_ids[index]
+        sample['path'] = self.paths[index]
+        sample['speaker_id'] = self.speakers[self.speaker_codes[index]]
+        sample['language'] = self.languages[self.language_codes[index]]
 
         # -- input and output model data
         sample['speech'] = self.__get_speech_sample__(index)
@@ -63,10 +102,13 @@ class ASRDataset(Dataset):
         return sample
 
     def __get_speech_sample__(self, index):
-        wav_path = self.dataset.iloc[index]['path']
+        wav_path = self.paths[index]
+        if self.waveform_store is not None and wav_path in self.waveform_store:
+            return self.waveform_store[wav_path]
+
         waveform, sample_rate = torchaudio.load(wav_path, normalize=True)
 
         return waveform # -- (T,)
 
     def __get_text_sample__(self, index):
-        return self.dataset.iloc[index]['sentence'].strip().lower() # -- (L,)
+        return self.sentences[index] # -- (L,)
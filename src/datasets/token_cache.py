@@ -0,0 +1,83 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+def tokenizer_hash(config):
+    """Fingerprint of the BPE model and token list the token IDs depend on.
+    """
+    sha = hashlib.sha1()
+    sha.update(str(config.token_type).encode('utf-8'))
+    for source in [config.bpemodel, config.token_list]:
+        if isinstance(source, str):
+            try:
+                with open(source, 'rb') as f:
+                    sha.update(f.read())
+            except FileNotFoundError:
+                # -- e.g. whisper models named by tag
+                sha.update(source.encode('utf-8'))
+        elif source is not None:
+            sha.update('\n'.join(source).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+class TokenCache:
+    """Token IDs of the transcripts, stored as a ragged array keyed by waveform path.
+
+    The cache is a .npz file holding the sorted waveform paths, the offsets of
+    their token IDs within a single int32 array and the hash of the tokenizer
+    that produced them. Paths are used rather than sample IDs, i.e. file names,
+    since the same file name may appear under different splits or speakers.
+    """
+
+    def __init__(self, cache_path):
+        cache = np.load(cache_path)
+        if 'paths' not in cache:
+            raise ValueError(f'The token cache {cache_path} is keyed by sample ID, it should be rebuilt with src/scripts/build_token_cache.py')
+        self.paths = cache['paths']
+        self.offsets = cache['offsets']
+        self.token_ids = cache['token_ids']
+        self.tokenizer_hash = str(cache['tokenizer_hash'])
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get(self, path):
+        """Returns the token IDs of the sample whose waveform is at 'path', or None if it is not cached.
+        """
+        row = np.searchsorted(self.paths, path)
+        if row == len(self.paths) or self.paths[row] != path:
+            return None
+        return self.token_ids[self.offsets[row]:self.offsets[row + 1]]
+
+def build_token_cache(dataset_paths, cache_path, tokenizer, converter, config):
+    """Tokenizes once the transcripts of the dataset CSV splits and stores them as a TokenCache.
+    """
+    dataset = pd.concat([pd.read_csv(dataset_path, delimiter=',') for dataset_path in dataset_paths])
+
+    # -- same text normalization as ASRDataset
+    dataset['sentence'] = dataset['sentence'].str.strip().str.lower()
+
+    # -- a waveform listed in several splits must have the same transcript in all of them
+    conflicts = dataset.groupby('path')['sentence'].nunique()
+    conflicts = conflicts[conflicts > 1].index.tolist()
+    if len(conflicts) > 0:
+        raise ValueError(f'{len(conflicts)} waveforms have different transcripts across the splits, e.g. {conflicts[:5]}')
+    dataset = dataset.drop_duplicates('path').sort_values('path')
+
+    token_ids = [
+        np.asarray(converter.tokens2ids(tokenizer.text2tokens(sentence)), dtype=np.int32)
+        for sentence in tqdm(dataset['sentence'])
+    ]
+    offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids in token_ids], out=offsets[1:])
+
+    with open(cache_path, 'wb') as f:
+        np.savez(
+            f,
+            paths=dataset['path'].to_numpy(dtype=str),
+            offsets=offsets,
+            token_ids=np.concatenate(token_ids) if len(token_ids) > 0 else np.zeros(0, dtype=np.int32),
+            tokenizer_hash=np.array(tokenizer_hash(config)),
+        )
+
+    return TokenCache(cache_path)
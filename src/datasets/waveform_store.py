@@ -0,0 +1,84 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import torch
+import torchaudio
+
+class WaveformStore:
+    """Pre-decoded waveforms packed into a single contiguous file.
+
+    The store is a directory holding 'waveforms.bin', where every waveform is
+    laid out as (time, channel) samples one after the other, and 'index.json'
+    with the offset, number of samples and number of channels of each audio
+    path. Samples are read as memory-mapped slices, so random access does not
+    depend on the size of the store and no decoding happens at training time.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'index.json'), 'r') as f:
+            index = json.load(f)
+
+        self.dtype = np.dtype(index['dtype'])
+        self.sample_rate = index['sample_rate']
+        self.index = {path: (offset, nsamples, nchannels) for path, offset, nsamples, nchannels in index['waveforms']}
+
+        # -- opened lazily, so each dataloader worker maps the file on its own
+        self.waveforms = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def __getitem__(self, path):
+        if self.waveforms is None:
+            # -- copy-on-write mapping: slices are zero-copy and writable without touching the file
+            self.waveforms = np.memmap(os.path.join(self.store_dir, 'waveforms.bin'), dtype=self.dtype, mode='c')
+
+        offset, nsamples, nchannels = self.index[path]
+        waveform = self.waveforms[offset:offset + nsamples * nchannels].reshape(nsamples, nchannels)
+
+        # -- int16 samples are rescaled as torchaudio.load(..., normalize=True) does
+        if self.dtype == np.int16:
+            return torch.from_numpy(waveform.T.astype(np.float32) / 32768.0) # -- (C, T)
+        elif self.dtype == np.float16:
+            return torch.from_numpy(waveform.T.astype(np.float32)) # -- (C, T)
+        return torch.from_numpy(waveform).T # -- (C, T)
+
+def pack_waveforms(dataset_paths, store_dir, dtype='int16'):
+    """Decodes once every waveform listed in the dataset CSV splits and packs them into a WaveformStore.
+    """
+    dtype = np.dtype(dtype)
+    assert dtype in [np.int16, np.float16, np.float32], f'unsupported waveform dtype: {dtype}'
+
+    paths = pd.concat([pd.read_csv(dataset_path, delimiter=',')['path'] for dataset_path in dataset_paths]).drop_duplicates().tolist()
+
+    os.makedirs(store_dir, exist_ok=True)
+    waveforms = []
+    sample_rate = None
+    offset = 0
+    with open(os.path.join(store_dir, 'waveforms.bin'), 'wb') as f:
+        for path in tqdm(paths):
+            waveform, sr = torchaudio.load(path, normalize=True)
+            if sample_rate is None:
+                sample_rate = sr
+            assert sr == sample_rate, f'{path} has a sample rate of {sr}, but {sample_rate} was expected'
+
+            waveform = waveform.T.numpy() # -- (T, C)
+            if dtype == np.int16:
+                waveform = np.clip(np.round(waveform * 32768.0), -32768, 32767)
+            waveform = np.ascontiguousarray(waveform, dtype=dtype)
+            f.write(waveform.tobytes())
+
+            waveforms.append((path, offset, waveform.shape[0], waveform.shape[1]))
+            offset += waveform.size
+
+    with open(os.path.join(store_dir, 'index.json'), 'w') as f:
+        json.dump({'dtype': dtype.name, 'sample_rate': sample_rate, 'waveforms': waveforms}, f)
+
+    return WaveformStore(store_dir)
@@ -6,6 +6,8 @@
 
 """Decoder self-attention layer definition."""
 
+import math
+
 import torch
 from torch import nn
 
@@ -85,6 +87,7 @@ class DecoderLayer(nn.Module):
         cache=None,
         pre_memory=None,
         pre_memory_mask=None,
+        memory_cache=None,
     ):
         """Compute decoded features.
 
@@ -97,6 +100,8 @@ class DecoderLayer(nn.Module):
                 Each tensor shape should be (#batch, maxlen_out - 1, size).
             pre_memory (torch.Tensor): Encoded memory (#batch, maxlen_in, size).
             pre_memory_mask (torch.Tensor): Encoded memory mask (#batch, maxlen_in).
+            memory_cache (Tuple[torch.Tensor, torch.Tensor]): Source-attention key
+                and value of the memory computed by `memory_key_value`.
 
         Returns:
             torch.Tensor: Output tensor(#batch, maxlen_out, size).
@@ -160,13 +165,15 @@ class DecoderLayer(nn.Module):
         residual = x
         if self.normalize_before:
             x = self.norm2(x)
+        if memory_cache is None:
+            x_src = self.src_attn(x, memory, memory, memory_mask)
+        else:
+            x_src = self.cached_src_attn(x, memory_cache, memory_mask)
         if self.concat_after:
-            x_concat = torch.cat(
-                (x, self.src_attn(x, memory, memory, memory_mask)), dim=-1
-            )
+            x_concat = torch.cat((x, x_src), dim=-1)
             x = residual + self.concat_linear2(x_concat)
         else:
-            x = residual + self.dropout(self.src_attn(x, memory, memory, memory_mask))
+            x = residual + self.dropout(x_src)
         if not self.normalize_before:
             x = self.norm2(x)
 
@@ -187,3 +194,39 @@ class DecoderLayer(nn.Module):
         if pre_memory is not None:
             return x, tgt_mask, memory, memory_mask, None, pre_memory, pre_memory_mask
         return x, tgt_mask, memory, memory_mask
+
+    def memory_key_value(self, memory):
+        """Project the encoded memory into source-attention key and value.
+
+        Args:
+            memory (torch.Tensor): Encoded memory (#batch, maxlen_in, size).
+
+        Returns:
+            torch.Tensor: Key tensor (#batch, n_head, maxlen_in, d_k).
+            torch.Tensor: Value tensor (#batch, n_head, maxlen_in, d_k).
+
+        """
+        n_batch = memory.size(0)
+        k = self.src_attn.linear_k(memory).view(n_batch, -1, self.src_attn.h, self.src_attn.d_k)
+        v = self.src_attn.linear_v(memory).view(n_batch, -1, self.src_attn.h, self.src_attn.d_k)
+        return k.transpose(1, 2), v.transpose(1, 2)
+
+    def cached_src_attn(self, x, memory_cache, memory_mask):
+        """Compute source attention reusing the key and value of the memory.
+
+        Args:
+            x (torch.Tensor): Query tensor (#batch, maxlen_out, size).
+            memory_cache (Tuple[torch.Tensor, torch.Tensor]): Key and value
+                computed by `memory_key_value`.
+            memory_mask (torch.Tensor): Encoded memory mask (#batch, 1, maxlen_in).
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, maxlen_out, size).
+
+        """
+        k, v = memory_cache
+        n_batch = x.size(0)
+        q = self.src_attn.linear_q(x).view(n_batch, -1, self.src_attn.h, self.src_attn.d_k)
+        q = q.transpose(1, 2)  # (batch, head, time1, d_k)
+        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.src_attn.d_k)
+        return self.src_attn.forward_attention(v, scores, memory_mask)
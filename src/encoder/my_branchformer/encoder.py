@@ -410,3 +410,129 @@ class MyBranchformerEncoder(AbsEncoder):
         if len(intermediate_outs) > 0:
             return (xs_pad, intermediate_outs), olens, None
         return xs_pad, olens, None
+
+    def _subsampling_window(self) -> Tuple[int, int]:
+        """Receptive field and stride (in input frames) of the embedding layer."""
+        window, stride = 1, 1
+        conv = getattr(self.embed, "conv", None)
+        if conv is not None:
+            for module in conv.modules():
+                if isinstance(module, (torch.nn.Conv1d, torch.nn.Conv2d)):
+                    window += (module.kernel_size[0] - 1) * stride
+                    stride *= module.stride[0]
+        return window, stride
+
+    def _streaming_pos_emb(self, x: torch.Tensor, time2: int) -> Optional[torch.Tensor]:
+        """Relative positional embedding of a chunk attending to `time2` frames."""
+        if self.embed is None:
+            return None
+        pos_enc = [m for m in self.embed.modules() if isinstance(m, RelPositionalEncoding)]
+        if len(pos_enc) == 0:
+            return None
+        pos_enc = pos_enc[0]
+        pos_enc.extend_pe(x.new_zeros(1, time2))
+        center = pos_enc.pe.size(1) // 2
+        return pos_enc.dropout(pos_enc.pe[:, center - time2 + 1 : center + time2])
+
+    def forward_infer(
+        self,
+        xs_pad: torch.Tensor,
+        prev_states: Optional[dict] = None,
+        is_final: bool = True,
+        ctc: CTC = None,
+        left_context: int = 64,
+    ) -> Tuple[torch.Tensor, Optional[dict]]:
+        """Calculate blockwise streaming forward propagation.
+
+        Input frames that do not complete a subsampling window are buffered until
+        the next call. Each layer attends to at most `left_context` previous
+        encoder frames, so time and memory per chunk do not depend on how long
+        the stream has been running.
+
+        Args:
+            xs_pad (torch.Tensor): Input chunk (#batch, L, input_size).
+            prev_states (dict): States returned by the previous call, or None
+                at the beginning of the stream.
+            is_final (bool): Whether this is the last chunk of the stream.
+            ctc (CTC): Intermediate CTC module.
+            left_context (int): Number of cached encoder frames per layer.
+        Returns:
+            torch.Tensor: Output tensor (#batch, L', output_size).
+            dict: States for the next call, None if is_final.
+        """
+        if not (
+            self.embed is None
+            or isinstance(self.embed, torch.nn.Sequential)
+            or hasattr(self.embed, "conv")
+        ):
+            raise NotImplementedError(f"{type(self.embed).__name__} does not support streaming")
+        if self._streaming_pos_emb(xs_pad, 1) is None:
+            if any(layer.attn is not None for layer in self.encoders):
+                raise NotImplementedError("streaming attention requires rel_pos encoding")
+
+        if prev_states is None:
+            buffer, layer_caches = None, [(None, None)] * len(self.encoders)
+        else:
+            buffer, layer_caches = prev_states["buffer"], prev_states["layer_caches"]
+        if buffer is not None:
+            xs_pad = torch.cat([buffer, xs_pad], dim=1)
+
+        # -- -- frames that complete a subsampling window
+        window, stride = self._subsampling_window()
+        n_out = max(0, (xs_pad.size(1) - window) // stride + 1)
+        next_buffer = xs_pad[:, n_out * stride :]
+
+        if n_out == 0:
+            xs_pad = xs_pad.new_zeros(xs_pad.size(0), 0, self._output_size)
+            if is_final:
+                return xs_pad, None
+            return xs_pad, {"buffer": next_buffer, "layer_caches": layer_caches}
+
+        xs_pad = xs_pad[:, : (n_out - 1) * stride + window]
+        masks = xs_pad.new_ones(xs_pad.size(0), 1, xs_pad.size(1), dtype=torch.bool)
+        if hasattr(self.embed, "conv"):
+            xs_pad, masks = self.embed(xs_pad, masks)
+        elif self.embed is not None:
+            xs_pad = self.embed(xs_pad)
+            masks = masks[:, :, :n_out]
+        if isinstance(xs_pad, tuple):
+            xs_pad = xs_pad[0]
+
+        n_cached = 0 if layer_caches[0][0] is None else layer_caches[0][0].size(1)
+        pos_emb = self._streaming_pos_emb(xs_pad, n_cached + n_out)
+        if pos_emb is not None:
+            xs_pad = (xs_pad, pos_emb)
+
+        next_layer_caches = []
+        for layer_idx, encoder_layer in enumerate(self.encoders):
+            xs_pad, masks, (attn_cache, conv_cache) = encoder_layer(
+                xs_pad, masks, cache=layer_caches[layer_idx]
+            )
+            if attn_cache is not None:
+                attn_cache = attn_cache[:, max(0, attn_cache.size(1) - left_context) :]
+                if attn_cache.size(1) == 0:
+                    attn_cache = None
+            next_layer_caches.append((attn_cache, conv_cache))
+
+            if layer_idx + 1 in self.interctc_layer_idx and self.interctc_use_conditioning:
+                encoder_out = xs_pad
+                if isinstance(encoder_out, tuple):
+                    encoder_out = encoder_out[0]
+                if self.normalize_before:
+                    encoder_out = self.after_norm(encoder_out)
+                ctc_out = ctc.softmax(encoder_out)
+                if isinstance(xs_pad, tuple):
+                    x, pos_emb = xs_pad
+                    x = x + self.conditioning_layer(ctc_out)
+                    xs_pad = (x, pos_emb)
+                else:
+                    xs_pad = xs_pad + self.conditioning_layer(ctc_out)
+
+        if isinstance(xs_pad, tuple):
+            xs_pad = xs_pad[0]
+        if self.normalize_before:
+            xs_pad = self.after_norm(xs_pad)
+
+        if is_final:
+            return xs_pad, None
+        return xs_pad, {"buffer": next_buffer, "layer_caches": next_layer_caches}
@@ -15,8 +15,10 @@ import logging
 from typing import List, Optional, Tuple, Union
 
 import copy
+import math
 import numpy
 import torch
+import torch.nn.functional as F
 from typeguard import check_argument_types
 
 from espnet2.asr.encoder.abs_encoder import AbsEncoder
@@ -150,80 +152,19 @@ class MyBranchformerEncoderLayer(torch.nn.Module):
         else:
             self.merge_proj = torch.nn.Identity()
 
-    def forward(self, x_input, mask, cache=None):
-        """Compute encoded features.
+    def _merge_branches(self, x, x1, x2, mask, stoch_layer_coeff=1.0):
+        """Merge the outputs of both branches into the residual stream.
 
         Args:
-            x_input (Union[Tuple, torch.Tensor]): Input tensor w/ or w/o pos emb.
-                - w/ pos emb: Tuple of tensors [(#batch, time, size), (1, time, size)].
-                - w/o pos emb: Tensor (#batch, time, size).
-            mask (torch.Tensor): Mask tensor for the input (#batch, time).
-            cache (torch.Tensor): Cache tensor of the input (#batch, time - 1, size).
+            x (torch.Tensor): Residual input tensor (#batch, time, size).
+            x1 (torch.Tensor): Output of the attention branch (#batch, time, size).
+            x2 (torch.Tensor): Output of the cgMLP branch (#batch, time, size).
+            mask (torch.Tensor): Mask tensor for the input (#batch, 1, time).
+            stoch_layer_coeff (float): Stochastic depth residual coefficient.
 
         Returns:
             torch.Tensor: Output tensor (#batch, time, size).
-            torch.Tensor: Mask tensor (#batch, time).
         """
-
-        if cache is not None:
-            raise NotImplementedError("cache is not None, which is not tested")
-
-        if isinstance(x_input, tuple):
-            x, pos_emb = x_input[0], x_input[1]
-        else:
-            x, pos_emb = x_input, None
-
-        skip_layer = False
-        # with stochastic depth, residual connection `x + f(x)` becomes
-        # `x <- x + 1 / (1 - p) * f(x)` at training time.
-        stoch_layer_coeff = 1.0
-        if self.training and self.stochastic_depth_rate > 0:
-            skip_layer = torch.rand(1).item() < self.stochastic_depth_rate
-            stoch_layer_coeff = 1.0 / (1 - self.stochastic_depth_rate)
-
-        if skip_layer:
-            if cache is not None:
-                x = torch.cat([cache, x], dim=1)
-            if pos_emb is not None:
-                return (x, pos_emb), mask
-            return x, mask
-
-        # Macaron FFN: positionwise feed forward module
-        residual = x
-        x = self.norm_ff_macaron(x)
-        x = residual + self.ff_scale * self.dropout(self.feed_forward_macaron(x))
-
-        # Two branches
-        x1 = x
-        x2 = x
-
-        # Branch 1: multi-headed attention module
-        if self.attn is not None:
-            x1 = self.norm_mha(x1)
-
-            if isinstance(self.attn, FastSelfAttention):
-                x_att = self.attn(x1, mask)
-            else:
-                if pos_emb is not None:
-                    x_att = self.attn(x1, x1, x1, pos_emb, mask)
-                else:
-                    x_att = self.attn(x1, x1, x1, mask)
-
-            x1 = self.dropout(x_att)
-
-        # Branch 2: convolutional gating mlp
-        if self.cgmlp is not None:
-            x2 = self.norm_mlp(x2)
-
-            if pos_emb is not None:
-                x2 = (x2, pos_emb)
-            x2 = self.cgmlp(x2, mask)
-            if isinstance(x2, tuple):
-                x2 = x2[0]
-
-            x2 = self.dropout(x2)
-
-        # Merge two branches
         if self.use_two_branches:
             if self.merge_method == "concat":
                 x = x + stoch_layer_coeff * self.dropout(
@@ -308,6 +249,85 @@ class MyBranchformerEncoderLayer(torch.nn.Module):
                 # This should not happen
                 raise RuntimeError("Both branches are not None, which is unexpected.")
 
+        return x
+
+    def forward(self, x_input, mask, cache=None):
+        """Compute encoded features.
+
+        Args:
+            x_input (Union[Tuple, torch.Tensor]): Input tensor w/ or w/o pos emb.
+                - w/ pos emb: Tuple of tensors [(#batch, time, size), (1, time, size)].
+                - w/o pos emb: Tensor (#batch, time, size).
+            mask (torch.Tensor): Mask tensor for the input (#batch, time).
+            cache (Tuple[torch.Tensor, torch.Tensor]): Streaming cache of the
+                previous chunks, see `forward_chunk`.
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time, size).
+            torch.Tensor: Mask tensor (#batch, time).
+        """
+
+        if cache is not None:
+            return self.forward_chunk(x_input, mask, cache)
+
+        if isinstance(x_input, tuple):
+            x, pos_emb = x_input[0], x_input[1]
+        else:
+            x, pos_emb = x_input, None
+
+        skip_layer = False
+        # with stochastic depth, residual connection `x + f(x)` becomes
+        # `x <- x + 1 / (1 - p) * f(x)` at training time.
+        stoch_layer_coeff = 1.0
+        if self.training and self.stochastic_depth_rate > 0:
+            skip_layer = torch.rand(1).item() < self.stochastic_depth_rate
+            stoch_layer_coeff = 1.0 / (1 - self.stochastic_depth_rate)
+
+        if skip_layer:
+            if cache is not None:
+                x = torch.cat([cache, x], dim=1)
+            if pos_emb is not None:
+                return (x, pos_emb), mask
+            return x, mask
+
+        # Macaron FFN: positionwise feed forward module
+        residual = x
+        x = self.norm_ff_macaron(x)
+        x = residual + self.ff_scale * self.dropout(self.feed_forward_macaron(x))
+
+        # Two branches
+        x1 = x
+        x2 = x
+
+        # Branch 1: multi-headed attention module
+        if self.attn is not None:
+            x1 = self.norm_mha(x1)
+
+            if isinstance(self.attn, FastSelfAttention):
+                x_att = self.attn(x1, mask)
+            else:
+                if pos_emb is not None:
+                    x_att = self.attn(x1, x1, x1, pos_emb, mask)
+                else:
+                    x_att = self.attn(x1, x1, x1, mask)
+
+            x1 = self.dropout(x_att)
+
+        # Branch 2: convolutional gating mlp
+        if self.cgmlp is not None:
+            x2 = self.norm_mlp(x2)
+
+            if pos_emb is not None:
+                x2 = (x2, pos_emb)
+            x2 = self.cgmlp(x2, mask)
+            if isinstance(x2, tuple):
+                x2 = x2[0]
+
+            x2 = self.dropout(x2)
+
+        # Merge two branches
+        x = self._merge_branches(x, x1, x2, mask, stoch_layer_coeff)
+
         # FFN: positionwise feed forward module
         residual = x
         x = self.norm_ff(x)
@@ -319,3 +339,156 @@ class MyBranchformerEncoderLayer(torch.nn.Module):
             return (x, pos_emb), mask
 
         return x, mask
+
+    def forward_chunk(self, x_input, mask, cache):
+        """Compute encoded features of a streaming chunk.
+
+        The attention branch attends to the cached frames of the previous chunks
+        plus the current chunk, whereas the depthwise convolution of the cgMLP
+        branch takes its left context from the cache and sees zeros in place of
+        the future frames. The learned_ave merge weights are pooled over the
+        current chunk only.
+
+        Args:
+            x_input (Union[Tuple, torch.Tensor]): Input tensor w/ or w/o pos emb.
+                - w/ pos emb: Tuple of tensors [(#batch, chunk, size),
+                  (1, 2 * (cache + chunk) - 1, size)].
+                - w/o pos emb: Tensor (#batch, chunk, size).
+            mask (torch.Tensor): Mask tensor for the chunk (#batch, 1, chunk).
+            cache (Tuple[torch.Tensor, torch.Tensor]): Normalized attention input
+                of the previous frames (#batch, cache, size) and normalized gate
+                input of the cgMLP convolution (#batch, kernel_size // 2,
+                cgmlp_linear_units // 2). Any of them can be None.
+
+        Returns:
+            Union[Tuple, torch.Tensor]: Output tensor (#batch, chunk, size).
+            torch.Tensor: Mask tensor (#batch, 1, chunk).
+            Tuple[torch.Tensor, torch.Tensor]: Updated cache. The attention cache
+                grows with the chunk, so the caller must trim it.
+        """
+        if isinstance(x_input, tuple):
+            x, pos_emb = x_input[0], x_input[1]
+        else:
+            x, pos_emb = x_input, None
+        attn_cache, conv_cache = cache
+
+        # Macaron FFN: positionwise feed forward module
+        residual = x
+        x = self.norm_ff_macaron(x)
+        x = residual + self.ff_scale * self.dropout(self.feed_forward_macaron(x))
+
+        x1 = x
+        x2 = x
+
+        # Branch 1: multi-headed attention over cache + chunk
+        next_attn_cache = None
+        if self.attn is not None:
+            x1 = self.norm_mha(x1)
+            key = x1 if attn_cache is None else torch.cat([attn_cache, x1], dim=1)
+            next_attn_cache = key
+            x1 = self.dropout(self._chunk_attention(x1, key, pos_emb))
+
+        # Branch 2: convolutional gating mlp with cached left context
+        next_conv_cache = None
+        if self.cgmlp is not None:
+            x2 = self.norm_mlp(x2)
+            x2, next_conv_cache = self._chunk_cgmlp(x2, conv_cache)
+            x2 = self.dropout(x2)
+
+        # Merge two branches
+        x = self._merge_branches(x, x1, x2, mask)
+
+        # FFN: positionwise feed forward module
+        residual = x
+        x = self.norm_ff(x)
+        x = residual + self.ff_scale * self.dropout(self.feed_forward(x))
+
+        x = self.norm_final(x)
+
+        next_cache = (next_attn_cache, next_conv_cache)
+        if pos_emb is not None:
+            return (x, pos_emb), mask, next_cache
+        return x, mask, next_cache
+
+    def _chunk_attention(self, query, key, pos_emb):
+        """Attend from the chunk frames to the cached + chunk frames.
+
+        Args:
+            query (torch.Tensor): Normalized chunk (#batch, chunk, size).
+            key (torch.Tensor): Normalized cache + chunk (#batch, time2, size).
+            pos_emb (torch.Tensor): Relative positional embedding
+                (1, 2 * time2 - 1, size), only used by rel_selfattn.
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, chunk, size).
+        """
+        if isinstance(self.attn, RelPositionMultiHeadedAttention):
+            q, k, v = self.attn.forward_qkv(query, key, key)
+            q = q.transpose(1, 2)  # (batch, chunk, head, d_k)
+
+            n_batch_pos = pos_emb.size(0)
+            p = self.attn.linear_pos(pos_emb).view(
+                n_batch_pos, -1, self.attn.h, self.attn.d_k
+            )
+            p = p.transpose(1, 2)  # (batch, head, 2*time2-1, d_k)
+
+            q_with_bias_u = (q + self.attn.pos_bias_u).transpose(1, 2)
+            q_with_bias_v = (q + self.attn.pos_bias_v).transpose(1, 2)
+            matrix_ac = torch.matmul(q_with_bias_u, k.transpose(-2, -1))
+            matrix_bd = torch.matmul(q_with_bias_v, p.transpose(-2, -1))
+
+            # the chunk is right-aligned with the keys, so query i (absolute
+            # position time2-chunk+i) attends key j at relative index chunk-1-i+j
+            time1, time2 = query.size(1), key.size(1)
+            index = (
+                torch.arange(time2, device=query.device)[None, :]
+                - torch.arange(time1, device=query.device)[:, None]
+                + time1
+                - 1
+            )
+            matrix_bd = matrix_bd.gather(
+                -1, index.expand(*matrix_bd.shape[:2], time1, time2)
+            )
+
+            scores = (matrix_ac + matrix_bd) / math.sqrt(self.attn.d_k)
+            return self.attn.forward_attention(v, scores, None)
+        elif isinstance(self.attn, (LegacyRelPositionMultiHeadedAttention, FastSelfAttention)):
+            raise NotImplementedError(
+                f"{type(self.attn).__name__} does not support streaming"
+            )
+        return self.attn(query, key, key, None)
+
+    def _chunk_cgmlp(self, x, conv_cache):
+        """Run the cgMLP branch on a chunk with a cached convolution context.
+
+        Args:
+            x (torch.Tensor): Normalized chunk (#batch, chunk, size).
+            conv_cache (torch.Tensor): Normalized gate input of the previous
+                frames (#batch, kernel_size // 2, cgmlp_linear_units // 2).
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, chunk, size).
+            torch.Tensor: Updated convolution cache.
+        """
+        csgu = self.cgmlp.csgu
+        x = self.cgmlp.channel_proj1(x)
+
+        x_r, x_g = x.chunk(2, dim=-1)
+        x_g = csgu.norm(x_g)
+
+        context = csgu.conv.kernel_size[0] // 2
+        if conv_cache is None:
+            conv_cache = x_g.new_zeros(x_g.size(0), context, x_g.size(2))
+        x_g = torch.cat([conv_cache, x_g], dim=1)
+        next_conv_cache = x_g[:, x_g.size(1) - context :]
+
+        x_g = F.pad(x_g.transpose(1, 2), (0, context))
+        x_g = F.conv1d(
+            x_g, csgu.conv.weight, csgu.conv.bias, groups=csgu.conv.groups
+        ).transpose(1, 2)
+        if csgu.linear is not None:
+            x_g = csgu.linear(x_g)
+        x_g = csgu.act(x_g)
+        x = csgu.dropout(x_r * x_g)
+
+        return self.cgmlp.channel_proj2(x), next_conv_cache
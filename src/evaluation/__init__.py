@@ -1 +1,3 @@
 from .bootstrap_wer import compute_bootstrap_wer
+from .error_rates import ErrorRateAccumulator, edit_distance
+from .bootstrap_ci import bootstrap_error_rates, bootstrap_interval
@@ -0,0 +1,40 @@
+import numpy as np
+
+def bootstrap_error_rates(errors, lengths, n_replicates=1000, seed=None):
+    """Error rates (%) of bootstrap resamples of the utterances.
+
+    Utterances with the same (errors, reference length) are interchangeable, so
+    a resample is fully described by how many times each distinct pair is drawn.
+    All the replicates are then drawn at once from a multinomial over those
+    pairs, whose number barely grows with the size of the test set.
+
+    Args:
+        errors: per-utterance number of errors (N,)
+        lengths: per-utterance reference length (N,)
+        n_replicates: number of bootstrap resamples
+        seed: seed of the random generator, None for a non-deterministic one
+    Returns:
+        error rate of each resample (n_replicates,)
+    """
+    errors = np.asarray(errors, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    assert errors.shape == lengths.shape, 'errors and lengths must have one entry per utterance'
+    if errors.size == 0:
+        return np.zeros(n_replicates)
+
+    # -- distinct (errors, length) pairs, found through a single integer key
+    base = int(lengths.max()) + 1
+    keys, counts = np.unique(errors * base + lengths, return_counts=True)
+    pairs = np.stack([keys // base, keys % base], axis=1) # -- (K, 2)
+
+    rng = np.random.default_rng(seed)
+    draws = rng.multinomial(errors.size, counts / errors.size, size=n_replicates) # -- (R, K)
+    totals = draws @ pairs # -- (R, 2)
+
+    return np.divide(100.0 * totals[:, 0], totals[:, 1], out=np.zeros(n_replicates), where=totals[:, 1] > 0)
+
+def bootstrap_interval(errors, lengths, n_replicates=1000, seed=None, scale=1.64):
+    """Half-width of the confidence interval of the error rate, as reported by tasasIntervalo.
+    """
+    rates = bootstrap_error_rates(errors, lengths, n_replicates=n_replicates, seed=seed)
+    return round(scale * float(rates.std()), 6)
@@ -1,16 +1,12 @@
-import subprocess
-
-def compute_bootstrap_wer(path):
-    wer_command = ['./src/evaluation/tasas/tasas', '-f', "#", '-s', " ", "-ie", path]
-    cer_command = ['./src/evaluation/tasas/tasas', '-f', "#", "-ie", path]
-
-    wer = float(subprocess.check_output(wer_command).strip())
-    cer = float(subprocess.check_output(cer_command).strip())
-
-    ci_wer_command = ['./src/evaluation/tasas/tasasIntervalo', '-f', "#", '-s', " ", "-ie", path]
-    ci_cer_command = ['./src/evaluation/tasas/tasasIntervalo', '-f', "#", "-ie", path]
-
-    ci_wer = float(subprocess.check_output(ci_wer_command).decode('utf-8').split('+-')[1].strip())
-    ci_cer = float(subprocess.check_output(ci_cer_command).decode('utf-8').split('+-')[1].strip())
-
-    return wer, cer, ci_wer, ci_cer
+from .error_rates import ErrorRateAccumulator
+
+def compute_bootstrap_wer(path, n_replicates=1000, seed=None):
+    """WER, CER and their confidence intervals of a file of 'reference#hypothesis' lines.
+    """
+    error_rates = ErrorRateAccumulator()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            ref, _, hyp = line.rstrip('\n').partition('#')
+            error_rates.add(ref, hyp)
+
+    return error_rates.summary(n_replicates=n_replicates, seed=seed)
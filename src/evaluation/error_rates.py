@@ -0,0 +1,114 @@
+from .bootstrap_ci import bootstrap_interval
+
+def edit_distance(ref, hyp):
+    """Levenshtein distance between two symbol sequences.
+
+    It follows the bit-parallel algorithm of Myers (1999) as formulated by Hyyrö
+    (2003): each column of the DP matrix is kept as two bit-vectors, so the
+    distance is computed with a handful of integer operations per hypothesis
+    symbol, whatever the length of the reference.
+    """
+    m = len(ref)
+    if m == 0:
+        return len(hyp)
+
+    # -- bit mask of the reference positions of each symbol
+    peq = {}
+    for i, symbol in enumerate(ref):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for symbol in hyp:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # -- the first DP row grows by one at each hypothesis symbol
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+
+    return score
+
+def word_symbols(sentence):
+    """Words of a sentence, as tasas splits them with '-s " "'."""
+    return [word for word in sentence.split(' ') if word]
+
+def char_symbols(sentence):
+    """Bytes of a sentence, as tasas reads them by default (one symbol per byte)."""
+    return sentence.encode('utf-8')
+
+class ErrorRateAccumulator:
+    """Per-utterance word and character error counts, accumulated while decoding.
+
+    The error rates are those of 'tasas -ie' (errors over reference symbols, in %),
+    and the confidence intervals those of 'tasasIntervalo', i.e. 1.64 times the
+    standard deviation of the error rate over bootstrap resamples of the utterances.
+    """
+
+    def __init__(self):
+        self.word_errors = []
+        self.word_lengths = []
+        self.char_errors = []
+        self.char_lengths = []
+
+        # -- running totals, so the error rates can be followed while decoding
+        self.totals = {'word_errors': 0, 'word_lengths': 0, 'char_errors': 0, 'char_lengths': 0}
+
+    def __len__(self):
+        return len(self.word_errors)
+
+    def add(self, ref, hyp):
+        """Scores one utterance and returns its (word errors, char errors)."""
+        ref_words, hyp_words = word_symbols(ref), word_symbols(hyp)
+        ref_chars, hyp_chars = char_symbols(ref), char_symbols(hyp)
+
+        word_errors = edit_distance(ref_words, hyp_words)
+        char_errors = edit_distance(ref_chars, hyp_chars)
+
+        self.word_errors.append(word_errors)
+        self.word_lengths.append(len(ref_words))
+        self.char_errors.append(char_errors)
+        self.char_lengths.append(len(ref_chars))
+
+        self.totals['word_errors'] += word_errors
+        self.totals['word_lengths'] += len(ref_words)
+        self.totals['char_errors'] += char_errors
+        self.totals['char_lengths'] += len(ref_chars)
+
+        return word_errors, char_errors
+
+    def update(self, other):
+        """Appends the utterances scored by another accumulator, e.g. of a decoding shard."""
+        self.word_errors.extend(other.word_errors)
+        self.word_lengths.extend(other.word_lengths)
+        self.char_errors.extend(other.char_errors)
+        self.char_lengths.extend(other.char_lengths)
+        for key in self.totals:
+            self.totals[key] += other.totals[key]
+
+    @staticmethod
+    def error_rate(errors, length):
+        return round(100.0 * errors / length, 6) if length > 0 else 0.0
+
+    @property
+    def wer(self):
+        return self.error_rate(self.totals['word_errors'], self.totals['word_lengths'])
+
+    @property
+    def cer(self):
+        return self.error_rate(self.totals['char_errors'], self.totals['char_lengths'])
+
+    def summary(self, n_replicates=1000, seed=None):
+        """Returns WER, CER and their confidence intervals, as compute_bootstrap_wer does."""
+        ci_wer = bootstrap_interval(self.word_errors, self.word_lengths, n_replicates=n_replicates, seed=seed)
+        ci_cer = bootstrap_interval(self.char_errors, self.char_lengths, n_replicates=n_replicates, seed=seed)
+        return self.wer, self.cer, ci_wer, ci_cer
@@ -1,2 +1,4 @@
 from .asr_inference import Speech2Text as ASR2Text
 from .asr_inference_maskctc import Speech2Text as ASR2TextMaskCTC
+from .asr_inference_streaming import Speech2TextStreaming as ASR2TextStreaming
+from .maskctc_sweep import MaskCTCSweep
@@ -91,14 +91,21 @@ class Speech2Text:
 
     @torch.no_grad()
     def __call__(
-        self, speech: Union[torch.Tensor, np.ndarray]
+        self,
+        speech: Union[torch.Tensor, np.ndarray],
+        speech_lengths: Optional[Union[torch.Tensor, np.ndarray]] = None,
+        paths: Optional[List[str]] = None,
     ) -> List[Tuple[Optional[str], List[str], List[int], Hypothesis, Optional[str]]]:
         """Inference
 
         Args:
-            data: Input speech data
+            speech: Input speech data of one utterance (Nsamples, ...)
+                or a padded batch of utterances (B, Nsamples, ...)
+            speech_lengths: (B,) required when speech is a padded batch
+            paths: (B,) waveform paths of the utterances, to reuse the
+                encoder outputs when the model has an encoder cache
         Returns:
-            text, token, token_int, hyp
+            text, token, token_int, hyp, lang_id per utterance
 
         """
         assert check_argument_types()
@@ -106,26 +113,59 @@ class Speech2Text:
         # Input as audio signal
         if isinstance(speech, np.ndarray):
             speech = torch.tensor(speech)
-
-        # data: (Nsamples,) -> (1, Nsamples)
-        speech = speech.unsqueeze(0).to(getattr(torch, self.dtype))
-        # lenghts: (1,)
-        lengths = speech.new_full([1], dtype=torch.long, fill_value=speech.size(1))
+        if isinstance(speech_lengths, np.ndarray):
+            speech_lengths = torch.tensor(speech_lengths)
+
+        if speech_lengths is None:
+            # data: (Nsamples,) -> (1, Nsamples)
+            speech = speech.unsqueeze(0).to(getattr(torch, self.dtype))
+            # lenghts: (1,)
+            lengths = speech.new_full([1], dtype=torch.long, fill_value=speech.size(1))
+        else:
+            speech = speech.to(getattr(torch, self.dtype))
+            lengths = speech_lengths.to(torch.long)
         batch = {"speech": speech, "speech_lengths": lengths}
 
         # a. To device
         batch = to_device(batch, device=self.device)
 
         # b. Forward Encoder
-        enc, _ = self.asr_model.encode(**batch)
+        enc, enc_lens = self.asr_model.encode(**batch, paths=paths)
 
         if isinstance(enc, tuple):
             intermediate_outs = enc[1]
             enc = enc[0]
-        assert len(enc) == 1, len(enc)
+        assert len(enc) == len(lengths), len(enc)
 
         # c. Passed the encoder result and the inference algorithm
-        hyp = self.s2t(enc[0])
+        hyps = self.s2t(enc, enc_lens)
+
+        # language identification from first intermediate output
+        lang_intermediate_out = intermediate_outs[0][-1]
+        lang_ctc_out = self.asr_model.ctc.log_softmax(lang_intermediate_out)
+        lang_ctc_probs, lang_ctc_ids = torch.exp(lang_ctc_out).max(dim=-1)
+
+        results = []
+        for hyp, lang_ids, enc_len in zip(hyps, lang_ctc_ids, enc_lens.tolist()):
+            text, token, token_int = self.hyp2text(hyp)
+
+            # remove blank symbols
+            lang_token_int = list(filter(lambda x: x != 0, lang_ids[:enc_len].tolist()))
+            if len(lang_token_int) > 0:
+                lang_token = self.converter.ids2tokens(lang_token_int)
+                lang_id = self.tokenizer.tokens2text(lang_token[0]).strip()
+            else:
+                lang_id = None
+
+            results.append((text, token, token_int, hyp, lang_id))
+
+        assert check_return_type(results)
+        return results
+
+    def hyp2text(
+        self, hyp: Hypothesis
+    ) -> Tuple[Optional[str], List[str], List[int]]:
+        """Convert a Mask-CTC hypothesis into text, token and token_int"""
         assert isinstance(hyp, Hypothesis), type(hyp)
 
         # remove sos/eos and get results
@@ -142,23 +182,7 @@ class Speech2Text:
         else:
             text = None
 
-        # language identification from first intermediate output
-        lang_intermediate_out = intermediate_outs[0][-1]
-        lang_ctc_out = self.asr_model.ctc.log_softmax(lang_intermediate_out)
-        lang_ctc_probs, lang_ctc_ids = torch.exp(lang_ctc_out).max(dim=-1)
-
-        # remove blank symbols
-        lang_token_int = list(filter(lambda x: x != 0, lang_ctc_ids[0].tolist()))
-        if len(lang_token_int) > 0:
-            lang_token = self.converter.ids2tokens(lang_token_int)
-            lang_id = self.tokenizer.tokens2text(lang_token[0]).strip()
-        else:
-            lang_id = None
-
-        results = [(text, token, token_int, hyp, lang_id)]
-
-        assert check_return_type(results)
-        return results
+        return text, token, token_int
 
     @staticmethod
     def from_pretrained(
@@ -211,8 +235,6 @@ def inference(
     maskctc_threshold_probability: float,
 ):
     assert check_argument_types()
-    if batch_size > 1:
-        raise NotImplementedError("batch decoding is not implemented")
     if ngpu > 1:
         raise NotImplementedError("only single GPU decoding is supported")
 
@@ -266,29 +288,25 @@ def inference(
             assert all(isinstance(s, str) for s in keys), keys
             _bs = len(next(iter(batch.values())))
             assert len(keys) == _bs, f"{len(keys)} != {_bs}"
-            batch = {k: v[0] for k, v in batch.items() if not k.endswith("_lengths")}
 
             try:
-                results = speech2text(**batch)
+                results = speech2text(batch["speech"], batch["speech_lengths"])
             except TooShortUttError as e:
                 logging.warning(f"Utterance {keys} {e}")
                 hyp = Hypothesis(score=0.0, scores={}, states={}, yseq=[])
-                results = [[" ", ["<space>"], [2], hyp]]
-
-            # Only supporting batch_size==1
-            key = keys[0]
-            (text, token, token_int, hyp) = results[0]
+                results = [[" ", ["<space>"], [2], hyp, None]] * len(keys)
 
             # Create a directory: outdir/{n}best_recog
             ibest_writer = writer["1best_recog"]
 
-            # Write the result to each file
-            ibest_writer["token"][key] = " ".join(token)
-            ibest_writer["token_int"][key] = " ".join(map(str, token_int))
-            ibest_writer["score"][key] = str(hyp.score)
+            for key, (text, token, token_int, hyp, _) in zip(keys, results):
+                # Write the result to each file
+                ibest_writer["token"][key] = " ".join(token)
+                ibest_writer["token_int"][key] = " ".join(map(str, token_int))
+                ibest_writer["score"][key] = str(hyp.score)
 
-            if text is not None:
-                ibest_writer["text"][key] = text
+                if text is not None:
+                    ibest_writer["text"][key] = text
 
 
 def get_parser():
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+import logging
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from typeguard import check_argument_types
+
+from src.encoder.my_branchformer.encoder import MyBranchformerEncoder
+from src.tasks.asr import ASRTask
+from espnet2.layers.utterance_mvn import UtteranceMVN
+from espnet2.text.build_tokenizer import build_tokenizer
+from espnet2.text.token_id_converter import TokenIDConverter
+
+
+class Speech2TextStreaming:
+    """Speech2TextStreaming class
+
+    Blockwise streaming CTC decoding with a MyBranchformerEncoder. The audio is
+    fed in arbitrary pieces and every call returns the tokens recognised in the
+    encoder chunks completed so far. Each encoder layer only keeps
+    `left_context` frames of history, so latency and memory are bounded
+    independently of how long the stream lasts.
+
+    Examples:
+        >>> speech2text = Speech2TextStreaming("asr_config.yml", "asr.pth")
+        >>> for piece in audio_pieces:
+        ...     text, token, token_int = speech2text(piece)
+        >>> text, token, token_int = speech2text(last_piece, is_final=True)
+
+    """
+
+    def __init__(
+        self,
+        asr_train_config: Union[Path, str],
+        asr_model_file: Union[Path, str] = None,
+        token_type: str = None,
+        bpemodel: str = None,
+        device: str = "cpu",
+        dtype: str = "float32",
+        chunk_size: int = 16,
+        left_context: int = 64,
+    ):
+        assert check_argument_types()
+
+        # 1. Build ASR model
+        asr_model, asr_train_args = ASRTask.build_model_from_file(
+            asr_train_config, asr_model_file, device
+        )
+        asr_model.to(dtype=getattr(torch, dtype)).eval()
+        if not isinstance(asr_model.encoder, MyBranchformerEncoder):
+            raise NotImplementedError(
+                f"streaming is not supported for {type(asr_model.encoder).__name__}"
+            )
+        if getattr(asr_model.frontend, "stft", None) is None:
+            raise NotImplementedError("streaming requires a frontend computing the STFT")
+        token_list = asr_model.token_list
+
+        # 2. [Optional] Build Text converter: e.g. bpe-sym -> Text
+        if token_type is None:
+            token_type = asr_train_args.token_type
+        if bpemodel is None:
+            bpemodel = asr_train_args.bpemodel
+
+        if token_type is None:
+            tokenizer = None
+        elif token_type == "bpe":
+            if bpemodel is not None:
+                tokenizer = build_tokenizer(token_type=token_type, bpemodel=bpemodel)
+            else:
+                tokenizer = None
+        else:
+            tokenizer = build_tokenizer(token_type=token_type)
+        converter = TokenIDConverter(token_list=token_list)
+        logging.info(f"Text tokenizer: {tokenizer}")
+
+        self.asr_model = asr_model
+        self.asr_train_args = asr_train_args
+        self.converter = converter
+        self.tokenizer = tokenizer
+        self.device = device
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.left_context = left_context
+
+        # number of input feature frames making up one encoder chunk
+        _, stride = asr_model.encoder._subsampling_window()
+        self.chunk_frames = chunk_size * stride
+
+        self.reset()
+
+    def reset(self):
+        """Forget the stream, e.g. before decoding a new session."""
+        self.wav_buffer = None
+        self.wav_offset = 0
+        self.n_frames = 0
+        self.feats_buffer = None
+        self.feats_sum = None
+        self.feats_sqsum = None
+        self.encoder_states = None
+        self.last_token_id = 0
+
+    def _extract_feats(self, speech: torch.Tensor, is_final: bool) -> torch.Tensor:
+        """Compute the frontend features of the frames completed by `speech`.
+
+        Only frames whose STFT window lies inside the received audio are
+        emitted, so the features match the ones of the whole utterance.
+
+        Args:
+            speech: new samples of the stream (Nsamples,)
+            is_final: also emit the last frames, padded as at utterance end
+        Returns:
+            features (1, Nframes, D)
+        """
+        frontend = self.asr_model.frontend
+        if self.wav_buffer is not None:
+            speech = torch.cat([self.wav_buffer, speech])
+
+        n_fft, hop = frontend.stft.n_fft, frontend.stft.hop_length
+        if is_final:
+            n_total = (self.wav_offset + speech.size(0)) // hop + 1
+            n_new = n_total - self.n_frames
+        elif self.n_frames == 0:
+            # the first frames are centered on reflect-padded audio, wait until
+            # the next frame window starts inside the received audio
+            n_new = max(0, (speech.size(0) - n_fft // 2) // hop + 1)
+            if n_new * hop < n_fft // 2:
+                n_new = 0
+        else:
+            n_new = max(0, (speech.size(0) - n_fft) // hop + 1)
+
+        if n_new <= 0:
+            self.wav_buffer = speech
+            return speech.new_zeros(1, 0, frontend.output_size())
+
+        if self.n_frames == 0:
+            wav, first = speech, 0
+        else:
+            # left-pad so that the frame windows start at the buffer samples
+            pad = (-(n_fft // 2)) % hop
+            wav, first = torch.cat([speech.new_zeros(pad), speech]), (pad + n_fft // 2) // hop
+        lengths = wav.new_full([1], dtype=torch.long, fill_value=wav.size(0))
+        feats, _ = frontend(wav.unsqueeze(0), lengths)
+        feats = feats[:, first : first + n_new]
+
+        # keep the samples needed by the next frame window
+        self.n_frames += n_new
+        start = max(0, self.n_frames * hop - n_fft // 2 - self.wav_offset)
+        self.wav_buffer = speech[start:]
+        self.wav_offset += start
+        return feats
+
+    def _normalize(self, feats: torch.Tensor) -> torch.Tensor:
+        """Normalize with statistics of the stream received so far."""
+        normalize = self.asr_model.normalize
+        if normalize is None or feats.size(1) == 0:
+            return feats
+        if not isinstance(normalize, UtteranceMVN):
+            lengths = feats.new_full([1], dtype=torch.long, fill_value=feats.size(1))
+            return normalize(feats, lengths)[0]
+
+        # utterance statistics are replaced by running ones
+        if self.feats_sum is None:
+            self.feats_sum = feats.new_zeros(feats.size(-1))
+            self.feats_sqsum = feats.new_zeros(feats.size(-1))
+        self.feats_sum += feats[0].sum(0)
+        self.feats_sqsum += feats[0].pow(2).sum(0)
+        mean = self.feats_sum / self.n_frames
+        if normalize.norm_means:
+            feats = feats - mean
+        if normalize.norm_vars:
+            var = self.feats_sqsum / self.n_frames - mean.pow(2)
+            feats = feats / torch.clamp(var.clamp(min=0).sqrt(), min=normalize.eps)
+        return feats
+
+    @torch.no_grad()
+    def __call__(
+        self,
+        speech: Union[torch.Tensor, np.ndarray],
+        is_final: bool = False,
+    ) -> Tuple[Optional[str], List[str], List[int]]:
+        """Inference on the next piece of the stream
+
+        Args:
+            speech: New samples of the stream (Nsamples,)
+            is_final: Whether the stream ends with this piece
+        Returns:
+            text, token, token_int recognised since the previous call
+
+        """
+        assert check_argument_types()
+
+        if isinstance(speech, np.ndarray):
+            speech = torch.tensor(speech)
+        speech = speech.to(device=self.device, dtype=getattr(torch, self.dtype))
+
+        # a. Features of the completed frames
+        feats = self._normalize(self._extract_feats(speech, is_final))
+        if self.feats_buffer is not None:
+            feats = torch.cat([self.feats_buffer, feats], dim=1)
+
+        # b. Forward Encoder chunk by chunk
+        n_chunks = feats.size(1) // self.chunk_frames
+        if is_final:
+            n_used = feats.size(1)
+        else:
+            n_used = n_chunks * self.chunk_frames
+        self.feats_buffer = feats[:, n_used:] if not is_final else None
+
+        token_int = []
+        if n_used > 0:
+            enc, self.encoder_states = self.asr_model.encoder.forward_infer(
+                feats[:, :n_used],
+                prev_states=self.encoder_states,
+                is_final=is_final,
+                ctc=self.asr_model.ctc,
+                left_context=self.left_context,
+            )
+
+            # c. Greedy CTC, collapsing repeats across chunk boundaries
+            for token_id in self.asr_model.ctc.argmax(enc)[0].tolist():
+                if token_id != self.last_token_id and token_id != 0:
+                    token_int.append(token_id)
+                self.last_token_id = token_id
+
+        token = self.converter.ids2tokens(token_int)
+        if self.tokenizer is not None:
+            text = self.tokenizer.tokens2text(token)
+        else:
+            text = None
+
+        if is_final:
+            self.reset()
+        return text, token, token_int
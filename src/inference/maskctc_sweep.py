@@ -0,0 +1,131 @@
+import sys
+from typing import List, Sequence, Tuple
+
+import pandas as pd
+import torch
+from tqdm import tqdm
+from colorama import Fore
+
+from src.evaluation import ErrorRateAccumulator
+
+
+class MaskCTCSweep:
+    """Grid search of the Mask-CTC decoding settings over cached encoder outputs
+
+    The frontend and encoder run once per utterance and their outputs are
+    kept in memory. Every (n_iterations, threshold_probability) setting is
+    then decoded from that cache: the greedy CTC tokens and the decoder
+    memory key/value are shared by all the settings, and several settings
+    of the same utterances are stacked into one decoder batch.
+
+    Examples:
+        >>> speech2text = ASR2TextMaskCTC("asr_config.yml", "asr.pth")
+        >>> sweep = MaskCTCSweep(speech2text, [1, 5, 10], [0.9, 0.99])
+        >>> sweep.encode(eval_loader)
+        >>> table = sweep.evaluate()
+
+    """
+
+    def __init__(
+        self,
+        speech2text,
+        n_iterations_grid: Sequence[int],
+        threshold_grid: Sequence[float],
+        batch_size: int = 8,
+        max_rows: int = 256,
+    ):
+        self.speech2text = speech2text
+        self.s2t = speech2text.s2t
+        self.grid = [(K, th) for K in n_iterations_grid for th in threshold_grid]
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.encoder_cache: List[Tuple[torch.Tensor, str]] = []
+
+    @torch.no_grad()
+    def encode(self, eval_loader, batch_transforms=None):
+        """Run the frontend and encoder once per utterance and cache their outputs
+
+        Args:
+            eval_loader: dataloader of the evaluation set, as built by get_dataloader
+            batch_transforms: optional transforms of the padded speech batches
+        Returns:
+            list of (encoder output (T, D) on CPU, reference) per utterance
+        """
+        device = self.speech2text.device
+        dtype = getattr(torch, self.speech2text.dtype)
+
+        self.encoder_cache = []
+        for batch in tqdm(eval_loader, position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.BLUE, Fore.RESET)):
+            speech = batch['speech'].to(device=device, dtype=dtype)
+            speech_lengths = batch['speech_lengths'].to(device=device, dtype=torch.long)
+            if batch_transforms is not None:
+                speech, speech_lengths = batch_transforms(speech, speech_lengths)
+
+            enc, enc_lens = self.speech2text.asr_model.encode(speech, speech_lengths, paths=batch.get('path'))
+            if isinstance(enc, tuple):
+                enc = enc[0]
+
+            for enc_out, enc_len, ref in zip(enc, enc_lens.tolist(), batch['ref']):
+                self.encoder_cache.append((enc_out[:enc_len].cpu(), ref.strip()))
+
+        return self.encoder_cache
+
+    @torch.no_grad()
+    def evaluate(self) -> pd.DataFrame:
+        """Decode the cached encoder outputs with every setting of the grid
+
+        Returns:
+            table of the settings and their WER, CER and confidence intervals,
+            ranked from the lowest WER
+        """
+        device = self.speech2text.device
+        error_rates = [ErrorRateAccumulator() for _ in self.grid]
+
+        # settings decoded at once, so that each decoder batch has at most max_rows rows
+        grid_chunk = max(1, self.max_rows // self.batch_size)
+
+        for start in tqdm(range(0, len(self.encoder_cache), self.batch_size), position=0, leave=True, file=sys.stdout, bar_format="{l_bar}%s{bar:10}%s{r_bar}" % (Fore.YELLOW, Fore.RESET)):
+            utterances = self.encoder_cache[start:start + self.batch_size]
+            enc_lens = torch.tensor([enc_out.size(0) for enc_out, _ in utterances], device=device)
+            enc = torch.nn.utils.rnn.pad_sequence([enc_out for enc_out, _ in utterances], batch_first=True).to(device)
+            n_utts = len(utterances)
+
+            # shared by every setting of the grid
+            y_hat, probs_hat, y_lens = self.s2t.greedy_ctc(enc, enc_lens)
+            memory_cache = None
+            if hasattr(self.s2t.mlm, "init_memory_cache"):
+                memory_cache = self.s2t.mlm.init_memory_cache(enc)
+
+            for first in range(0, len(self.grid), grid_chunk):
+                settings = self.grid[first:first + grid_chunk]
+                n_settings = len(settings)
+
+                # rows are laid out setting by setting: row = setting * n_utts + utterance
+                n_iterations = torch.tensor([K for K, _ in settings], device=device).repeat_interleave(n_utts)
+                threshold_probability = torch.tensor([th for _, th in settings], device=device, dtype=probs_hat.dtype).repeat_interleave(n_utts)
+                hyps = self.s2t.refine(
+                    enc.repeat(n_settings, 1, 1),
+                    enc_lens.repeat(n_settings),
+                    y_hat.repeat(n_settings, 1),
+                    probs_hat.repeat(n_settings, 1),
+                    y_lens.repeat(n_settings),
+                    n_iterations,
+                    threshold_probability,
+                    memory_cache=None if memory_cache is None else [
+                        (key.repeat(n_settings, 1, 1, 1), value.repeat(n_settings, 1, 1, 1))
+                        for key, value in memory_cache
+                    ],
+                )
+
+                for row, hyp in enumerate(hyps):
+                    setting, utt = divmod(row, n_utts)
+                    text = self.speech2text.hyp2text(hyp)[0] or ""
+                    error_rates[first + setting].add(utterances[utt][1], text.strip())
+
+        table = []
+        for (K, th), setting_error_rates in zip(self.grid, error_rates):
+            wer, cer, ci_wer, ci_cer = setting_error_rates.summary()
+            table.append((K, th, wer, cer, ci_wer, ci_cer))
+
+        table = pd.DataFrame(table, columns=["n_iterations", "threshold_probability", "wer", "cer", "ci_wer", "ci_cer"])
+        return table.sort_values(["wer", "cer"], kind="stable").reset_index(drop=True)
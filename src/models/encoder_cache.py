@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+def state_dict_hash(model: torch.nn.Module) -> str:
+    """Fingerprint of the parameters and buffers of a model, used to key its encoder outputs."""
+    sha = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        sha.update(name.encode("utf-8"))
+        sha.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+
+class EncoderOutputCache:
+    """Encoder outputs stored on disk, with size-bounded LRU eviction
+
+    Each entry holds the encoder output of one utterance stacked with its
+    intermediate CTC outputs, (1 + n_intermediate, T, D), in its own .npy
+    file, so it is read back as a copy-on-write memory-mapped array.
+    'index.json' keeps the entries from the least to the most recently used,
+    together with their size and intermediate layer indices. When the stored bytes exceed
+    `max_bytes`, the least recently used entries are removed. The index is
+    rewritten every `flush_every` new entries and by flush(), which the
+    caller runs once decoding is over.
+
+    Entries are keyed by (model hash, waveform path, transform config): the
+    outputs are only valid for the same weights and the same audio
+    preprocessing, and random transforms are cached as drawn the first time.
+    Sample IDs are not used, as they may be shared by utterances of
+    different splits.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 16 * 2**30, flush_every: int = 1000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.entries = OrderedDict()
+        index_path = os.path.join(cache_dir, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                for key, nbytes, layer_ids in json.load(f)["entries"]:
+                    if os.path.exists(self._path(key)):
+                        self.entries[key] = (nbytes, layer_ids)
+        self.total_bytes = sum(nbytes for nbytes, _ in self.entries.values())
+        self.dirty = False
+        self.puts_since_flush = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    @staticmethod
+    def key(model_hash: str, path: str, transform_key: str = "") -> str:
+        return hashlib.sha1(f"{model_hash}|{transform_key}|{path}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, List[int]]]:
+        """Returns the memory-mapped outputs (1 + n_intermediate, T, D) and the intermediate layer indices."""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        self.dirty = True
+        return np.load(self._path(key), mmap_mode="c"), self.entries[key][1]
+
+    def put(self, key: str, outputs: np.ndarray, layer_ids: List[int]):
+        # -- written aside and renamed, so a crash never leaves a truncated entry
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, outputs)
+        os.replace(tmp_path, self._path(key))
+
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[0]
+        self.entries[key] = (outputs.nbytes, list(layer_ids))
+        self.total_bytes += outputs.nbytes
+        self.dirty = True
+
+        # -- least recently used entries go first
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, (nbytes, _) = self.entries.popitem(last=False)
+            self.total_bytes -= nbytes
+            os.remove(self._path(old_key))
+
+        # -- the index grows with every entry, so it is only rewritten now and then
+        self.puts_since_flush += 1
+        if self.puts_since_flush >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Writes the index, so the entries and their recency survive the process."""
+        if not self.dirty:
+            return
+        index_path = os.path.join(self.cache_dir, "index.json")
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({"entries": [[key, nbytes, layer_ids] for key, (nbytes, layer_ids) in self.entries.items()]}, f)
+        os.replace(index_path + ".tmp", index_path)
+        self.dirty = False
+        self.puts_since_flush = 0
+
+    def encode(
+        self,
+        encode_fn: Callable,
+        speech: torch.Tensor,
+        speech_lengths: torch.Tensor,
+        keys: List[str],
+    ):
+        """Encoder outputs of a batch, only encoding the utterances that are not cached
+
+        Args:
+            encode_fn: frontend + encoder, e.g. ESPnetASRModel._encode
+            speech: (Batch, Length, ...)
+            speech_lengths: (Batch, )
+            keys: cache key of each utterance
+        Returns:
+            the outputs of encode_fn, padded with zeros
+        """
+        cached = [self.get(key) for key in keys]
+
+        # -- encoding the missing utterances as a smaller batch
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+        if len(missing) > 0:
+            rows = torch.tensor(missing, device=speech.device)
+            encoder_out, encoder_out_lens = encode_fn(speech[rows], speech_lengths[rows])
+            intermediate_outs = []
+            if isinstance(encoder_out, tuple):
+                encoder_out, intermediate_outs = encoder_out
+
+            layer_ids = [layer_idx for layer_idx, _ in intermediate_outs]
+            for j, (i, length) in enumerate(zip(missing, encoder_out_lens.tolist())):
+                outputs = torch.stack(
+                    [encoder_out[j, :length]] + [out[j, :length] for _, out in intermediate_outs]
+                )
+                outputs = outputs.detach().float().cpu().numpy()
+                self.put(keys[i], outputs, layer_ids)
+                cached[i] = (outputs, layer_ids)
+
+        # -- padding the cached and new outputs into a single batch
+        layer_ids = cached[0][1]
+        lengths = [outputs.shape[1] for outputs, _ in cached]
+        padded = torch.zeros(
+            len(cached), 1 + len(layer_ids), max(lengths), cached[0][0].shape[-1], dtype=speech.dtype
+        )
+        for i, (outputs, _) in enumerate(cached):
+            padded[i, :, : lengths[i]] = torch.from_numpy(outputs)
+        padded = padded.to(speech.device)
+        encoder_out_lens = torch.tensor(lengths, dtype=torch.long, device=speech.device)
+
+        if len(layer_ids) > 0:
+            intermediate_outs = [(layer_idx, padded[:, k + 1]) for k, layer_idx in enumerate(layer_ids)]
+            return (padded[:, 0], intermediate_outs), encoder_out_lens
+        return padded[:, 0], encoder_out_lens
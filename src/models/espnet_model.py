@@ -1,5 +1,5 @@
 import logging
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from typing import Dict, List, Optional, Tuple, Union
 
 import torch
@@ -8,6 +8,7 @@ from packaging.version import parse as V
 from typeguard import check_argument_types
 
 from src.ctc.ctc import CTC
+from src.models.encoder_cache import state_dict_hash
 from src.ctc.interctc_residual_module import InterCTCResidualModule
 from espnet2.asr.decoder.abs_decoder import AbsDecoder
 from espnet2.asr.encoder.abs_encoder import AbsEncoder
@@ -206,6 +207,13 @@ class ESPnetASRModel(AbsESPnetModel):
         else:
             self.lang_token_id = None
 
+        # optional on-disk cache of the encoder outputs, see set_encoder_cache
+        self.encoder_cache = None
+        self.encoder_cache_prefix = None
+
+        # optional per-stage timer of the forward, see set_stage_timer
+        self.stage_timer = None
+
     def forward(
         self,
         speech: torch.Tensor,
@@ -385,16 +393,75 @@ class ESPnetASRModel(AbsESPnetModel):
         feats, feats_lengths = self._extract_feats(speech, speech_lengths)
         return {"feats": feats, "feats_lengths": feats_lengths}
 
+    def set_encoder_cache(self, cache, transform_key: str = ""):
+        """Reuse encoder outputs stored in an EncoderOutputCache
+
+        The entries are keyed by the current weights of the modules that
+        produce the encoder outputs, so the cache has to be set after loading
+        the checkpoint, and it stays valid when only the decoder changes.
+
+        Args:
+            cache: EncoderOutputCache, or None to disable it
+            transform_key: description of the audio preprocessing
+        """
+        self.encoder_cache = cache
+        self.encoder_cache_prefix = None
+        if cache is not None:
+            self.encoder_cache_prefix = (state_dict_hash(self._encoder_modules()), transform_key)
+
+    def _encoder_modules(self) -> torch.nn.ModuleDict:
+        """Modules whose weights determine the encoder outputs"""
+        names = ["frontend", "normalize", "preencoder", "encoder", "postencoder"]
+        if self.encoder.interctc_use_conditioning:
+            # the intermediate CTC predictions are fed back into the encoder
+            names.append("ctc")
+        return torch.nn.ModuleDict(
+            {name: getattr(self, name) for name in names if getattr(self, name) is not None}
+        )
+
+    def set_stage_timer(self, timer):
+        """Time the stages of the forward, e.g. with a TrainingProfiler
+
+        Args:
+            timer: object whose stage(name) method returns a context
+                manager timing that stage, or None to disable it
+        """
+        self.stage_timer = timer
+
+    def _stage(self, name: str):
+        if self.stage_timer is None:
+            return nullcontext()
+        return self.stage_timer.stage(name)
+
     def encode(
-        self, speech: torch.Tensor, speech_lengths: torch.Tensor
+        self,
+        speech: torch.Tensor,
+        speech_lengths: torch.Tensor,
+        paths: Optional[List[str]] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """Frontend + Encoder. Note that this method is used by asr_inference.py
 
         Args:
             speech: (Batch, Length, ...)
             speech_lengths: (Batch, )
+            paths: (Batch, ) waveform paths of the utterances, needed to read
+                and fill the encoder cache in eval mode. Cached outputs carry
+                no gradient.
         """
-        with autocast(False):
+        if self.encoder_cache is not None and paths is not None and not self.training:
+            model_hash, transform_key = self.encoder_cache_prefix
+            keys = [
+                self.encoder_cache.key(model_hash, path, transform_key)
+                for path in paths
+            ]
+            return self.encoder_cache.encode(self._encode, speech, speech_lengths, keys)
+
+        return self._encode(speech, speech_lengths)
+
+    def _encode(
+        self, speech: torch.Tensor, speech_lengths: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        with self._stage("frontend"), torch.autocast(speech.device.type, enabled=False):
             # 1. Extract feats
             feats, feats_lengths = self._extract_feats(speech, speech_lengths)
 
@@ -406,29 +473,30 @@ class ESPnetASRModel(AbsESPnetModel):
             if self.normalize is not None:
                 feats, feats_lengths = self.normalize(feats, feats_lengths)
 
-        # Pre-encoder, e.g. used for raw input data
-        if self.preencoder is not None:
-            feats, feats_lengths = self.preencoder(feats, feats_lengths)
-
-        # 4. Forward encoder
-        # feats: (Batch, Length, Dim)
-        # -> encoder_out: (Batch, Length2, Dim2)
-        if self.encoder.interctc_use_conditioning:
-            encoder_out, encoder_out_lens, _ = self.encoder(
-                feats, feats_lengths, ctc=self.ctc
-            )
-        else:
-            encoder_out, encoder_out_lens, _ = self.encoder(feats, feats_lengths)
-        intermediate_outs = None
-        if isinstance(encoder_out, tuple):
-            intermediate_outs = encoder_out[1]
-            encoder_out = encoder_out[0]
-
-        # Post-encoder, e.g. NLU
-        if self.postencoder is not None:
-            encoder_out, encoder_out_lens = self.postencoder(
-                encoder_out, encoder_out_lens
-            )
+        with self._stage("encoder"):
+            # Pre-encoder, e.g. used for raw input data
+            if self.preencoder is not None:
+                feats, feats_lengths = self.preencoder(feats, feats_lengths)
+
+            # 4. Forward encoder
+            # feats: (Batch, Length, Dim)
+            # -> encoder_out: (Batch, Length2, Dim2)
+            if self.encoder.interctc_use_conditioning:
+                encoder_out, encoder_out_lens, _ = self.encoder(
+                    feats, feats_lengths, ctc=self.ctc
+                )
+            else:
+                encoder_out, encoder_out_lens, _ = self.encoder(feats, feats_lengths)
+            intermediate_outs = None
+            if isinstance(encoder_out, tuple):
+                intermediate_outs = encoder_out[1]
+                encoder_out = encoder_out[0]
+
+            # Post-encoder, e.g. NLU
+            if self.postencoder is not None:
+                encoder_out, encoder_out_lens = self.postencoder(
+                    encoder_out, encoder_out_lens
+                )
 
         assert encoder_out.size(0) == speech.size(0), (
             encoder_out.size(),
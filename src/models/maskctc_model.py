@@ -1,9 +1,7 @@
 import logging
 from contextlib import contextmanager
-from itertools import groupby
 from typing import Dict, List, Optional, Tuple, Union
 
-import numpy
 import torch
 from packaging.version import parse as V
 from typeguard import check_argument_types
@@ -11,7 +9,7 @@ from typeguard import check_argument_types
 from src.decoder.sim_t.mlm_decoder import MLMDecoderSimT
 
 from src.ctc.ctc import CTC
-from espnet2.asr.decoder.mlm_decoder import MLMDecoder
+from src.decoder.mlm.mlm_decoder import MLMDecoder
 from espnet2.asr.encoder.abs_encoder import AbsEncoder
 from src.models.espnet_model import ESPnetASRModel
 from espnet2.asr.frontend.abs_frontend import AbsFrontend
@@ -160,65 +158,68 @@ class MaskCTCModel(ESPnetASRModel):
             encoder_out = encoder_out[0]
 
         # 2. CTC branch
-        if self.ctc_weight != 0.0:
-            loss_ctc, cer_ctc = self._calc_ctc_loss(
-                encoder_out, encoder_out_lens, text, text_lengths
-            )
-            # Collect CTC branch stats
-            stats["loss_ctc"] = loss_ctc.detach() if loss_ctc is not None else None
-            stats["cer_ctc"] = cer_ctc
+        with self._stage("ctc"):
+            if self.ctc_weight != 0.0:
+                loss_ctc, cer_ctc = self._calc_ctc_loss(
+                    encoder_out, encoder_out_lens, text, text_lengths
+                )
+                # Collect CTC branch stats
+                stats["loss_ctc"] = loss_ctc.detach() if loss_ctc is not None else None
+                stats["cer_ctc"] = cer_ctc
 
         # 2a. Intermediate CTC (optional)
-        loss_interctc = 0.0
-        if self.interctc_weight != 0.0 and intermediate_outs is not None:
-            for layer_idx, intermediate_out in intermediate_outs:
-                # we assume intermediate_out has the same length & padding
-                # as those of encoder_out
-
-                # use auxiliary ctc data if specified
-                loss_ic = None
-                if self.aux_ctc is not None:
-                    idx_key = str(layer_idx)
-                    if idx_key in self.aux_ctc:
-                        aux_data_key = self.aux_ctc[idx_key]
-                        aux_data_tensor = kwargs.get(aux_data_key, None)
-                        aux_data_lengths = kwargs.get(aux_data_key + "_lengths", None)
-
-                        if aux_data_tensor is not None and aux_data_lengths is not None:
-                            loss_ic, cer_ic = self._calc_ctc_loss(
-                                intermediate_out,
-                                encoder_out_lens,
-                                aux_data_tensor,
-                                aux_data_lengths,
-                            )
-                        else:
-                            raise Exception(
-                                "Aux. CTC tasks were specified but no data was found"
-                            )
-                if loss_ic is None:
-                    loss_ic, cer_ic = self._calc_ctc_loss(
-                        intermediate_out, encoder_out_lens, text, text_lengths
+        with self._stage("interctc"):
+            loss_interctc = 0.0
+            if self.interctc_weight != 0.0 and intermediate_outs is not None:
+                for layer_idx, intermediate_out in intermediate_outs:
+                    # we assume intermediate_out has the same length & padding
+                    # as those of encoder_out
+
+                    # use auxiliary ctc data if specified
+                    loss_ic = None
+                    if self.aux_ctc is not None:
+                        idx_key = str(layer_idx)
+                        if idx_key in self.aux_ctc:
+                            aux_data_key = self.aux_ctc[idx_key]
+                            aux_data_tensor = kwargs.get(aux_data_key, None)
+                            aux_data_lengths = kwargs.get(aux_data_key + "_lengths", None)
+
+                            if aux_data_tensor is not None and aux_data_lengths is not None:
+                                loss_ic, cer_ic = self._calc_ctc_loss(
+                                    intermediate_out,
+                                    encoder_out_lens,
+                                    aux_data_tensor,
+                                    aux_data_lengths,
+                                )
+                            else:
+                                raise Exception(
+                                    "Aux. CTC tasks were specified but no data was found"
+                                )
+                    if loss_ic is None:
+                        loss_ic, cer_ic = self._calc_ctc_loss(
+                            intermediate_out, encoder_out_lens, text, text_lengths
+                        )
+                    loss_interctc = loss_interctc + loss_ic
+
+                    # Collect Intermedaite CTC stats
+                    stats["loss_interctc_layer{}".format(layer_idx)] = (
+                        loss_ic.detach() if loss_ic is not None else None
                     )
-                loss_interctc = loss_interctc + loss_ic
+                    stats["cer_interctc_layer{}".format(layer_idx)] = cer_ic
 
-                # Collect Intermedaite CTC stats
-                stats["loss_interctc_layer{}".format(layer_idx)] = (
-                    loss_ic.detach() if loss_ic is not None else None
-                )
-                stats["cer_interctc_layer{}".format(layer_idx)] = cer_ic
+                loss_interctc = loss_interctc / len(intermediate_outs)
 
-            loss_interctc = loss_interctc / len(intermediate_outs)
-
-            # calculate whole encoder loss
-            loss_ctc = (
-                1 - self.interctc_weight
-            ) * loss_ctc + self.interctc_weight * loss_interctc
+                # calculate whole encoder loss
+                loss_ctc = (
+                    1 - self.interctc_weight
+                ) * loss_ctc + self.interctc_weight * loss_interctc
 
         # 3. MLM decoder branch
-        if self.ctc_weight != 1.0:
-            loss_mlm, acc_mlm = self._calc_mlm_loss(
-                encoder_out, encoder_out_lens, text, text_lengths
-            )
+        with self._stage("mlm_decoder"):
+            if self.ctc_weight != 1.0:
+                loss_mlm, acc_mlm = self._calc_mlm_loss(
+                    encoder_out, encoder_out_lens, text, text_lengths
+                )
 
         # 4. CTC/MLM loss definition
         if self.ctc_weight == 0.0:
@@ -272,8 +273,11 @@ class MaskCTCModel(ESPnetASRModel):
             encoder_out, encoder_out_lens, ys_in_pad, ys_pad_lens
         )
 
-        # 3. Compute mlm loss
-        loss_mlm = self.criterion_mlm(decoder_out, ys_out_pad)
+        # 3. Compute mlm loss, at least in fp32 under mixed precision
+        loss_mlm = self.criterion_mlm(
+            decoder_out.to(torch.promote_types(decoder_out.dtype, torch.float32)),
+            ys_out_pad,
+        )
         acc_mlm = th_accuracy(
             decoder_out.view(-1, self.vocab_size),
             ys_out_pad,
@@ -324,68 +328,207 @@ class MaskCTCInference(torch.nn.Module):
         text = "".join(self.converter.ids2tokens(ids))
         return text.replace("<mask>", "_").replace("<space>", " ")
 
-    def forward(self, enc_out: torch.Tensor) -> List[Hypothesis]:
-        """Perform Mask-CTC inference"""
-        # greedy ctc outputs
-        enc_out = enc_out.unsqueeze(0)
-        ctc_probs, ctc_ids = torch.exp(self.ctc.log_softmax(enc_out)).max(dim=-1)
-        y_hat = torch.stack([x[0] for x in groupby(ctc_ids[0])])
-        y_idx = torch.nonzero(y_hat != 0).squeeze(-1)
-
-        logging.info("ctc:{}".format(self.ids2text(y_hat[y_idx].tolist())))
-
-        # calculate token-level ctc probabilities by taking
-        # the maximum probability of consecutive frames with
-        # the same ctc symbols
-        probs_hat = []
-        cnt = 0
-        for i, y in enumerate(y_hat.tolist()):
-            probs_hat.append(-1)
-            while cnt < ctc_ids.shape[1] and y == ctc_ids[0][cnt]:
-                if probs_hat[i] < ctc_probs[0][cnt]:
-                    probs_hat[i] = ctc_probs[0][cnt].item()
-                cnt += 1
-        probs_hat = torch.from_numpy(
-            numpy.array(probs_hat)
-        ).to(enc_out.device)
+    def forward(
+        self, enc_out: torch.Tensor, enc_out_lens: Optional[torch.Tensor] = None
+    ) -> Union[Hypothesis, List[Hypothesis]]:
+        """Perform Mask-CTC inference
 
-        # mask ctc outputs based on ctc probabilities
-        p_thres = self.threshold_probability
-        mask_idx = torch.nonzero(probs_hat[y_idx] < p_thres).squeeze(-1)
-        confident_idx = torch.nonzero(probs_hat[y_idx] >= p_thres).squeeze(-1)
-        mask_num = len(mask_idx)
-
-        y_in = (
-            torch.zeros(1, len(y_idx), dtype=torch.long).to(enc_out.device)
-            + self.mask_token
+        Args:
+            enc_out: encoder output of one utterance (T, D)
+                or of a padded batch of utterances (B, T, D)
+            enc_out_lens: (B,) only used with batched inputs
+        Returns:
+            a Hypothesis for one utterance or a list of them for batched inputs
+        """
+        if enc_out.dim() == 2:
+            return self.batch_forward(enc_out.unsqueeze(0))[0]
+        return self.batch_forward(enc_out, enc_out_lens)
+
+    def batch_forward(
+        self, enc_out: torch.Tensor, enc_out_lens: Optional[torch.Tensor] = None
+    ) -> List[Hypothesis]:
+        """Perform Mask-CTC inference over a padded batch of utterances
+
+        Each utterance keeps its own masks and number of iterations, so the
+        hypotheses are the same as decoding the utterances one at a time.
+
+        Args:
+            enc_out: (B, T, D)
+            enc_out_lens: (B,)
+        Returns:
+            list of Hypothesis, one per utterance
+        """
+        batch_size = enc_out.size(0)
+        if enc_out_lens is None:
+            enc_out_lens = torch.full(
+                [batch_size], enc_out.size(1), dtype=torch.long, device=enc_out.device
+            )
+
+        y_hat, probs_hat, y_lens = self.greedy_ctc(enc_out, enc_out_lens)
+        return self.refine(
+            enc_out,
+            enc_out_lens,
+            y_hat,
+            probs_hat,
+            y_lens,
+            self.n_iterations,
+            self.threshold_probability,
         )
-        y_in[0][confident_idx] = y_hat[y_idx][confident_idx]
 
-        logging.info("msk:{}".format(self.ids2text(y_in[0].tolist())))
+    def greedy_ctc(
+        self, enc_out: torch.Tensor, enc_out_lens: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Greedy CTC tokens and their probabilities, the input of `refine`
+
+        Args:
+            enc_out: (B, T, D)
+            enc_out_lens: (B,)
+        Returns:
+            token ids (B, L), token-level probabilities (B, L), number of tokens (B,)
+        """
+        ctc_probs, ctc_ids = torch.exp(self.ctc.log_softmax(enc_out)).max(dim=-1)
+
+        # calculate token-level ctc outputs and probabilities
+        y_hat, probs_hat, y_lens = self._token_probs(ctc_ids, ctc_probs, enc_out_lens)
+
+        self._log_tokens("ctc", y_hat, y_lens)
 
-        # iterative decoding
-        if not mask_num == 0:
-            K = self.n_iterations
-            num_iter = K if mask_num >= K and K > 0 else mask_num
+        return y_hat, probs_hat, y_lens
 
-            for t in range(num_iter - 1):
-                pred, _ = self.mlm(enc_out, [enc_out.size(1)], y_in, [y_in.size(1)])
-                pred_score, pred_id = pred[0][mask_idx].max(dim=-1)
-                cand = torch.topk(pred_score, mask_num // num_iter, -1)[1]
-                y_in[0][mask_idx[cand]] = pred_id[cand]
-                mask_idx = torch.nonzero(y_in[0] == self.mask_token).squeeze(-1)
+    def refine(
+        self,
+        enc_out: torch.Tensor,
+        enc_out_lens: torch.Tensor,
+        y_hat: torch.Tensor,
+        probs_hat: torch.Tensor,
+        y_lens: torch.Tensor,
+        n_iterations: Union[int, torch.Tensor],
+        threshold_probability: Union[float, torch.Tensor],
+        memory_cache: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None,
+    ) -> List[Hypothesis]:
+        """Mask the low-confidence greedy CTC tokens and predict them with the MLM
 
-                logging.info("msk:{}".format(self.ids2text(y_in[0].tolist())))
+        Args:
+            enc_out: (B, T, D)
+            enc_out_lens: (B,)
+            y_hat, probs_hat, y_lens: outputs of `greedy_ctc`
+            n_iterations: number of iterations, shared or per utterance (B,)
+            threshold_probability: masking threshold, shared or per utterance (B,)
+            memory_cache: source-attention key/value of enc_out,
+                computed by the decoder `init_memory_cache` if not given
+        Returns:
+            list of Hypothesis, one per utterance
+        """
+        valid = torch.arange(y_hat.size(1), device=enc_out.device)[None, :] < y_lens[:, None]
+        if isinstance(threshold_probability, torch.Tensor):
+            threshold_probability = threshold_probability[:, None]
+
+        # mask ctc outputs based on ctc probabilities
+        mask = (probs_hat < threshold_probability) & valid
+        y_in = y_hat.masked_fill(mask, self.mask_token)
+        mask_num = mask.sum(dim=-1)
+
+        self._log_tokens("msk", y_in, y_lens)
+
+        # iterative decoding, with a per-utterance number of iterations
+        if mask_num.sum() > 0:
+            K = torch.as_tensor(n_iterations, device=enc_out.device).expand_as(mask_num)
+            num_iter = torch.where((mask_num >= K) & (K > 0), K, mask_num)
+            num_cand = mask_num // num_iter.clamp(min=1)
+            positions = torch.arange(y_in.size(1), device=enc_out.device).expand_as(y_in)
+
+            # the source-attention key/value of the encoder memory
+            # are computed once and reused along all the iterations
+            mlm_kwargs = {}
+            if isinstance(self.mlm, MLMDecoder):
+                if memory_cache is None:
+                    memory_cache = self.mlm.init_memory_cache(enc_out)
+                mlm_kwargs["memory_cache"] = memory_cache
+
+            for t in range(int(num_iter.max()) - 1):
+                pred, _ = self.mlm(enc_out, enc_out_lens, y_in, y_lens, **mlm_kwargs)
+                pred_score, pred_id = pred.max(dim=-1)
+
+                # rank masked positions by their score to keep the top candidates
+                pred_score = pred_score.masked_fill(~mask, float("-inf"))
+                order = pred_score.argsort(dim=-1, descending=True)
+                rank = torch.empty_like(order).scatter_(1, order, positions)
+                cand = mask & (rank < num_cand[:, None]) & (t < num_iter - 1)[:, None]
+
+                y_in = torch.where(cand, pred_id, y_in)
+                mask = (y_in == self.mask_token) & valid
+
+                self._log_tokens("msk", y_in, y_lens)
 
             # predict leftover masks (|masks| < mask_num // num_iter)
-            pred, _ = self.mlm(enc_out, [enc_out.size(1)], y_in, [y_in.size(1)])
-            y_in[0][mask_idx] = pred[0][mask_idx].argmax(dim=-1)
+            pred, _ = self.mlm(enc_out, enc_out_lens, y_in, y_lens, **mlm_kwargs)
+            y_in = torch.where(mask, pred.argmax(dim=-1), y_in)
 
-            logging.info("msk:{}".format(self.ids2text(y_in[0].tolist())))
+            self._log_tokens("msk", y_in, y_lens)
 
         # pad with mask tokens to ensure compatibility with sos/eos tokens
-        yseq = torch.tensor(
-            [self.mask_token] + y_in.tolist()[0] + [self.mask_token], device=y_in.device
-        )
+        hyps = []
+        for b, y_len in enumerate(y_lens.tolist()):
+            yseq = torch.tensor(
+                [self.mask_token] + y_in[b, :y_len].tolist() + [self.mask_token],
+                device=y_in.device,
+            )
+            hyps.append(Hypothesis(yseq=yseq))
+
+        return hyps
 
-        return Hypothesis(yseq=yseq)
+    def _token_probs(
+        self, ctc_ids: torch.Tensor, ctc_probs: torch.Tensor, ctc_lens: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Collapse greedy CTC paths into non-blank tokens and their probabilities
+
+        The token-level probability is the maximum probability of the
+        consecutive frames sharing the same ctc symbol. Runs of frames are
+        labelled with segment IDs and reduced with a scatter-max, so the
+        whole batch is processed on its device without Python loops.
+
+        Args:
+            ctc_ids: greedy ctc symbols (B, T)
+            ctc_probs: probabilities of the greedy ctc symbols (B, T)
+            ctc_lens: (B,)
+        Returns:
+            token ids padded with the mask token (B, L),
+            token-level probabilities padded with 1.0 (B, L),
+            number of tokens (B,)
+        """
+        batch_size, max_frames = ctc_ids.size()
+        frames = torch.arange(max_frames, device=ctc_ids.device)
+        valid = frames[None, :] < ctc_lens[:, None]
+
+        # run-length segment IDs, padded frames go to an extra dummy segment
+        is_start = torch.ones_like(valid)
+        is_start[:, 1:] = ctc_ids[:, 1:] != ctc_ids[:, :-1]
+        seg_ids = torch.cumsum(is_start, dim=-1) - 1
+        seg_ids = seg_ids.masked_fill(~valid, max_frames)
+
+        # segment symbols and their maximum frame probabilities
+        seg_tokens = ctc_ids.new_zeros(batch_size, max_frames + 1)
+        seg_tokens.scatter_(1, seg_ids, ctc_ids)
+        seg_probs = ctc_probs.new_zeros(batch_size, max_frames + 1)
+        seg_probs.scatter_reduce_(1, seg_ids, ctc_probs, reduce="amax", include_self=False)
+        seg_tokens, seg_probs = seg_tokens[:, :-1], seg_probs[:, :-1]
+
+        # keep non-blank segments, which is assumed to be 0, packed to the left
+        num_segs = (is_start & valid).sum(dim=-1)
+        keep = (seg_tokens != 0) & (frames[None, :] < num_segs[:, None])
+        y_lens = keep.sum(dim=-1)
+        token_pos = torch.cumsum(keep, dim=-1) - 1
+
+        max_tokens = int(y_lens.max()) if batch_size > 0 else 0
+        y_hat = ctc_ids.new_full((batch_size, max_tokens), self.mask_token)
+        probs_hat = ctc_probs.new_ones(batch_size, max_tokens)
+        rows, cols = torch.nonzero(keep, as_tuple=True)
+        y_hat[rows, token_pos[rows, cols]] = seg_tokens[rows, cols]
+        probs_hat[rows, token_pos[rows, cols]] = seg_probs[rows, cols]
+
+        return y_hat, probs_hat, y_lens
+
+    def _log_tokens(self, prefix: str, ys: torch.Tensor, y_lens: torch.Tensor):
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            for b, y_len in enumerate(y_lens.tolist()):
+                logging.info("{}:{}".format(prefix, self.ids2text(ys[b, :y_len].tolist())))
@@ -0,0 +1,24 @@
+import yaml
+import argparse
+from pathlib import Path
+
+from src.utils import get_tokenizer_converter
+from src.datasets import build_token_cache
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenizing once the transcripts of the dataset splits and storing their token IDs.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--config-file", required=True, type=str, help="Path to the config file specifying the tokenizer")
+    parser.add_argument("--split-paths", nargs='+', required=True, type=str, help="Paths to the dataset splits whose transcripts will be tokenized")
+    parser.add_argument("--cache-path", required=True, type=str, help="Path to the .npz file where the token IDs will be stored")
+    args = parser.parse_args()
+
+    # -- configuration architecture details
+    config_file = Path(args.config_file)
+    with config_file.open("r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    config = argparse.Namespace(**config)
+
+    tokenizer, converter = get_tokenizer_converter(config)
+    token_cache = build_token_cache(args.split_paths, args.cache_path, tokenizer, converter, config)
+    print(f"Stored the token IDs of {len(token_cache)} transcripts in {args.cache_path} (tokenizer {token_cache.tokenizer_hash})")
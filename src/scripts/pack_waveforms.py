@@ -0,0 +1,13 @@
+import argparse
+from src.datasets import pack_waveforms
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decoding once the waveforms of the dataset splits and packing them into a memory-mapped waveform store.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--split-paths", nargs='+', required=True, type=str, help="Paths to the dataset splits whose waveforms will be packed")
+    parser.add_argument("--store-dir", required=True, type=str, help="Directory where the waveform store will be written")
+    parser.add_argument("--dtype", default="int16", type=str, help="Sample type of the store: 'int16', 'float16' or 'float32'")
+    args = parser.parse_args()
+
+    store = pack_waveforms(args.split_paths, args.store_dir, dtype=args.dtype)
+    print(f"Packed {len(store)} waveforms into {args.store_dir}")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import warnings
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+warnings.filterwarnings("ignore", category=UserWarning)
+
+from src.inference import ASR2TextMaskCTC, MaskCTCSweep
+from src.models.encoder_cache import EncoderOutputCache
+
+import os
+import yaml
+import argparse
+import pandas as pd
+from pathlib import Path
+
+from src.utils import *
+from src.transforms import *
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tuning the Mask-CTC decoding settings of several checkpoints, encoding the validation set once per checkpoint.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--validation-dataset", required=True, type=str, help="Path to where the validation dataset split is")
+    parser.add_argument("--config-file", required=True, type=str, help="Path to a config file that specifies the model architecture")
+    parser.add_argument("--yaml-overrides", metavar="CONF:KEY:VALUE", nargs='*', help="Set a number of conf-key-value pairs for modifying the yaml config file on the fly.")
+    parser.add_argument("--checkpoints", nargs='+', required=True, type=str, help="Paths to the Mask-CTC-based ASR model checkpoints to evaluate")
+
+    parser.add_argument("--n-iterations", nargs='+', default=[1, 5, 10], type=int, help="Grid of Mask-CTC number of iterations")
+    parser.add_argument("--threshold-probabilities", nargs='+', default=[0.9, 0.99], type=float, help="Grid of Mask-CTC masking thresholds")
+    parser.add_argument("--batch-size", default=8, type=int, help="Number of utterances decoded at once")
+    parser.add_argument("--max-rows", default=256, type=int, help="Maximum decoder batch size, i.e. utterances times settings decoded at once")
+
+    parser.add_argument("--encoder-cache-dir", default="", type=str, help="Directory of an on-disk cache of the encoder outputs, reused across runs of the same checkpoints and SNR")
+    parser.add_argument("--encoder-cache-gb", default=16.0, type=float, help="Maximum size in GB of the encoder cache, the least recently used outputs are evicted")
+
+    parser.add_argument("--snr-target", default=9999, type=int, help="A specific signal-to-noise rate when adding noise to the audio waveform.")
+    parser.add_argument("--noise", nargs='+', default="./src/noise/babble_noise.wav", type=str, help="Path(s) to .wav file(s) of noise, each noisy sample draws its noise from one of them")
+    parser.add_argument("--output-dir", required=True, type=str, help="Path to save the CSV files with the ranked settings")
+
+    args = parser.parse_args()
+
+    # -- configuration architecture details
+    config_file = Path(args.config_file)
+    with config_file.open("r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    override_yaml(config, args.yaml_overrides)
+    config = argparse.Namespace(**config)
+
+    # -- building tokenizer and converter
+    tokenizer, converter = get_tokenizer_converter(config)
+
+    # -- creating validation dataloader
+    eval_audio_transforms = Compose([
+        AddNoise(noise_path=args.noise, sample_rate=16000, snr_target=args.snr_target),
+    ])
+    eval_loader = get_dataloader(config, dataset_path=args.validation_dataset, audio_transforms=eval_audio_transforms, tokenizer=tokenizer, converter=converter, is_training=False, batch_size=args.batch_size)
+
+    # -- optional cache of the encoder outputs, shared by all the checkpoints
+    encoder_cache = None
+    if args.encoder_cache_dir:
+        encoder_cache = EncoderOutputCache(args.encoder_cache_dir, max_bytes=int(args.encoder_cache_gb * 2**30))
+
+    # -- sweeping the grid of settings for each checkpoint
+    os.makedirs(args.output_dir, exist_ok=True)
+    tables = []
+    for checkpoint in args.checkpoints:
+        print(f"Sweeping {len(args.n_iterations) * len(args.threshold_probabilities)} Mask-CTC settings with {checkpoint}:")
+        speech2text = ASR2TextMaskCTC(
+            asr_train_config=args.config_file,
+            asr_model_file=checkpoint,
+            token_type=config.token_type,
+            **config.inference_conf,
+        )
+        speech2text.asr_model.set_encoder_cache(encoder_cache, transform_key=f"snr={args.snr_target}|noise={args.noise}")
+
+        sweep = MaskCTCSweep(speech2text, args.n_iterations, args.threshold_probabilities, batch_size=args.batch_size, max_rows=args.max_rows)
+        sweep.encode(eval_loader)
+        if encoder_cache is not None:
+            encoder_cache.flush()
+        table = sweep.evaluate()
+
+        table.insert(0, "checkpoint", checkpoint)
+        table.to_csv(os.path.join(args.output_dir, Path(checkpoint).stem + "_sweep.csv"), index=False)
+        tables.append(table)
+
+    # -- ranking every checkpoint and setting
+    table = pd.concat(tables).sort_values(["wer", "cer"], kind="stable").reset_index(drop=True)
+    table.to_csv(os.path.join(args.output_dir, "sweep_maskctc.csv"), index=False)
+    print(table.head(10).to_string())
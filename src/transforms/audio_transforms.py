@@ -71,31 +71,112 @@ class NormaliseUtterance(object):
 
         return (audio_data - audio_data.mean()) / (audio_data.std() + self.eps)
 
+class NoiseBank(object):
+    """Noise audio waveforms loaded once and concatenated into a single buffer.
+       The prefix sums of their squared samples make the power of any noise segment an O(1) lookup.
+    """
+
+    def __init__(self, noise_paths: Union[str, List[str]], sample_rate: float = 16000):
+        """__init__.
+
+        Args:
+            noise_paths (str or list): the path(s) where the noisy audio waveforms are stored.
+            sample_rate (float): the sample rate of the audio waveform.
+        """
+        if isinstance(noise_paths, str):
+            noise_paths = [noise_paths]
+
+        noises = []
+        for noise_path in noise_paths:
+            if not os.path.exists(noise_path):
+                raise IOError(f'Noise path `{noise_path}` does not exist')
+
+            # -- converting to mono-channel audio, re-sampling, and normalising the noisy audio waveform
+            effects = [
+                ["remix", "1"],
+                ["rate", str(sample_rate)],
+            ]
+            noise, noise_sr = torchaudio.sox_effects.apply_effects_file(noise_path, effects, normalize=False)
+            noise = torchaudio.functional.resample(noise, orig_freq=noise_sr, new_freq=sample_rate)
+            noises.append(noise[0])
+
+        self.sample_rate = sample_rate
+        self.noise = torch.cat(noises) # -- (total,)
+        self.lengths = torch.tensor([noise.shape[0] for noise in noises], dtype=torch.int64)
+        self.starts = torch.cumsum(self.lengths, dim=0) - self.lengths
+        self.squared_sums = torch.cat([torch.zeros(1, dtype=torch.float64), torch.cumsum(self.noise.double() ** 2, dim=0)]) # -- (total+1,)
+        self.device_noise = {}
+
+    def sample_segments(self, audio_lengths: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            audio_lengths (torch.Tensor): length of each audio waveform (#batch,).
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: start of a random noise segment per audio waveform
+                within the buffer, its length, shorter than the audio if the noise has to be zero-padded,
+                and its power over the whole audio length.
+        """
+        audio_lengths = audio_lengths.cpu()
+        noise_ids = torch.randint(len(self.lengths), (audio_lengths.shape[0],))
+        noise_lengths = self.lengths[noise_ids]
+
+        offsets = (torch.rand(audio_lengths.shape[0]) * ((noise_lengths - audio_lengths).clamp(min=0) + 1)).long()
+        segment_starts = self.starts[noise_ids] + offsets
+        segment_lengths = torch.minimum(audio_lengths, noise_lengths - offsets)
+
+        segment_powers = (self.squared_sums[segment_starts + segment_lengths] - self.squared_sums[segment_starts]) / audio_lengths
+        return segment_starts, segment_lengths, segment_powers.float()
+
+    def mix(self, speech: torch.Tensor, speech_lengths: torch.Tensor, snr_db: torch.Tensor
+    ) -> torch.Tensor:
+        """Adds noise in-place to a padded batch of audio waveforms.
+
+        Args:
+            speech (torch.Tensor): padded batch of audio waveforms (#batch, time, channel).
+            speech_lengths (torch.Tensor): length of each audio waveform (#batch,).
+            snr_db (torch.Tensor): signal-noise-rate of each audio waveform (#batch,), 9999 meaning no noise.
+        Returns:
+            torch.Tensor: the same speech tensor, with noise added.
+        """
+        if speech.device not in self.device_noise:
+            self.device_noise[speech.device] = self.noise.to(device=speech.device)
+        noise = self.device_noise[speech.device].to(dtype=speech.dtype)
+
+        segment_starts, segment_lengths, noise_powers = self.sample_segments(speech_lengths)
+        segment_starts, segment_lengths = segment_starts.to(speech.device), segment_lengths.to(speech.device)
+        speech_lengths = speech_lengths.to(speech.device)
+
+        # -- scaling the noise to reach the target SNR, the padding being masked out of the speech power
+        time_idxs = torch.arange(speech.shape[1], device=speech.device)
+        speech_mask = (time_idxs[None, :] < speech_lengths[:, None]).to(speech.dtype) # -- (#batch, time)
+        audio_powers = (speech ** 2 * speech_mask[:, :, None]).sum(dim=(1, 2)) / speech_lengths.to(speech.dtype)
+        snr_db = snr_db.to(device=speech.device, dtype=audio_powers.dtype)
+        scales = torch.sqrt(audio_powers / noise_powers.to(speech.device).clamp(min=1e-20) / 10 ** (snr_db / 10.0))
+        scales = scales.masked_fill(snr_db == 9999, 0.0)
+
+        # -- gathering every noise segment at once, zero beyond its length
+        noise_mask = time_idxs[None, :] < segment_lengths[:, None] # -- (#batch, time)
+        noise_idxs = (segment_starts[:, None] + time_idxs[None, :]).masked_fill(~noise_mask, 0)
+        segments = noise[noise_idxs] * noise_mask.to(noise.dtype)
+        speech.add_(scales[:, None, None] * segments[:, :, None])
+
+        return speech
+
 class AddNoise(object):
     """Adding noise to an audio waveform.
        This code is mainly based on that implemented in https://jonathanbgn.com/2021/08/30/audio-augmentation.html
     """
 
-    def __init__(self, noise_path: str, sample_rate: float = 16000, snr_target: int = None):
+    def __init__(self, noise_path: Union[str, List[str]], sample_rate: float = 16000, snr_target: int = None):
         """__init__.
 
         Args:
-            noise_path (str): the path where the noisy audio waveform is stored.
+            noise_path (str or list): the path(s) where the noisy audio waveforms are stored.
             sample_rate (float): the sample rate of the audio waveform.
             snr_target (int): a fixed signal-noise-rate value.
         """
-
-        if not os.path.exists(noise_path):
-            raise IOError(f'Noise path `{noise_path}` does not exist')
-
-        # -- converting to mono-channel audio, re-sampling, and normalising the noisy audio waveform
-        effects = [
-            ["remix", "1"],
-            ["rate", str(sample_rate)],
-        ]
-        self.entire_noise, noise_sr = torchaudio.sox_effects.apply_effects_file(noise_path, effects, normalize=False)
-        self.entire_noise = torchaudio.functional.resample(self.entire_noise, orig_freq=noise_sr, new_freq=sample_rate)
-        self.entire_noise_length = self.entire_noise.shape[-1]
+        self.noise_bank = NoiseBank(noise_path, sample_rate=sample_rate)
         self.sample_rate = sample_rate
         self.snr_target = snr_target
 
@@ -107,28 +188,14 @@ class AddNoise(object):
         Returns:
             torch.Tensor: the noise-added audio waveform.
         """
-        audio_length = audio_data.shape[-1]
-        if self.entire_noise_length > audio_length:
-            offset = random.randint(0, self.entire_noise_length - audio_length)
-            noise = self.entire_noise[..., offset:offset+audio_length]
-        elif self.entire_noise_length < audio_length:
-            noise = torch.cat([self.entire_noise, torch.zeros((self.entire_noise.shape[0], audio_length - self.entire_noise_length))], dim=-1)
-        noise_length = noise.shape[-1]
-
         snr_db = random.choice([-5, 0, 5, 10, 15, 20, 9999]) if not self.snr_target else self.snr_target
         # -- no applying data augmentation
         if snr_db == 9999:
             return audio_data
 
         # -- adding noise to the audio waveform
-        snr = 10 ** (snr_db / 10.0)
-        snr = snr ** 0.5
-
-        audio_power = (audio_data ** 2).sum() / (audio_length * 1.0)
-        noise_power = (noise ** 2).sum() / (noise_length * 1.0)
-
-        noise = 1 / snr * noise * torch.sqrt(audio_power / noise_power)
-        noisy_audio_data = audio_data + noise
+        noisy_audio_data = audio_data.clone()
+        self.noise_bank.mix(noisy_audio_data.T[None], torch.tensor([audio_data.shape[-1]]), torch.tensor([float(snr_db)]))
 
         # snr = math.exp(snr_db / 10)
         # audio_power = audio_data.norm(p=2)
@@ -138,6 +205,51 @@ class AddNoise(object):
 
         return noisy_audio_data
 
+class SpeedPerturbation(torch.nn.Module):
+    """Changing the speed of audio waveforms by means of polyphase re-sampling.
+       The sinc kernel of each speed factor is computed once, so every call is a single conv1d.
+    """
+
+    def __init__(self, speed_factors: List[float] = [0.9, 1.1]):
+        """__init__.
+
+        Args:
+            speed_factors (list): speed factors whose kernels are precomputed.
+        """
+        super().__init__()
+        # -- playing the audio 'speed_factor' times faster is re-sampling it from speed_factor*sr to sr
+        self.resamplers = torch.nn.ModuleDict({
+            f'speed{round(speed_factor * 100)}': torchaudio.transforms.Resample(orig_freq=round(speed_factor * 100), new_freq=100)
+            for speed_factor in speed_factors if speed_factor != 1.0
+        })
+
+    def output_lengths(self, lengths: torch.Tensor, speed_factor: float) -> torch.Tensor:
+        """
+        Args:
+            lengths (torch.Tensor): lengths of the audio waveforms.
+            speed_factor (float): speed factor to apply.
+        Returns:
+            torch.Tensor: lengths of the re-sampled audio waveforms.
+        """
+        if speed_factor == 1.0:
+            return lengths
+        resampler = self.resamplers[f'speed{round(speed_factor * 100)}']
+        return torch.div(lengths * resampler.new_freq + resampler.orig_freq - 1, resampler.orig_freq, rounding_mode='floor')
+
+    def forward(self, audio_data: torch.Tensor, speed_factor: float
+    ) -> torch.Tensor:
+        """
+        Args:
+            audio_data (torch.Tensor): audio waveforms (..., time).
+            speed_factor (float): speed factor to apply, one of those given at construction.
+        Returns:
+            torch.Tensor: re-sampled audio waveforms.
+        """
+        if speed_factor == 1.0:
+            return audio_data
+        resampler = self.resamplers[f'speed{round(speed_factor * 100)}'].to(device=audio_data.device, dtype=audio_data.dtype)
+        return resampler(audio_data)
+
 class SpeedRate(object):
     """Subsample/Upsample the number of frames of the audio waveform.
        This code is mainly based on that implemented in https://jonathanbgn.com/2021/08/30/audio-augmentation.html
@@ -150,6 +262,7 @@ class SpeedRate(object):
             sample_rate (float): the sample rate of the audio waveform.
         """
         self.sample_rate = sample_rate
+        self.speed_perturbation = SpeedPerturbation([0.9, 1.1])
 
     def __call__(self, audio_data: torch.Tensor
     ) -> torch.Tensor:
@@ -165,17 +278,125 @@ class SpeedRate(object):
             return audio_data
 
         # -- re-sampling the audio waveform
-        sox_effects = [
-            ["speed", str(speed_factor)],
-            ["rate", str(self.sample_rate)],
-        ]
-        resampled_audio_data, _ = torchaudio.sox_effects.apply_effects_tensor(
-            audio_data,
-            self.sample_rate,
-            sox_effects
-        )
-
-        return resampled_audio_data
+        return self.speed_perturbation(audio_data, speed_factor)
+
+class BatchCompose(object):
+    """Compose several batch preprocess together.
+    """
+
+    def __init__(self, preprocess):
+        """__init__.
+        Args:
+            preprocess (list of batch ``Preprocess`` objects): list of batch preprocess to compose.
+        """
+        self.preprocess = preprocess
+
+    def __call__(self, speech: torch.Tensor, speech_lengths: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            speech (torch.Tensor): padded batch of audio waveforms (#batch, time, channel).
+            speech_lengths (torch.Tensor): length of each audio waveform (#batch,).
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: the preprocessed batch and its lengths.
+        """
+        for p in self.preprocess:
+            if p is not None:
+                speech, speech_lengths = p(speech, speech_lengths)
+        return speech, speech_lengths
+
+class BatchAddNoise(object):
+    """Adding noise to a padded batch of audio waveforms, with a random SNR and noise segment per row.
+       It runs on the device where the batch is, so it can be applied after moving the batch to the GPU.
+    """
+
+    def __init__(self, noise_path: Union[str, List[str]], sample_rate: float = 16000, snr_target: int = None, snr_levels: List[int] = [-5, 0, 5, 10, 15, 20, 9999]):
+        """__init__.
+
+        Args:
+            noise_path (str or list): the path(s) where the noisy audio waveforms are stored.
+            sample_rate (float): the sample rate of the audio waveform.
+            snr_target (int): a fixed signal-noise-rate value.
+            snr_levels (list): SNR values to choose from when no target is set, 9999 meaning no noise.
+        """
+        self.noise_bank = NoiseBank(noise_path, sample_rate=sample_rate)
+        self.snr_levels = torch.tensor([snr_target] if snr_target else snr_levels, dtype=torch.float32)
+
+    def __call__(self, speech: torch.Tensor, speech_lengths: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            speech (torch.Tensor): padded batch of audio waveforms (#batch, time, channel).
+            speech_lengths (torch.Tensor): length of each audio waveform (#batch,).
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: the noise-added batch and its lengths.
+        """
+        # -- random SNR per row
+        snr_db = self.snr_levels[torch.randint(len(self.snr_levels), (speech.shape[0],))]
+
+        return self.noise_bank.mix(speech, speech_lengths, snr_db), speech_lengths
+
+class BatchSpeedRate(object):
+    """Subsample/Upsample a padded batch of audio waveforms, with a random speed factor per row.
+       Rows sharing a factor are re-sampled together on the device where the batch is.
+    """
+
+    def __init__(self, sample_rate: float = 16000, speed_factors: List[float] = [0.9, 1.0, 1.1], length_multiple: int = 640):
+        """__init__.
+
+        Args:
+            sample_rate (float): the sample rate of the audio waveform.
+            speed_factors (list): speed factors to choose from.
+            length_multiple (int): the re-sampled lengths are truncated to a multiple of it, as done when collating the batch.
+        """
+        self.sample_rate = sample_rate
+        self.speed_factors = speed_factors
+        self.length_multiple = length_multiple
+        self.speed_perturbation = SpeedPerturbation(speed_factors)
+
+    def __call__(self, speech: torch.Tensor, speech_lengths: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            speech (torch.Tensor): padded batch of audio waveforms (#batch, time, channel).
+            speech_lengths (torch.Tensor): length of each audio waveform (#batch,).
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: the re-sampled batch and its lengths.
+        """
+        batch_size, max_length = speech.shape[0], speech.shape[1]
+        factor_idx = torch.randint(len(self.speed_factors), (batch_size,)).tolist()
+
+        # -- padding is zeroed so that it does not leak into the re-sampled audio
+        valid = torch.arange(max_length, device=speech.device)[None, :] < speech_lengths[:, None]
+        speech = (speech * valid[:, :, None]).transpose(1, 2) # -- (#batch, channel, time)
+
+        rows, new_speech, new_lengths = [], [], []
+        for i, speed_factor in enumerate(self.speed_factors):
+            group = [row for row, idx in enumerate(factor_idx) if idx == i]
+            if len(group) == 0:
+                continue
+            group = torch.tensor(group, device=speech.device)
+
+            new_speech.append(self.speed_perturbation(speech[group], speed_factor))
+            new_lengths.append(self.speed_perturbation.output_lengths(speech_lengths[group], speed_factor))
+            rows.append(group)
+
+        # -- restoring the batch order
+        rows = torch.cat(rows)
+        speech_lengths = torch.empty_like(speech_lengths)
+        speech_lengths[rows] = torch.cat(new_lengths)
+        speech_lengths = speech_lengths // self.length_multiple * self.length_multiple
+
+        max_length = int(speech_lengths.max())
+        resampled_speech = speech.new_zeros(batch_size, speech.shape[1], max_length)
+        for group, group_speech in zip(rows.split([len(x) for x in new_lengths]), new_speech):
+            length = min(max_length, group_speech.shape[-1])
+            resampled_speech[group, :, :length] = group_speech[..., :length]
+
+        valid = torch.arange(max_length, device=speech.device)[None, :] < speech_lengths[:, None]
+        resampled_speech = resampled_speech * valid[:, None, :]
+
+        return resampled_speech.transpose(1, 2), speech_lengths # -- (#batch, time, channel)
 
 class TimeMasking(object):
     """Apply the time-masking technique over an audio waveform.
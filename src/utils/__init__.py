@@ -5,3 +5,10 @@ from .tokenizer import *
 from .inference import *
 from .asr_dataloader import *
 from .model_checkpoint import *
+from .checkpoint_writer import *
+from .amp import *
+from .distributed import *
+from .accumulation import *
+from .training_state import *
+from .device_loader import *
+from .profiler import *
@@ -0,0 +1,139 @@
+import contextlib
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from .distributed import all_reduce_sum
+from .profiler import profile_stage
+
+class GradientAccumulator:
+    """
+      Accumulates the gradients of the micro-batches of each optimizer step and performs the step.
+
+      Each micro-batch loss is weighted by its number of target tokens ('tokens') or by one ('batches'), and
+      the accumulated gradients are divided by the total weight of the step, across processes in distributed
+      training, right before the update. In distributed training, the micro-batches before the update do not
+      synchronize their gradients. The running loss is kept on the device, so there is no device sync but the
+      ones of the optimizer step. The backward and the optimizer step are timed by the optional 'profiler'.
+    """
+
+    def __init__(self, model, optimizer, scheduler, accum_grad, n_batches, scaler=None, grad_clip=-1.0, weighting="tokens", loss_sum=0.0, weight_sum=0.0, device="cpu", profiler=None):
+        if weighting not in ["tokens", "batches"]:
+            raise ValueError(f"The loss weighting should be 'tokens' or 'batches'. You specified: {weighting}")
+
+        self.model = model
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.accum_grad = max(1, accum_grad)
+        self.n_batches = n_batches
+        self.scaler = scaler
+        self.grad_clip = grad_clip
+        self.weighting = weighting
+        self.profiler = profiler
+
+        self.loss_sum = torch.tensor(loss_sum, dtype=torch.float64, device=device)
+        self.weight_sum = weight_sum
+        self.step_loss = torch.zeros((), dtype=torch.float64, device=device)
+        self.step_weight = 0.0
+        self.step_batches = 0
+
+    def is_update(self, batch_idx):
+        return ((batch_idx+1) % self.accum_grad == 0) or (batch_idx+1 == self.n_batches)
+
+    def weight(self, batch):
+        """
+          Weight of a micro-batch, computed from its lengths while they are still on the host.
+        """
+        if self.weighting == "tokens":
+            return float(batch['text_lengths'].sum())
+        return 1.0
+
+    def part_weight(self, part, batch, weight):
+        """
+          Weight of a part of a micro-batch, so that its parts add up to the weight of the whole micro-batch.
+        """
+        if self.weighting == "tokens":
+            return self.weight(part)
+        return weight * len(part['sample_id']) / len(batch['sample_id'])
+
+    def reset(self):
+        """
+          Discards the gradients accumulated since the last update, e.g. the partial ones of a micro-batch that ran out of memory.
+          The losses and weights of the micro-batches of the step are discarded too, so the running loss matches the gradients
+          actually applied. Returns the number of micro-batches discarded, the parts of a split micro-batch counting as such.
+        """
+        n_discarded = self.step_batches
+        self.optimizer.zero_grad()
+        self.loss_sum -= self.step_loss
+        self.weight_sum -= self.step_weight
+        self._clear_step()
+        return n_discarded
+
+    def _clear_step(self):
+        self.step_loss.zero_()
+        self.step_weight = 0.0
+        self.step_batches = 0
+
+    def micro_step(self, batch_idx):
+        """
+          Context of the forward and backward of a micro-batch, skipping the gradient all-reduce unless an update follows.
+        """
+        if isinstance(self.model, DistributedDataParallel) and not self.is_update(batch_idx):
+            return self.model.no_sync()
+        return contextlib.nullcontext()
+
+    def backward(self, loss, weight):
+        loss = loss * weight
+        with profile_stage(self.profiler, "backward"):
+            if self.scaler is not None:
+                self.scaler.scale(loss).backward()
+            else:
+                loss.backward()
+
+        self.loss_sum += loss.detach().sum()
+        self.weight_sum += weight
+        self.step_loss += loss.detach().sum()
+        self.step_weight += weight
+        self.step_batches += 1
+
+    def step(self):
+        with profile_stage(self.profiler, "optimizer"):
+            self._step()
+
+    def _step(self):
+        # -- gradients are unscaled before being normalized and clipped, and a step with inf/nan gradients is skipped by the scaler
+        if self.scaler is not None:
+            self.scaler.unscale_(self.optimizer)
+
+        # -- DDP averages the gradients of the processes, so they are normalized by the mean weight per process
+        step_weight = self.step_weight
+        if dist.is_initialized():
+            step_weight = all_reduce_sum([step_weight], self.loss_sum.device)[0] / dist.get_world_size()
+        grads = [p.grad for p in self.model.parameters() if p.grad is not None]
+        if step_weight > 0 and len(grads) > 0:
+            torch._foreach_mul_(grads, 1.0 / step_weight)
+
+        if self.grad_clip > 0:
+            torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_clip)
+
+        if self.scaler is not None:
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+        else:
+            self.optimizer.step()
+        if self.scheduler is not None:
+            self.scheduler.step()
+        self.optimizer.zero_grad()
+        self._clear_step()
+
+    def state(self):
+        """
+          Running loss sum and weight sum, e.g. to be saved with a mid-epoch training state.
+        """
+        return self.loss_sum.item(), self.weight_sum
+
+    def average_loss(self):
+        """
+          Weighted average loss of the micro-batches so far, across processes in distributed training.
+        """
+        loss_sum, weight_sum = all_reduce_sum([self.loss_sum.item(), self.weight_sum], self.loss_sum.device)
+        return loss_sum / max(weight_sum, 1.0)
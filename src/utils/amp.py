@@ -0,0 +1,25 @@
+import torch
+from torch.cuda.amp import GradScaler
+
+def get_amp_dtype(config):
+    """
+      Precision of the mixed-precision training, or None when 'use_amp' is disabled.
+      By default float16 on GPU and bfloat16 on CPU, unless 'amp_dtype' is set in the training settings.
+    """
+    if not config.training_settings['use_amp']:
+        return None
+
+    amp_dtype = config.training_settings.get('amp_dtype', None)
+    if amp_dtype is None:
+        amp_dtype = 'float16' if torch.device(config.device).type == 'cuda' else 'bfloat16'
+
+    return getattr(torch, amp_dtype)
+
+def get_grad_scaler(config):
+    """
+      Loss scaler of float16 training. bfloat16 has the range of float32, so its gradients are not scaled.
+    """
+    if get_amp_dtype(config) != torch.float16:
+        return None
+
+    return GradScaler()
@@ -1,10 +1,12 @@
 import os
+import itertools
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.utils.data as data
-from src.datasets import ASRDataset
+from src.datasets import ASRDataset, TokenCache, tokenizer_hash
 
-def get_dataloader(config, dataset_path, audio_transforms, tokenizer, converter, filter_spkr_ids=['all-spkrs'], filter_by_language=['all-langs'], is_training=True):
+def get_dataloader(config, dataset_path, audio_transforms, tokenizer, converter, filter_spkr_ids=['all-spkrs'], filter_by_language=['all-langs'], is_training=True, batch_size=None, num_replicas=1, rank=0, num_workers=None):
 
     # -- defining dataset
     dataset = ASRDataset(
@@ -15,19 +17,258 @@ def get_dataloader(config, dataset_path, audio_transforms, tokenizer, converter,
         is_training=is_training,
     )
 
+    # -- pre-tokenized transcripts and constant language-tag IDs
+    token_cache = get_token_cache(config)
+    language_ids = None
+    if config.aux_ctc_tasks is not None and 'lid_utt' in config.aux_ctc_tasks:
+        # we remove an aritifical space symbol provided by the tokenizer
+        language_ids = {language: torch.Tensor(converter.tokens2ids(tokenizer.text2tokens(language))[1:]) for language in dataset.languages}
+    collate_fn = lambda x: asr_data_processing(x, audio_transforms, tokenizer, converter, config, token_cache, language_ids)
+    if num_workers is None:
+        num_workers = config.training_settings['num_workers']
+
     # -- defining dataloader
-    dataloader = data.DataLoader(
-        dataset=dataset,
-        batch_size=config.training_settings['batch_size'] if is_training else 1,
-        shuffle=is_training,
-        collate_fn=lambda x: asr_data_processing(x, audio_transforms, tokenizer, converter, config),
-        num_workers=config.training_settings['num_workers'],
-        pin_memory=True,
-    )
+    batch_sampler = None
+    if is_training:
+        batch_sampler = get_train_batch_sampler(config, dataset, batch_size, num_replicas, rank, token_cache, tokenizer, converter)
+    elif num_replicas > 1:
+        # -- each process evaluates every num_replicas-th utterance
+        batch_sampler = data.BatchSampler(range(rank, len(dataset), num_replicas), batch_size if batch_size is not None else 1, drop_last=False)
+
+    if batch_sampler is not None:
+        dataloader = data.DataLoader(
+            dataset=dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=collate_fn,
+            num_workers=num_workers,
+            pin_memory=True,
+        )
+    else:
+        if batch_size is None:
+            batch_size = config.training_settings['batch_size'] if is_training else 1
+
+        dataloader = data.DataLoader(
+            dataset=dataset,
+            batch_size=batch_size,
+            shuffle=is_training,
+            collate_fn=collate_fn,
+            num_workers=num_workers,
+            pin_memory=True,
+        )
 
     return dataloader
 
-def asr_data_processing(data, audio_transforms, tokenizer, converter, config):
+def get_token_cache(config):
+    """Loads the TokenCache set as 'token_cache' in the config, provided it was built with the current tokenizer.
+    """
+    cache_path = getattr(config, 'token_cache', None)
+    if not cache_path:
+        return None
+
+    token_cache = TokenCache(cache_path)
+    if token_cache.tokenizer_hash != tokenizer_hash(config):
+        print(f'{cache_path} was built with a different tokenizer, transcripts will be tokenized on the fly')
+        return None
+    return token_cache
+
+def get_token_lengths(dataset, token_cache, tokenizer, converter):
+    """Number of tokens of each transcript of the dataset, read from the TokenCache when possible.
+    """
+    token_lengths = np.zeros(len(dataset), dtype=np.int64)
+    for index in range(len(dataset)):
+        token_ids = token_cache.get(dataset.paths[index]) if token_cache is not None else None
+        if token_ids is None:
+            token_ids = converter.tokens2ids(tokenizer.text2tokens(dataset.sentences[index]))
+        token_lengths[index] = len(token_ids)
+
+    return token_lengths
+
+def get_train_batch_sampler(config, dataset, batch_size=None, num_replicas=1, rank=0, token_cache=None, tokenizer=None, converter=None):
+    """Builds the resumable batch sampler of a training set, length-bucketed when possible and random otherwise,
+    and sharded across processes in distributed training.
+    """
+    batch_sampler = None
+    if batch_size is None:
+        batch_sampler = get_length_bucket_sampler(config, dataset, token_cache, tokenizer, converter)
+
+    if batch_sampler is None:
+        # -- the shuffling has its own generator, so its state can be saved and restored
+        generator = torch.Generator()
+        generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+        batch_sampler = data.BatchSampler(
+            data.RandomSampler(dataset, generator=generator),
+            batch_size if batch_size is not None else config.training_settings['batch_size'],
+            drop_last=False,
+        )
+    else:
+        generator = batch_sampler.generator
+
+    if num_replicas > 1:
+        batch_sampler = DistributedBatchSampler(batch_sampler, num_replicas, rank)
+
+    return ResumableBatchSampler(batch_sampler, generator)
+
+def get_length_bucket_sampler(config, dataset, token_cache=None, tokenizer=None, converter=None):
+    """Builds a LengthBucketBatchSampler when 'batch_seconds', 'batch_frames' and/or 'batch_tokens' is set in the training settings.
+    """
+    batch_seconds = config.training_settings.get('batch_seconds', None)
+    batch_frames = config.training_settings.get('batch_frames', None)
+    batch_tokens = config.training_settings.get('batch_tokens', None)
+    if batch_seconds is None and batch_frames is None and batch_tokens is None:
+        return None
+
+    # -- utterance sizes in the same unit as the target
+    lengths = dataset.lengths
+    if batch_frames is not None:
+        frontend_conf = config.frontend_conf if config.frontend_conf is not None else {}
+        fs = frontend_conf.get('fs', 16000)
+        hop_length = frontend_conf.get('hop_length', 128)
+        lengths = lengths * fs / hop_length
+        max_batch_size = batch_frames
+    elif batch_seconds is not None:
+        max_batch_size = batch_seconds
+    else:
+        max_batch_size = float('inf')
+
+    # -- decoder-side budget: padded transcript tokens
+    token_lengths = None
+    if batch_tokens is not None:
+        token_lengths = get_token_lengths(dataset, token_cache, tokenizer, converter)
+
+    return LengthBucketBatchSampler(
+        lengths,
+        max_batch_size,
+        shuffle=True,
+        token_lengths=token_lengths,
+        max_batch_tokens=batch_tokens,
+    )
+
+class LengthBucketBatchSampler(data.Sampler):
+    """Batch sampler grouping utterances of similar length.
+
+    Utterances are sorted by length and consecutive ones are packed while the
+    padded size of the batch, i.e. its number of utterances times the longest
+    one, stays within 'max_batch_size'. When token lengths are given, the
+    padded number of transcript tokens must also stay within
+    'max_batch_tokens'. The batches are built once, so the number of steps
+    per epoch is fixed, and shuffling is done at the bucket level: the batch
+    order and the utterance order within each batch change every epoch.
+
+    Args:
+        lengths (array-like): size of each utterance of the dataset, e.g. in seconds or frames.
+        max_batch_size (float): maximum padded size of a batch, in the same unit as 'lengths'.
+        shuffle (bool): whether to shuffle the buckets every epoch.
+        seed (int): seed of the shuffling generator, drawn from the global torch RNG if None.
+        token_lengths (array-like): number of tokens of each transcript, optional.
+        max_batch_tokens (int): maximum padded number of tokens of a batch, used with 'token_lengths'.
+    """
+
+    def __init__(self, lengths, max_batch_size, shuffle=True, seed=None, token_lengths=None, max_batch_tokens=None):
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        if token_lengths is None:
+            token_lengths, max_batch_tokens = np.zeros(len(self.lengths)), float('inf')
+        self.token_lengths = np.asarray(token_lengths, dtype=np.float64)
+        self.max_batch_tokens = max_batch_tokens
+        self.generator = torch.Generator()
+        if seed is None:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        self.generator.manual_seed(seed)
+
+        # -- packing utterances sorted by decreasing length
+        order = np.argsort(-self.lengths, kind='stable')
+        self.batches = []
+        batch, batch_max, batch_max_tokens = [], 0.0, 0.0
+        for index in order.tolist():
+            length, n_tokens = self.lengths[index], self.token_lengths[index]
+            if len(batch) > 0 and (
+                max(batch_max, length) * (len(batch) + 1) > max_batch_size
+                or max(batch_max_tokens, n_tokens) * (len(batch) + 1) > self.max_batch_tokens
+            ):
+                self.batches.append(batch)
+                batch, batch_max, batch_max_tokens = [], 0.0, 0.0
+            batch.append(index)
+            batch_max = max(batch_max, length)
+            batch_max_tokens = max(batch_max_tokens, n_tokens)
+        if len(batch) > 0:
+            self.batches.append(batch)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        if not self.shuffle:
+            yield from self.batches
+            return
+
+        for batch_idx in torch.randperm(len(self.batches), generator=self.generator).tolist():
+            batch = self.batches[batch_idx]
+            yield [batch[i] for i in torch.randperm(len(batch), generator=self.generator).tolist()]
+
+class DistributedBatchSampler(data.Sampler):
+    """Shards the batches of a batch sampler across the processes of a distributed training.
+
+    Every process must draw the same batch order, i.e. its shuffling generator must have the
+    same seed in every process. Process 'rank' then takes every num_replicas-th batch, so a
+    length-bucketed sampler keeps its buckets. The last batches are dropped when needed, so
+    all the processes run the same number of steps per epoch.
+
+    Args:
+        batch_sampler (Sampler): batch sampler shared by all the processes.
+        num_replicas (int): number of processes.
+        rank (int): index of the current process.
+    """
+
+    def __init__(self, batch_sampler, num_replicas, rank):
+        self.batch_sampler = batch_sampler
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def __len__(self):
+        return len(self.batch_sampler) // self.num_replicas
+
+    def __iter__(self):
+        # -- every batch is drawn, so the shuffling generator stays in sync across processes
+        n_batches = len(self) * self.num_replicas
+        for batch_idx, batch in enumerate(self.batch_sampler):
+            if batch_idx < n_batches and batch_idx % self.num_replicas == self.rank:
+                yield batch
+
+class ResumableBatchSampler(data.Sampler):
+    """Batch sampler that can start an epoch from any of its batches, e.g. when resuming a training interrupted mid-epoch.
+
+    The skipped batches are still drawn from the wrapped sampler, so the rest of the epoch
+    follows the same order as the interrupted one, but they are never loaded.
+
+    Args:
+        batch_sampler (Sampler): batch sampler whose shuffling only depends on 'generator'.
+        generator (torch.Generator): generator of the shuffling, whose state is saved and restored.
+    """
+
+    def __init__(self, batch_sampler, generator):
+        self.batch_sampler = batch_sampler
+        self.generator = generator
+        self.start_batch = 0
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        batches = iter(self.batch_sampler)
+        for _ in itertools.islice(batches, self.start_batch):
+            pass
+        self.start_batch = 0
+
+        return batches
+
+    def state_dict(self):
+        return {'generator': self.generator.get_state()}
+
+    def load_state_dict(self, state_dict):
+        self.generator.set_state(state_dict['generator'])
+
+def asr_data_processing(data, audio_transforms, tokenizer, converter, config, token_cache=None, language_ids=None):
     # -- create empty batch
     batch_keys = list(data[0].keys()) + ['speech_lengths', 'text_lengths', 'ref']
     if config.aux_ctc_tasks is not None:
@@ -39,6 +280,7 @@ def asr_data_processing(data, audio_transforms, tokenizer, converter, config):
     for sample in data:
         # -- sample metadata
         batch['sample_id'].append(sample['sample_id'])
+        batch['path'].append(sample['path'])
         batch['speaker_id'].append(sample['speaker_id'])
         batch['language'].append(sample['language'])
 
@@ -55,15 +297,22 @@ def asr_data_processing(data, audio_transforms, tokenizer, converter, config):
         if config.aux_ctc_tasks is not None:
             for task_id in config.aux_ctc_tasks:
                 if task_id == 'lid_utt':
-                    # we remove an aritifical space symbol provided by the tokenizer
-                    language_id = torch.Tensor(converter.tokens2ids(tokenizer.text2tokens(sample['language']))[1:])
+                    if language_ids is not None:
+                        language_id = language_ids[sample['language']]
+                    else:
+                        # we remove an aritifical space symbol provided by the tokenizer
+                        language_id = torch.Tensor(converter.tokens2ids(tokenizer.text2tokens(sample['language']))[1:])
                     batch[task_id].append(language_id)
                     batch[f'{task_id}_lengths'].append(1)
                 else:
                     raise ValueError('unknown auxiliary CTC task ID: {task_id}')
 
         # -- transcription preprocessing
-        text = torch.Tensor(converter.tokens2ids(tokenizer.text2tokens(sample['text'])))
+        token_ids = token_cache.get(sample['path']) if token_cache is not None else None
+        if token_ids is not None:
+            text = torch.from_numpy(token_ids).float()
+        else:
+            text = torch.Tensor(converter.tokens2ids(tokenizer.text2tokens(sample['text'])))
 
         batch['text'].append(text)
         batch['text_lengths'].append(text.shape[0])
@@ -84,3 +333,24 @@ def asr_data_processing(data, audio_transforms, tokenizer, converter, config):
     batch['text_lengths'] = torch.Tensor(batch['text_lengths']).type(torch.int64) # -- (#batch,)
 
     return batch
+
+def split_batch(batch):
+    """Splits a collated batch into two halves, e.g. to retry a batch that ran out of memory.
+    The padded sequences of each half are trimmed to its own longest one.
+
+    Args:
+        batch (dict): batch built by 'asr_data_processing'.
+
+    Returns:
+        tuple: the two halves of the batch.
+    """
+    half = len(batch['sample_id']) // 2
+    halves = []
+    for indices in [slice(0, half), slice(half, None)]:
+        part = {key: value[indices] for key, value in batch.items()}
+        for key in part:
+            if f'{key}_lengths' in part and torch.is_tensor(part[key]):
+                part[key] = part[key][:, :int(part[f'{key}_lengths'].max())]
+        halves.append(part)
+
+    return tuple(halves)
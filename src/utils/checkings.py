@@ -3,3 +3,25 @@ def security_checks(config):
         raise RuntimeError(
             f"The number of epochs to compute an average model should be a value between 1 and the number of training epochs. You specified (average-epochs, training-epochs): {config.training_settings['average_epochs']}",
         )
+
+    amp_dtype = config.training_settings.get('amp_dtype', None)
+    if config.training_settings['use_amp'] and amp_dtype is not None:
+        if amp_dtype not in ['float16', 'bfloat16']:
+            raise RuntimeError(
+                f"The mixed-precision type should be 'float16' or 'bfloat16'. You specified: {amp_dtype}",
+            )
+        if amp_dtype == 'float16' and not config.device.startswith('cuda'):
+            raise RuntimeError(
+                f"Mixed-precision training in float16 requires a GPU, 'bfloat16' should be used on {config.device}",
+            )
+
+    profiling = config.training_settings.get('profiling', None)
+    if profiling and profiling not in ['jsonl', 'csv']:
+        raise RuntimeError(
+            f"The profiling output should be 'jsonl' or 'csv'. You specified: {profiling}",
+        )
+    profiler_trace = config.training_settings.get('profiler_trace', None)
+    if profiler_trace is not None and len(profiler_trace) != 3:
+        raise RuntimeError(
+            f"The profiler trace should be a list of [wait, warmup, active] steps. You specified: {profiler_trace}",
+        )
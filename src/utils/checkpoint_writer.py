@@ -0,0 +1,99 @@
+import os
+import copy
+import queue
+import threading
+import torch
+
+class AsyncCheckpointWriter:
+    """
+      Writes checkpoints on a background thread, so training does not wait for torch.save.
+
+      Each checkpoint is first snapshotted into CPU buffers (pinned when CUDA is available),
+      which only takes a device-to-host copy. The buffers of each kind of checkpoint are reused
+      from one save to the next. The snapshot is serialized next to its destination and
+      atomically renamed, so an interrupted write never leaves a truncated checkpoint. At most
+      `max_pending` checkpoints wait to be written; beyond that, save() blocks.
+    """
+
+    def __init__(self, max_pending=2):
+        self.pin_memory = torch.cuda.is_available()
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.free_buffers = {}
+        self.lock = threading.Lock()
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _snapshot(self, obj, buffers, index):
+        if isinstance(obj, torch.Tensor):
+            i = index[0]
+            index[0] += 1
+            if i == len(buffers):
+                buffers.append(None)
+            if buffers[i] is None or buffers[i].shape != obj.shape or buffers[i].dtype != obj.dtype:
+                buffers[i] = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=self.pin_memory)
+            return buffers[i].copy_(obj.detach(), non_blocking=self.pin_memory)
+        if isinstance(obj, dict):
+            return obj.__class__((k, self._snapshot(v, buffers, index)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return obj.__class__(self._snapshot(v, buffers, index) for v in obj)
+        return copy.deepcopy(obj)
+
+    def save(self, obj, dst_path, kind="model"):
+        """
+          Snapshots obj (e.g. a state_dict) and queues it to be written in dst_path.
+          Checkpoints of the same kind share their snapshot buffers.
+        """
+        self._raise_error()
+
+        with self.lock:
+            free_buffers = self.free_buffers.setdefault(kind, [])
+            buffers = free_buffers.pop() if len(free_buffers) > 0 else []
+        snapshot = self._snapshot(obj, buffers, [0])
+
+        # -- the writer thread waits for the device-to-host copies, not the training loop
+        copied = None
+        if self.pin_memory:
+            copied = torch.cuda.Event()
+            copied.record()
+
+        self.pending.put((snapshot, dst_path, kind, buffers, copied))
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                break
+
+            snapshot, dst_path, kind, buffers, copied = item
+            try:
+                if copied is not None:
+                    copied.synchronize()
+                tmp_path = dst_path + ".tmp"
+                torch.save(snapshot, tmp_path)
+                os.replace(tmp_path, dst_path)
+            except Exception as error:
+                self.error = error
+            finally:
+                with self.lock:
+                    self.free_buffers[kind].append(buffers)
+                self.pending.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("a checkpoint could not be written") from error
+
+    def flush(self):
+        """
+          Waits until every queued checkpoint is on disk, e.g. before reading them back.
+        """
+        self.pending.join()
+        self._raise_error()
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
@@ -0,0 +1,67 @@
+import torch
+from .profiler import profile_stage
+
+class DevicePrefetcher:
+    """
+      Wraps a dataloader to move its batches to the device ahead of the step that uses them.
+
+      On GPU, the pinned batches of the loader are copied on a side stream, so the copy of the next batch
+      overlaps with the compute of the current step, and the compute stream only waits for the copy of the
+      batch it is about to use. Non-tensor values, e.g. 'sample_id' and 'ref', are left as they are. Iterating
+      yields (host batch, device batch) pairs, so the lengths can still be read without a device sync.
+
+      With 'num_workers' = 0, the batches are collated in this process and draw from its RNG, so they are
+      fetched in step order to keep runs and resumed runs reproducible, and only their copy runs ahead.
+      The copies are timed by the optional 'profiler'.
+    """
+
+    def __init__(self, loader, device, profiler=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.profiler = profiler
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        self.fetch_ahead = getattr(loader, 'num_workers', 0) > 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        # -- the loader iterator is created right away, as a DataLoader draws its worker seeds at that point
+        return self._prefetch(iter(self.loader))
+
+    def _to_device(self, batch):
+        if self.stream is None:
+            with profile_stage(self.profiler, "h2d_copy"):
+                return {k: v.to(device=self.device) if torch.is_tensor(v) else v for k, v in batch.items()}, None
+
+        with torch.cuda.stream(self.stream), profile_stage(self.profiler, "h2d_copy", stream=self.stream):
+            device_batch = {k: v.to(device=self.device, non_blocking=True) if torch.is_tensor(v) else v for k, v in batch.items()}
+            copied = torch.cuda.Event()
+            copied.record(self.stream)
+        return device_batch, copied
+
+    def _wait(self, device_batch, copied):
+        if copied is not None:
+            # -- the tensors were allocated on the side stream, so their memory is kept until the compute stream is done with them
+            compute_stream = torch.cuda.current_stream(self.device)
+            compute_stream.wait_event(copied)
+            for value in device_batch.values():
+                if torch.is_tensor(value):
+                    value.record_stream(compute_stream)
+        return device_batch
+
+    def _prefetch(self, batches):
+        if not self.fetch_ahead:
+            for batch in batches:
+                yield batch, self._wait(*self._to_device(batch))
+            return
+
+        # -- double buffering: the next batch is fetched and its copy issued before the current one is used
+        next_batch = next(batches, None)
+        next_copy = self._to_device(next_batch) if next_batch is not None else None
+        while next_batch is not None:
+            batch, (device_batch, copied) = next_batch, next_copy
+            next_batch = next(batches, None)
+            if next_batch is not None:
+                next_copy = self._to_device(next_batch)
+            yield batch, self._wait(device_batch, copied)
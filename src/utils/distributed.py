@@ -0,0 +1,93 @@
+import os
+import sys
+import random
+import numpy as np
+import torch
+import torch.distributed as dist
+from .training_state import get_rng_state, set_rng_state
+
+def init_distributed(config):
+    """
+      Joins the process group of a torchrun launch, i.e. when WORLD_SIZE > 1, with the NCCL backend on GPU
+      and gloo on CPU. On GPU, each process uses the device of its LOCAL_RANK. On CPU, the processes of a node
+      split its cores. Only the first process prints its progress. Every process starts from the same RNG
+      states, drawn by the first one, so they all build the same balanced dataset and draw the same batch
+      order, from which each process takes its own batches. Once the dataloaders are built, the processes
+      get their own RNG streams with split_rng_streams().
+
+      Returns the rank of the process and the number of processes.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size == 1:
+        return 0, 1
+
+    rank = int(os.environ['RANK'])
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+    if torch.device(config.device).type == 'cuda':
+        config.device = f"cuda:{local_rank}"
+        torch.cuda.set_device(config.device)
+        backend = 'nccl'
+    else:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+        backend = 'gloo'
+    dist.init_process_group(backend=backend)
+
+    # -- only the first process logs, the others just report their errors
+    if rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+
+    # -- sharing the seed of the first process
+    seed = torch.randint(2**31 - 1, (1,), dtype=torch.int64).to(config.device)
+    dist.broadcast(seed, src=0)
+    seed = int(seed.item())
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    return rank, world_size
+
+def split_rng_streams():
+    """
+      Gives every process but the first one its own python, numpy and torch RNG streams, seeded with a seed drawn
+      from the shared RNG states plus the rank of the process. The processes then draw different dropout,
+      SpecAugment and audio augmentations, and their dataloader workers different base seeds, while the first
+      one keeps the shared streams, so it follows the same RNG sequence as a single-process training.
+    """
+    if not dist.is_initialized() or dist.get_rank() == 0:
+        return
+
+    seed = int(torch.randint(2**31 - 1 - dist.get_world_size(), (1,)).item()) + dist.get_rank()
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def sync_rng_state():
+    """
+      Gives every process the RNG states of the first one, e.g. to build the same balanced dataset in all of them.
+    """
+    if not dist.is_initialized():
+        return
+
+    state = [get_rng_state()]
+    dist.broadcast_object_list(state, src=0)
+    set_rng_state(state[0])
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def all_reduce_sum(values, device):
+    """
+      Sums a list of numbers across the processes, e.g. to reduce the statistics of their shards.
+    """
+    if not dist.is_initialized():
+        return list(values)
+
+    values = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(values, op=dist.ReduceOp.SUM)
+    return values.tolist()
+
+def destroy_distributed():
+    if dist.is_initialized():
+        dist.barrier()
+        dist.destroy_process_group()
@@ -2,6 +2,10 @@ import os
 import torch
 import pandas as pd
 from collections import OrderedDict
+from packaging.version import parse as V
+
+# -- memory-mapped loading is only available from torch 2.1
+_MMAP_LOAD = {'mmap': True} if V(torch.__version__) >= V("2.1.0") else {}
 
 def load_frontend_lrw(e2e, checkpoint, module_name):
     frontend_lrw = OrderedDict()
@@ -65,28 +69,53 @@ def load_e2e(e2e, modules, checkpoint_path, ctc_weight):
     else:
         print(f"Training the end-to-end model from scracth!")
 
-def average_model(e2e, checkpoint_paths):
+def average_checkpoints(checkpoint_paths):
     """
-      Code based on the implentation publicly released by FairSeq.
-        https://github.com/facebookresearch/fairseq/blob/main/scripts/average_checkpoints.py
+      Averages the state_dicts of the checkpoints one at a time. Each checkpoint is
+      memory-mapped when torch supports it, so only the tensor being added is paged in,
+      and it is accumulated in place into a float64 buffer. Otherwise, at most one
+      checkpoint is in memory along with the buffers. Integer buffers (e.g. num_batches_tracked) are
+      accumulated as int64 and floor-divided, as FairSeq does.
     """
-    average_model = {}
+    average_state = OrderedDict()
+    dtypes = {}
     for checkpoint_path in checkpoint_paths:
-        model = torch.load(checkpoint_path, map_location=torch.device('cpu'))
+        checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'), weights_only=True, **_MMAP_LOAD)
+
+        for k, p in checkpoint.items():
+            if k not in average_state:
+                dtypes[k] = p.dtype
+                average_state[k] = torch.zeros(p.shape, dtype=torch.float64 if p.is_floating_point() else torch.int64)
+            average_state[k].add_(p)
 
-        model_keys = list(model.keys())
-        for k in model_keys:
-            p = model[k]
-            if average_model.get(k) is None:
-                average_model[k] = p.clone()
-            else:
-                average_model[k] += p.clone()
+        del checkpoint
 
     nmodels = len(checkpoint_paths)
-    for k, v in average_model.items():
-        average_model[k] = torch.div(v, nmodels)
+    for k, v in average_state.items():
+        if v.is_floating_point():
+            average_state[k] = v.div_(nmodels).to(dtypes[k])
+        else:
+            average_state[k] = v.floor_divide_(nmodels).to(dtypes[k])
+
+    return average_state
+
+def average_model(e2e, checkpoint_paths):
+    """
+      Code based on the implentation publicly released by FairSeq.
+        https://github.com/facebookresearch/fairseq/blob/main/scripts/average_checkpoints.py
+    """
+    e2e.load_state_dict(average_checkpoints(checkpoint_paths))
 
-    e2e.load_state_dict(average_model)
+def best_checkpoints(val_stats_path, nbest):
+    """
+      Paths of the nbest checkpoints of a val_stats.csv, ranked by WER and then CER when
+      available (as written by the validation sweeps), or by CER (as written by save_val_stats).
+    """
+    val_stats = pd.read_csv(val_stats_path, delimiter=",")
+    metrics = [metric for metric in ["wer", "cer"] if metric in val_stats.columns]
+    val_stats = val_stats.sort_values(by=metrics, kind="stable")
+
+    return val_stats[:nbest]["model_check_path"].tolist()
 
 def set_bn_eval(module):
     if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
@@ -120,13 +149,20 @@ def freeze_e2e(e2e, modules, config):
     else:
         print("The entire E2E system will be trained")
 
-def save_model(output_dir, model, suffix):
+def save_model(output_dir, model, suffix, writer=None):
+    return save_state_dict(output_dir, model.state_dict(), suffix, writer)
+
+def save_state_dict(output_dir, state_dict, suffix, writer=None):
     dst_root = output_dir + "/models/"
 
     os.makedirs(dst_root, exist_ok=True)
     dst_path = os.path.join(dst_root, "model_" + suffix + ".pth")
     print(f"Saving model in {dst_path} ...")
-    torch.save(model.state_dict(), dst_path)
+    if writer is not None:
+        # -- written in the background by an AsyncCheckpointWriter
+        writer.save(state_dict, dst_path, kind="model")
+    else:
+        torch.save(state_dict, dst_path)
 
     return dst_path
 
@@ -0,0 +1,176 @@
+import os
+import csv
+import json
+import time
+import contextlib
+from collections import defaultdict
+import torch
+
+class TrainingProfiler:
+    """
+      Per-step telemetry of the training, written as one record per micro-batch to a JSONL or CSV file.
+
+      Each record holds the time spent in every stage of the step: waiting for the data, copying it to the
+      device, frontend, encoder, CTC, InterCTC, MLM decoder, backward and optimizer step, along with the
+      utterances and audio seconds per second, the padding ratio of the batch and the peak device memory.
+      On GPU, the stages are timed with CUDA events and the device is synchronized at the end of every step
+      to read them, so profiling slows the training down a little and is meant for measurement runs.
+      Optionally, a 'trace_window' of [wait, warmup, active] steps is also traced with torch.profiler into
+      'trace_dir', which can be opened with TensorBoard.
+    """
+
+    STAGES = ["data_wait", "h2d_copy", "frontend", "encoder", "ctc", "interctc", "mlm_decoder", "backward", "optimizer"]
+
+    def __init__(self, output_path, device, fs=16000, trace_window=None, trace_dir=None):
+        self.device = torch.device(device)
+        self.use_cuda = self.device.type == 'cuda'
+        self.fs = fs
+        self.file_format = 'csv' if output_path.endswith('.csv') else 'jsonl'
+
+        # -- records are appended, so a resumed training keeps the ones of the interrupted run
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, 'a', newline='')
+        self.csv_writer = None
+        if self.file_format == 'csv':
+            fieldnames = ['epoch', 'step', 'utterances', 'audio_seconds', 'step_seconds', 'utterances_per_second', 'audio_seconds_per_second', 'padding_ratio', 'peak_memory_mb'] + [f'{stage}_ms' for stage in self.STAGES]
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            if write_header:
+                self.csv_writer.writeheader()
+
+        self.cpu_times = defaultdict(float)
+        self.cuda_events = defaultdict(list)
+        self.step_start = time.perf_counter()
+        self.epoch_totals = defaultdict(float)
+        self.epoch = None
+
+        # -- torch.profiler trace of [wait, warmup, active] steps
+        self.torch_profiler = None
+        if trace_window is not None:
+            wait, warmup, active = trace_window
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.use_cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.torch_profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir),
+                profile_memory=True,
+            )
+            self.torch_profiler.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, stream=None):
+        """
+          Times a stage of the current step, on the given CUDA stream (the current one by default) when training on GPU.
+        """
+        label = torch.profiler.record_function(name) if self.torch_profiler is not None else contextlib.nullcontext()
+        with label:
+            if not self.use_cuda:
+                start = time.perf_counter()
+                yield
+                self.cpu_times[name] += time.perf_counter() - start
+                return
+
+            start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            start.record(stream)
+            yield
+            end.record(stream)
+            self.cuda_events[name].append((start, end))
+
+    def start(self, epoch):
+        """
+          Starts timing the steps of an epoch, discarding what was timed before, e.g. during the validation.
+        """
+        self.epoch = epoch
+        if self.use_cuda:
+            torch.cuda.synchronize(self.device)
+        self.cpu_times.clear()
+        self.cuda_events.clear()
+        self.step_start = time.perf_counter()
+
+    def data_wait(self, batches):
+        """
+          Iterates over the batches, timing how long the training waits for each of them.
+        """
+        batches = iter(batches)
+        while True:
+            start = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                return
+            self.cpu_times['data_wait'] += time.perf_counter() - start
+            yield batch
+
+    def end_step(self, batch, step):
+        """
+          Writes the record of a step, given its host batch.
+        """
+        if self.use_cuda:
+            torch.cuda.synchronize(self.device)
+        step_seconds = time.perf_counter() - self.step_start
+
+        stage_ms = {f'{stage}_ms': 1000.0 * self.cpu_times.get(stage, 0.0) for stage in self.STAGES}
+        for stage, events in self.cuda_events.items():
+            stage_ms[f'{stage}_ms'] += sum(start.elapsed_time(end) for start, end in events)
+
+        speech_lengths = batch['speech_lengths']
+        n_utts = len(batch['sample_id'])
+        audio_seconds = float(speech_lengths.sum()) / self.fs
+        padded_seconds = n_utts * float(speech_lengths.max()) / self.fs
+        peak_memory_mb = None
+        if self.use_cuda:
+            peak_memory_mb = torch.cuda.max_memory_allocated(self.device) / 2**20
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+        record = {
+            'epoch': self.epoch,
+            'step': step,
+            'utterances': n_utts,
+            'audio_seconds': round(audio_seconds, 3),
+            'step_seconds': round(step_seconds, 6),
+            'utterances_per_second': round(n_utts / step_seconds, 3),
+            'audio_seconds_per_second': round(audio_seconds / step_seconds, 3),
+            # -- share of the padded speech samples that are padding
+            'padding_ratio': round(1.0 - audio_seconds / padded_seconds, 4),
+            'peak_memory_mb': round(peak_memory_mb, 1) if peak_memory_mb is not None else None,
+            **{key: round(value, 3) for key, value in stage_ms.items()},
+        }
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+        self.epoch_totals['utterances'] += n_utts
+        self.epoch_totals['audio_seconds'] += audio_seconds
+        self.epoch_totals['padded_seconds'] += padded_seconds
+        self.epoch_totals['seconds'] += step_seconds
+
+        self.cpu_times.clear()
+        self.cuda_events.clear()
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+        self.step_start = time.perf_counter()
+
+    def epoch_summary(self):
+        """
+          Throughput of the steps since the last summary, as a printable string.
+        """
+        seconds = max(self.epoch_totals['seconds'], 1e-9)
+        padding_ratio = 1.0 - self.epoch_totals['audio_seconds'] / max(self.epoch_totals['padded_seconds'], 1e-9)
+        summary = f"{self.epoch_totals['utterances'] / seconds:.2f} utterances/s | {self.epoch_totals['audio_seconds'] / seconds:.2f} audio-s/s | padding {100.0 * padding_ratio:.1f}%"
+        self.epoch_totals.clear()
+        return summary
+
+    def close(self):
+        if self.torch_profiler is not None:
+            self.torch_profiler.stop()
+            self.torch_profiler = None
+        self.file.close()
+
+def profile_stage(timer, name, **kwargs):
+    """
+      Stage 'name' of an optional TrainingProfiler, or a no-op when there is none.
+    """
+    return timer.stage(name, **kwargs) if timer is not None else contextlib.nullcontext()
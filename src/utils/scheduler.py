@@ -43,11 +43,3 @@ def set_optimizer(config, e2e, train_loader):
         raise RuntimeError("The scheduler should be specified as 'noam' or 'onecycle'")
 
     return optimizer, scheduler
-
-def save_optimizer(args, optimizer, epoch):
-    dst_root = os.path.join(args.output_dir, "optimizer")
-
-    os.makedirs(dst_root, exist_ok=True)
-    dst_path = os.path.join(dst_root, "optimizer_" + str(epoch).zfill(3) + ".pth")
-    print(f"Saving optimizer in {dst_path} ...")
-    torch.save(optimizer.state_dict(), dst_path)
@@ -0,0 +1,59 @@
+import os
+import random
+import numpy as np
+import torch
+
+def get_rng_state():
+    """
+      States of the python, numpy and torch (CPU and CUDA) random number generators.
+    """
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def save_training_state(output_dir, e2e, optimizer, scheduler, scaler, progress, writer=None):
+    """
+      Saves everything needed to resume the training in 'training_state.pth', overwriting the previous one:
+      the model, the optimizer (the Noam scheduler included), the scheduler, the AMP scaler and
+      the 'progress' of the training, i.e. its epoch, batch, sampler and RNG states.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    dst_path = os.path.join(output_dir, "training_state.pth")
+    state = {
+        "model": e2e.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict() if scheduler is not None else None,
+        "scaler": scaler.state_dict() if scaler is not None else None,
+        **progress,
+    }
+    if writer is not None:
+        # -- written in the background by an AsyncCheckpointWriter
+        writer.save(state, dst_path, kind="training_state")
+    else:
+        tmp_path = dst_path + ".tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, dst_path)
+
+    return dst_path
+
+def load_training_state(state_path):
+    # -- the RNG states are not tensors, so the file is loaded as a whole
+    return torch.load(state_path, map_location=torch.device('cpu'), weights_only=False)
+
+def restore_training_state(state, e2e, optimizer, scheduler, scaler):
+    e2e.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    if scheduler is not None and state["scheduler"] is not None:
+        scheduler.load_state_dict(state["scheduler"])
+    if scaler is not None and state["scaler"] is not None:
+        scaler.load_state_dict(state["scaler"])
@@ -0,0 +1,131 @@
+import pytest
+import torch
+
+from src.utils.accumulation import GradientAccumulator
+from src.utils.asr_dataloader import split_batch
+
+def make_batch(n_utts, max_tokens, seed):
+    # -- utterances of different numbers of target tokens, each token being a regression target
+    generator = torch.Generator().manual_seed(seed)
+    text_lengths = torch.randint(1, max_tokens + 1, (n_utts,), generator=generator)
+    return {
+        'sample_id': [f'utt{i}' for i in range(n_utts)],
+        'speech': torch.randn(n_utts, max_tokens, 4, generator=generator),
+        'speech_lengths': text_lengths.clone(),
+        'text': torch.randn(n_utts, max_tokens, generator=generator),
+        'text_lengths': text_lengths,
+    }
+
+def token_mean_loss(model, batch):
+    # -- like the ASR losses, a mean over the tokens of the micro-batch
+    mask = torch.arange(batch['text'].shape[1])[None, :] < batch['text_lengths'][:, None]
+    errors = (model(batch['speech']).squeeze(-1) - batch['text']) ** 2
+    return (errors * mask).sum() / mask.sum()
+
+def make_model():
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 1)
+    return model, torch.optim.SGD(model.parameters(), lr=0.1)
+
+def accumulated_step(micro_batches, weighting):
+    model, optimizer = make_model()
+    accumulator = GradientAccumulator(model, optimizer, None, len(micro_batches), len(micro_batches), weighting=weighting)
+    for batch_idx, batch in enumerate(micro_batches):
+        accumulator.backward(token_mean_loss(model, batch), accumulator.weight(batch))
+        if accumulator.is_update(batch_idx):
+            accumulator.step()
+    return model, accumulator
+
+def full_batch_step(batch):
+    model, optimizer = make_model()
+    loss = token_mean_loss(model, batch)
+    loss.backward()
+    optimizer.step()
+    return model, loss.item()
+
+def test_token_weighted_accumulation_matches_a_full_batch_step():
+    micro_batches = [make_batch(n_utts, 8, seed) for seed, n_utts in enumerate([3, 1, 5])]
+    full_batch = {
+        key: sum(values, []) if key == 'sample_id' else torch.cat(values)
+        for key, values in zip(micro_batches[0], zip(*[batch.values() for batch in micro_batches]))
+    }
+
+    model, accumulator = accumulated_step(micro_batches, 'tokens')
+    reference, reference_loss = full_batch_step(full_batch)
+
+    for param, reference_param in zip(model.parameters(), reference.parameters()):
+        assert torch.allclose(param, reference_param, atol=1e-6)
+    assert accumulator.average_loss() == pytest.approx(reference_loss, rel=1e-6)
+
+def test_batch_weighted_accumulation_averages_the_micro_batch_losses():
+    micro_batches = [make_batch(n_utts, 8, seed) for seed, n_utts in enumerate([3, 1, 5])]
+
+    model, accumulator = accumulated_step(micro_batches, 'batches')
+    reference, optimizer = make_model()
+    (sum(token_mean_loss(reference, batch) for batch in micro_batches) / len(micro_batches)).backward()
+    optimizer.step()
+
+    for param, reference_param in zip(model.parameters(), reference.parameters()):
+        assert torch.allclose(param, reference_param, atol=1e-6)
+
+def test_split_micro_batch_matches_the_whole_one():
+    # -- retrying a micro-batch as two halves, as done when it runs out of memory
+    batch = make_batch(6, 8, seed=0)
+
+    model, accumulator = accumulated_step([batch], 'tokens')
+    split_model, optimizer = make_model()
+    split_accumulator = GradientAccumulator(split_model, optimizer, None, 1, 1, weighting='tokens')
+    weight = split_accumulator.weight(batch)
+    for part in split_batch(batch):
+        split_accumulator.backward(token_mean_loss(split_model, part), split_accumulator.part_weight(part, batch, weight))
+    split_accumulator.step()
+
+    for param, split_param in zip(model.parameters(), split_model.parameters()):
+        assert torch.allclose(param, split_param, atol=1e-6)
+    assert split_accumulator.weight_sum == pytest.approx(accumulator.weight_sum)
+
+@pytest.mark.parametrize('weighting', ['tokens', 'batches'])
+def test_weights_of_the_parts_add_up_to_the_micro_batch(weighting):
+    batch = make_batch(5, 8, seed=0)
+    model, optimizer = make_model()
+    accumulator = GradientAccumulator(model, optimizer, None, 1, 1, weighting=weighting)
+    weight = accumulator.weight(batch)
+
+    assert sum(accumulator.part_weight(part, batch, weight) for part in split_batch(batch)) == pytest.approx(weight)
+
+def test_reset_discards_the_partial_gradients_of_the_step():
+    batch = make_batch(4, 8, seed=0)
+    model, optimizer = make_model()
+    accumulator = GradientAccumulator(model, optimizer, None, 1, 1)
+    accumulator.backward(token_mean_loss(model, batch), accumulator.weight(batch))
+
+    assert accumulator.reset() == 1
+    assert accumulator.step_weight == 0.0
+    assert all(param.grad is None or not param.grad.any() for param in model.parameters())
+
+def test_reset_discards_the_losses_of_the_step():
+    previous, discarded, kept = [make_batch(n_utts, 8, seed) for seed, n_utts in enumerate([2, 3, 4])]
+    model, optimizer = make_model()
+    accumulator = GradientAccumulator(model, optimizer, None, 2, 4)
+
+    # -- a first step, then one whose first micro-batch is discarded, e.g. after running out of memory
+    for batch in [previous, previous]:
+        accumulator.backward(token_mean_loss(model, batch), accumulator.weight(batch))
+    accumulator.step()
+    accumulator.backward(token_mean_loss(model, discarded), accumulator.weight(discarded))
+    assert accumulator.reset() == 1
+    accumulator.backward(token_mean_loss(model, kept), accumulator.weight(kept))
+    accumulator.step()
+
+    # -- same update and running loss as if the discarded micro-batch had never been seen
+    reference, reference_optimizer = make_model()
+    reference_accumulator = GradientAccumulator(reference, reference_optimizer, None, 2, 4)
+    for batch in [previous, previous]:
+        reference_accumulator.backward(token_mean_loss(reference, batch), reference_accumulator.weight(batch))
+    reference_accumulator.step()
+    reference_accumulator.backward(token_mean_loss(reference, kept), reference_accumulator.weight(kept))
+    reference_accumulator.step()
+
+    for param, reference_param in zip(model.parameters(), reference.parameters()):
+        assert torch.allclose(param, reference_param, atol=1e-6)
+    assert accumulator.state() == pytest.approx(reference_accumulator.state())
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+import torch
+from torch.utils import data
+
+from src.utils.asr_dataloader import DistributedBatchSampler, LengthBucketBatchSampler, ResumableBatchSampler, split_batch
+
+# -- length-bucketed batches
+
+def test_length_bucket_batches_cover_the_dataset_once():
+    lengths = np.random.RandomState(0).rand(100) * 10
+    sampler = LengthBucketBatchSampler(lengths, 40.0, seed=0)
+
+    indices = sorted(index for batch in sampler for index in batch)
+    assert indices == list(range(100))
+
+def test_length_bucket_batches_respect_the_padded_budget():
+    lengths = np.random.RandomState(0).rand(100) * 10
+    sampler = LengthBucketBatchSampler(lengths, 40.0, seed=0)
+
+    for batch in sampler:
+        assert len(batch) == 1 or lengths[batch].max() * len(batch) <= 40.0
+
+def test_length_bucket_batches_group_similar_lengths():
+    lengths = np.arange(20, dtype=np.float64)
+    sampler = LengthBucketBatchSampler(lengths, 40.0, shuffle=False)
+
+    # -- sorted by decreasing length, so every batch is a run of consecutive lengths
+    for batch in sampler:
+        assert sorted(batch) == list(range(min(batch), max(batch) + 1))
+
+def test_length_bucket_shuffling_is_seeded():
+    lengths = np.random.RandomState(0).rand(50) * 10
+    first = list(LengthBucketBatchSampler(lengths, 20.0, seed=3))
+    second = list(LengthBucketBatchSampler(lengths, 20.0, seed=3))
+
+    assert first == second
+
+def test_length_bucket_batches_respect_the_token_budget():
+    rng = np.random.RandomState(0)
+    lengths, token_lengths = rng.rand(100) * 10, rng.randint(1, 50, 100)
+    sampler = LengthBucketBatchSampler(lengths, 1000.0, seed=0, token_lengths=token_lengths, max_batch_tokens=100)
+
+    assert sorted(index for batch in sampler for index in batch) == list(range(100))
+    for batch in sampler:
+        assert len(batch) == 1 or token_lengths[batch].max() * len(batch) <= 100
+
+# -- resuming mid-epoch
+
+def random_batch_sampler(n_samples, batch_size, seed):
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    batch_sampler = data.BatchSampler(data.RandomSampler(range(n_samples), generator=generator), batch_size, drop_last=False)
+    return ResumableBatchSampler(batch_sampler, generator)
+
+def length_bucket_batch_sampler(n_samples, batch_size, seed):
+    # -- the dataset does not depend on the seed, only the shuffling does
+    lengths = np.random.RandomState(0).rand(n_samples) * 10
+    batch_sampler = LengthBucketBatchSampler(lengths, 10.0 * batch_size, seed=seed)
+    return ResumableBatchSampler(batch_sampler, batch_sampler.generator)
+
+@pytest.mark.parametrize('build_sampler', [random_batch_sampler, length_bucket_batch_sampler])
+@pytest.mark.parametrize('start_batch', [0, 1, 4])
+def test_resumed_epoch_follows_the_interrupted_order(build_sampler, start_batch):
+    sampler = build_sampler(30, 4, seed=0)
+    list(sampler) # -- a previous epoch, so the state is not the initial one
+    epoch_state = sampler.state_dict()
+    interrupted = list(sampler)
+    next_epoch = list(sampler)
+
+    # -- a new process, e.g. after a crash, restoring the state saved at the start of the epoch
+    resumed = build_sampler(30, 4, seed=1)
+    resumed.load_state_dict(epoch_state)
+    resumed.start_batch = start_batch
+
+    assert list(resumed) == interrupted[start_batch:]
+    assert list(resumed) == next_epoch
+
+def test_start_batch_only_applies_to_one_epoch():
+    sampler = random_batch_sampler(30, 4, seed=0)
+    sampler.start_batch = 3
+
+    assert len(list(sampler)) == len(sampler) - 3
+    assert sampler.start_batch == 0
+    assert len(list(sampler)) == len(sampler)
+
+# -- sharding across processes
+
+@pytest.mark.parametrize('num_replicas', [2, 3])
+def test_distributed_shards_partition_the_batches(num_replicas):
+    lengths = np.random.RandomState(0).rand(100) * 10
+    batches = list(LengthBucketBatchSampler(lengths, 40.0, seed=0))
+    shards = [list(DistributedBatchSampler(LengthBucketBatchSampler(lengths, 40.0, seed=0), num_replicas, rank)) for rank in range(num_replicas)]
+
+    # -- same number of steps in every process, the last batches being dropped when needed
+    n_steps = len(batches) // num_replicas
+    assert all(len(shard) == n_steps for shard in shards)
+    assert sorted(batch for shard in shards for batch in shard) == sorted(batches[:n_steps * num_replicas])
+
+def test_distributed_shards_keep_the_shuffling_in_sync():
+    lengths = np.random.RandomState(0).rand(100) * 10
+    shared = LengthBucketBatchSampler(lengths, 40.0, seed=0)
+    reference = LengthBucketBatchSampler(lengths, 40.0, seed=0)
+    sampler = DistributedBatchSampler(shared, 4, 1)
+
+    # -- every epoch draws all the batches, so the generator of each process follows the same sequence
+    for _ in range(3):
+        assert list(sampler) == list(reference)[1::4][:len(sampler)]
+
+# -- splitting batches that run out of memory
+
+def test_split_batch_trims_each_half_to_its_longest_sequence():
+    speech_lengths = torch.tensor([3, 9, 2, 4, 5])
+    text_lengths = torch.tensor([1, 2, 1, 2, 3])
+    batch = {
+        'sample_id': ['a', 'b', 'c', 'd', 'e'],
+        'speech': torch.randn(5, 9, 1),
+        'speech_lengths': speech_lengths,
+        'text': torch.randn(5, 3),
+        'text_lengths': text_lengths,
+        'ref': ['a', 'b', 'c', 'd', 'e'],
+    }
+    first, second = split_batch(batch)
+
+    assert first['sample_id'] == ['a', 'b'] and second['ref'] == ['c', 'd', 'e']
+    assert first['speech'].shape == (2, 9, 1) and second['speech'].shape == (3, 5, 1)
+    assert first['text'].shape == (2, 2) and second['text'].shape == (3, 3)
+    assert torch.equal(torch.cat([first['speech_lengths'], second['speech_lengths']]), speech_lengths)
+    assert torch.equal(second['speech'], batch['speech'][2:, :5])
@@ -0,0 +1,36 @@
+import numpy as np
+
+from src.evaluation import bootstrap_error_rates, bootstrap_interval
+
+def test_seeded_resamples_are_deterministic():
+    rng = np.random.RandomState(0)
+    errors, lengths = rng.randint(0, 5, 200), rng.randint(5, 20, 200)
+
+    first = bootstrap_error_rates(errors, lengths, n_replicates=100, seed=1)
+    second = bootstrap_error_rates(errors, lengths, n_replicates=100, seed=1)
+    assert first.shape == (100,)
+    assert np.array_equal(first, second)
+
+def test_resamples_are_centred_on_the_error_rate():
+    rng = np.random.RandomState(0)
+    errors, lengths = rng.randint(0, 5, 500), rng.randint(5, 20, 500)
+
+    rates = bootstrap_error_rates(errors, lengths, n_replicates=2000, seed=0)
+    assert abs(rates.mean() - 100.0 * errors.sum() / lengths.sum()) < 0.1
+
+def test_resamples_match_a_per_utterance_bootstrap():
+    rng = np.random.RandomState(0)
+    errors, lengths = rng.randint(0, 5, 300), rng.randint(5, 20, 300)
+
+    # -- resampling the utterances one by one, as tasasIntervalo does
+    draws = np.random.default_rng(0).integers(0, 300, size=(4000, 300))
+    naive = 100.0 * errors[draws].sum(axis=1) / lengths[draws].sum(axis=1)
+    rates = bootstrap_error_rates(errors, lengths, n_replicates=4000, seed=0)
+    assert abs(rates.std() - naive.std()) < 0.1 * naive.std()
+
+def test_identical_utterances_give_an_empty_interval():
+    assert bootstrap_interval([2] * 50, [10] * 50, seed=0) == 0.0
+
+def test_no_utterances_give_zero_rates():
+    assert np.array_equal(bootstrap_error_rates([], [], n_replicates=10), np.zeros(10))
+    assert bootstrap_interval([], []) == 0.0
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from src.evaluation import ErrorRateAccumulator, edit_distance
+
+def reference_edit_distance(ref, hyp):
+    # -- textbook Levenshtein DP, one row at a time
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        previous, row = row, [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            row[j] = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + (r != h))
+    return row[-1]
+
+@pytest.mark.parametrize('max_length', [5, 63, 64, 65, 200])
+def test_edit_distance_matches_the_dp(max_length):
+    rng = random.Random(max_length)
+    for _ in range(200):
+        # -- a small alphabet, so that there are many matches to align
+        ref = [rng.choice('abcd') for _ in range(rng.randint(0, max_length))]
+        hyp = [rng.choice('abcd') for _ in range(rng.randint(0, max_length))]
+        assert edit_distance(ref, hyp) == reference_edit_distance(ref, hyp)
+
+def test_edit_distance_of_empty_sequences():
+    assert edit_distance([], []) == 0
+    assert edit_distance([], ['a', 'b']) == 2
+    assert edit_distance(['a', 'b', 'c'], []) == 3
+
+def test_edit_distance_of_words_and_bytes():
+    assert edit_distance(['kaixo', 'mundua'], ['kaixo', 'munduan', 'bai']) == 2
+    assert edit_distance('ñu'.encode('utf-8'), 'nu'.encode('utf-8')) == 2
+
+def test_accumulator_counts_words_and_bytes():
+    accumulator = ErrorRateAccumulator()
+
+    assert accumulator.add('hola que tal', 'hola  tal') == (1, 3)
+    assert accumulator.add('egun on', 'egun on') == (0, 0)
+    assert len(accumulator) == 2
+    assert accumulator.wer == round(100.0 * 1 / 5, 6)
+    assert accumulator.cer == round(100.0 * 3 / 19, 6)
+
+def test_accumulators_of_shards_are_merged():
+    utterances = [('hola que tal', 'hola tal'), ('egun on', 'egun one'), ('bai', 'ez')]
+    whole, first, second = ErrorRateAccumulator(), ErrorRateAccumulator(), ErrorRateAccumulator()
+    for i, (ref, hyp) in enumerate(utterances):
+        whole.add(ref, hyp)
+        (first if i < 1 else second).add(ref, hyp)
+    first.update(second)
+
+    assert len(first) == len(whole)
+    assert (first.wer, first.cer) == (whole.wer, whole.cer)
+    assert first.summary(seed=0) == whole.summary(seed=0)
+
+def test_empty_accumulator():
+    assert ErrorRateAccumulator().summary(seed=0) == (0.0, 0.0, 0.0, 0.0)
@@ -0,0 +1,87 @@
+import pytest
+import torch
+from espnet2.asr.ctc import CTC
+from espnet2.asr.frontend.default import DefaultFrontend
+
+from src.encoder.my_branchformer.encoder import MyBranchformerEncoder
+from src.inference.asr_inference_streaming import Speech2TextStreaming
+
+def make_encoder(interctc_use_conditioning):
+    torch.manual_seed(0)
+    encoder = MyBranchformerEncoder(
+        input_size=20,
+        output_size=32,
+        attention_heads=2,
+        linear_units=64,
+        num_blocks=2,
+        cgmlp_linear_units=64,
+        cgmlp_conv_kernel=7,
+        input_layer="conv2d",
+        interctc_use_conditioning=interctc_use_conditioning,
+        interctc_layer_idx=[1] if interctc_use_conditioning else [],
+    )
+    ctc = CTC(odim=10, encoder_output_size=32)
+    if interctc_use_conditioning:
+        encoder.conditioning_layer = torch.nn.Linear(10, 32)
+    return encoder.eval(), ctc.eval()
+
+# -- blockwise encoder
+
+@pytest.mark.parametrize('interctc_use_conditioning', [False, True])
+def test_single_chunk_matches_the_offline_encoder(interctc_use_conditioning):
+    encoder, ctc = make_encoder(interctc_use_conditioning)
+    feats = torch.randn(1, 83, 20)
+
+    with torch.no_grad():
+        offline = encoder(feats, torch.tensor([83]), ctc=ctc)[0]
+        if isinstance(offline, tuple):
+            offline = offline[0]
+        streamed, states = encoder.forward_infer(feats, is_final=True, ctc=ctc, left_context=1000)
+
+    assert states is None
+    assert streamed.shape == offline.shape
+    assert torch.allclose(streamed, offline, atol=1e-5)
+
+def test_chunks_give_as_many_frames_as_the_offline_encoder():
+    encoder, ctc = make_encoder(False)
+    feats = torch.randn(1, 83, 20)
+
+    with torch.no_grad():
+        offline = encoder(feats, torch.tensor([83]))[0]
+        states, outputs = None, []
+        # -- chunks that do not align with the subsampling windows, so frames are buffered across calls
+        for start in range(0, 83, 13):
+            out, states = encoder.forward_infer(feats[:, start:start + 13], prev_states=states, is_final=start + 13 >= 83, left_context=8)
+            outputs.append(out)
+
+    assert states is None
+    # -- the values differ, as the chunks do not see the frames that follow them
+    assert torch.cat(outputs, dim=1).shape == offline.shape
+    assert torch.isfinite(torch.cat(outputs, dim=1)).all()
+
+# -- streaming frontend
+
+def make_streaming_frontend():
+    # -- only the frontend is used by the feature extraction
+    speech2text = Speech2TextStreaming.__new__(Speech2TextStreaming)
+    speech2text.asr_model = torch.nn.Module()
+    speech2text.asr_model.frontend = DefaultFrontend(fs=16000, n_fft=512, win_length=400, hop_length=160, n_mels=20).eval()
+    speech2text.reset()
+    return speech2text
+
+@pytest.mark.parametrize('piece_sizes', [[16000], [100] * 160, [1, 511, 37, 4000, 159, 161, 11131], [7000, 9000]])
+def test_streamed_features_match_the_whole_utterance(piece_sizes):
+    speech2text = make_streaming_frontend()
+    frontend = speech2text.asr_model.frontend
+    speech = torch.randn(sum(piece_sizes))
+
+    with torch.no_grad():
+        offline, _ = frontend(speech.unsqueeze(0), torch.tensor([speech.size(0)]))
+        feats, start = [], 0
+        for i, size in enumerate(piece_sizes):
+            feats.append(speech2text._extract_feats(speech[start:start + size], is_final=i + 1 == len(piece_sizes)))
+            start += size
+    feats = torch.cat(feats, dim=1)
+
+    assert feats.shape == offline.shape
+    assert torch.allclose(feats, offline, atol=1e-4)
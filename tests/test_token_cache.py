@@ -0,0 +1,57 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.datasets import TokenCache, build_token_cache, tokenizer_hash
+
+class CharTokenizer:
+    def text2tokens(self, text):
+        return list(text)
+
+class CharConverter:
+    def tokens2ids(self, tokens):
+        return [ord(token) for token in tokens]
+
+CONFIG = argparse.Namespace(token_type='char', bpemodel=None, token_list=['<blank>', 'a', 'b'])
+
+def write_split(path, rows):
+    pd.DataFrame(rows, columns=['path', 'sentence']).to_csv(path, index=False)
+    return str(path)
+
+def test_token_ids_are_looked_up_by_path(tmp_path):
+    split = write_split(tmp_path / 'split.csv', [
+        ('/es/spk1/0.wav', ' Hola '),
+        ('/eu/spk2/0.wav', 'kaixo'),
+    ])
+    cache = build_token_cache([split], str(tmp_path / 'tokens.npz'), CharTokenizer(), CharConverter(), CONFIG)
+
+    assert len(cache) == 2
+    assert cache.tokenizer_hash == tokenizer_hash(CONFIG)
+    # -- same file name under two directories, with the normalized transcript of each one
+    assert cache.get('/es/spk1/0.wav').tolist() == [ord(c) for c in 'hola']
+    assert cache.get('/eu/spk2/0.wav').tolist() == [ord(c) for c in 'kaixo']
+    assert cache.get('0.wav') is None
+
+def test_repeated_paths_with_the_same_transcript_are_merged(tmp_path):
+    train = write_split(tmp_path / 'train.csv', [('/a.wav', 'ab')])
+    dev = write_split(tmp_path / 'dev.csv', [('/a.wav', 'AB ')])
+    cache = build_token_cache([train, dev], str(tmp_path / 'tokens.npz'), CharTokenizer(), CharConverter(), CONFIG)
+
+    assert len(cache) == 1
+    assert TokenCache(str(tmp_path / 'tokens.npz')).get('/a.wav').tolist() == [ord('a'), ord('b')]
+
+def test_conflicting_transcripts_are_rejected(tmp_path):
+    train = write_split(tmp_path / 'train.csv', [('/a.wav', 'ab')])
+    dev = write_split(tmp_path / 'dev.csv', [('/a.wav', 'ba')])
+
+    with pytest.raises(ValueError):
+        build_token_cache([train, dev], str(tmp_path / 'tokens.npz'), CharTokenizer(), CharConverter(), CONFIG)
+
+def test_caches_keyed_by_sample_id_are_rejected(tmp_path):
+    cache_path = str(tmp_path / 'old.npz')
+    np.savez(cache_path, sample_ids=np.array(['a.wav']), offsets=np.array([0, 1]), token_ids=np.array([1], dtype=np.int32), tokenizer_hash=np.array('x'))
+
+    with pytest.raises(ValueError):
+        TokenCache(cache_path)
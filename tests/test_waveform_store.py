@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+import torch
+
+import src.datasets.waveform_store as waveform_store
+from src.datasets import WaveformStore, pack_waveforms
+
+WAVEFORMS = {
+    '/data/a.wav': torch.tensor([[0.0, 0.5, -0.5, 0.25]]),
+    '/data/b.wav': torch.tensor([[0.125, -1.0]]),
+}
+
+@pytest.fixture
+def split_path(tmp_path, monkeypatch):
+    # -- decoding is not under test, so the waveforms are served from memory
+    monkeypatch.setattr(waveform_store.torchaudio, 'load', lambda path, normalize=True: (WAVEFORMS[path].clone(), 16000))
+
+    split_path = tmp_path / 'split.csv'
+    pd.DataFrame({'path': ['/data/a.wav', '/data/b.wav', '/data/a.wav']}).to_csv(split_path, index=False)
+    return str(split_path)
+
+@pytest.mark.parametrize('dtype', ['int16', 'float16', 'float32'])
+def test_packed_waveforms_are_read_back(tmp_path, split_path, dtype):
+    store = pack_waveforms([split_path], str(tmp_path / 'store'), dtype=dtype)
+
+    assert len(store) == 2
+    assert store.sample_rate == 16000
+    for path, waveform in WAVEFORMS.items():
+        assert path in store
+        assert store[path].shape == waveform.shape
+        assert torch.allclose(store[path], waveform, atol=1e-4)
+
+def test_store_is_reopened_from_disk(tmp_path, split_path):
+    pack_waveforms([split_path], str(tmp_path / 'store'))
+    store = WaveformStore(str(tmp_path / 'store'))
+
+    assert '/data/c.wav' not in store
+    assert torch.allclose(store['/data/b.wav'], WAVEFORMS['/data/b.wav'], atol=1e-4)